@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+'''A local stand-in for a WordPress blog's XML-RPC interface.
+
+Implements the methods WordPressClient uses (metaWeblog.*, wp.getTerms,
+wp.newCategory, blogger.* and the rest), keeping posts, terms and
+uploads in memory, so that rst2wp can be timed without touching a
+real blog. Every HTTP request can be made to take a little longer, to
+stand in for the network and PHP, and the blog can start out with
+however many tags and categories you like.
+
+Used by benchmarks/scenarios.py, but can also be run on its own:
+
+    python benchmarks/fakewordpress.py [--port 8000] [--latency 0.05] [--tags 10000]
+
+and pointed at from a wordpressrc with
+url = http://127.0.0.1:8000/xmlrpc.php and blog_id = 1.
+'''
+from __future__ import print_function
+import argparse
+import collections
+import socketserver
+import threading
+import time
+import xmlrpc.client
+import xmlrpc.server
+
+EPOCH = xmlrpc.client.DateTime('20200101T00:00:00')
+
+
+def term(id, name, taxonomy, count=0):
+    return {'term_id': str(id), 'name': name, 'slug': name.lower().replace(' ', '-'),
+            'term_group': '0', 'term_taxonomy_id': str(id), 'taxonomy': taxonomy,
+            'description': '', 'parent': '0', 'count': str(count)}
+
+
+class Handler(xmlrpc.server.SimpleXMLRPCRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    rpc_paths = ('/xmlrpc.php', '/RPC2')
+
+    def do_POST(self):
+        blog = self.server.blog
+        with blog.lock:
+            blog.requests += 1
+            blog.bytes_received += int(self.headers.get('Content-Length', 0))
+        if blog.latency:
+            time.sleep(blog.latency)
+        xmlrpc.server.SimpleXMLRPCRequestHandler.do_POST(self)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(socketserver.ThreadingMixIn, xmlrpc.server.SimpleXMLRPCServer):
+    daemon_threads = True
+
+    def _dispatch(self, method, params):
+        with self.blog.lock:
+            self.blog.calls[method] += 1
+        return xmlrpc.server.SimpleXMLRPCServer._dispatch(self, method, params)
+
+
+class FakeWordPress(object):
+    def __init__(self, latency=0.0, tags=0, categories=1, multicall=True,
+                 host='127.0.0.1', port=0):
+        '''A blog with the given numbers of tags and categories. Every
+        request takes at least latency seconds.'''
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.posts = {}
+        self.terms = {'post_tag': [], 'category': []}
+        self._next_id = 1
+        for i in range(categories):
+            self._add_term('category', 'Uncategorized' if i == 0 else 'category{0:05d}'.format(i))
+        for i in range(tags):
+            self._add_term('post_tag', 'tag{0:05d}'.format(i), count=1)
+        self.reset_counts()
+
+        self.server = Server((host, port), Handler, allow_none=True, logRequests=False)
+        self.server.blog = self
+        if multicall:
+            self.server.register_multicall_functions()
+        for name in ['blogger.getUsersBlogs', 'blogger.getUserInfo', 'blogger.deletePost',
+                     'metaWeblog.getPost', 'metaWeblog.getRecentPosts', 'metaWeblog.newPost',
+                     'metaWeblog.editPost', 'metaWeblog.newMediaObject',
+                     'wp.getOptions', 'wp.getTerms', 'wp.newCategory', 'wp.newPage', 'wp.editPage',
+                     'mt.supportedMethods', 'mt.getCategoryList', 'mt.getPostCategories',
+                     'mt.setPostCategories', 'mt.publishPost', 'mt.getTrackbackPings',
+                     'pingback.extensions.getPingbacks']:
+            self.server.register_function(getattr(self, name.replace('.', '_')), name)
+        self.server.register_introspection_functions()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{0}:{1}/xmlrpc.php'.format(host, port)
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counts(self):
+        with self.lock:
+            self.calls = collections.Counter()
+            self.requests = 0
+            self.bytes_received = 0
+
+    def _add_term(self, taxonomy, name, count=0):
+        added = term(self._next_id, name, taxonomy, count)
+        self._next_id += 1
+        self.terms[taxonomy].append(added)
+        return added
+
+    def _find_term(self, taxonomy, name):
+        for t in self.terms[taxonomy]:
+            if t['name'] == name:
+                return t
+
+    # blogger.*
+
+    def blogger_getUsersBlogs(self, appkey, user, password):
+        return [{'blogid': '1', 'blogName': 'Benchmarks', 'isAdmin': True,
+                 'url': self.url.replace('xmlrpc.php', '')}]
+
+    def blogger_getUserInfo(self, appkey, user, password):
+        return {'userid': '1', 'firstname': 'Bench', 'lastname': 'Mark',
+                'nickname': user, 'email': user + '@example.com', 'url': ''}
+
+    def blogger_deletePost(self, appkey, post_id, user, password, publish=False):
+        with self.lock:
+            return self.posts.pop(str(post_id), None) is not None
+
+    # metaWeblog.*
+
+    def _post_struct(self, post_id, content):
+        return {'postid': post_id, 'title': content.get('title', ''),
+                'description': content.get('description', ''),
+                'permaLink': '{0}?p={1}'.format(self.url.replace('xmlrpc.php', ''), post_id),
+                'link': '', 'userid': '1', 'mt_excerpt': content.get('mt_excerpt', ''),
+                'mt_text_more': content.get('mt_text_more', ''), 'mt_allow_comments': 1,
+                'mt_allow_pings': 1, 'mt_keywords': content.get('mt_keywords', ''),
+                'categories': content.get('categories', []),
+                'date_created_gmt': content.get('date_created_gmt', EPOCH),
+                'dateCreated': content.get('date_created_gmt', EPOCH)}
+
+    def _save(self, post_id, content):
+        with self.lock:
+            # Like WordPress, tags that don't exist yet are created
+            for name in content.get('mt_keywords', '').split(','):
+                name = name.strip()
+                if name and not self._find_term('post_tag', name):
+                    self._add_term('post_tag', name, count=1)
+            self.posts[post_id] = content
+
+    def metaWeblog_getPost(self, post_id, user, password):
+        with self.lock:
+            content = self.posts.get(str(post_id))
+        if content is None:
+            raise xmlrpc.client.Fault(404, 'Invalid post ID.')
+        return self._post_struct(str(post_id), content)
+
+    def metaWeblog_getRecentPosts(self, blog_id, user, password, count=10):
+        with self.lock:
+            posts = sorted(self.posts.items(), key=lambda item: -int(item[0]))[:count]
+        return [self._post_struct(post_id, content) for post_id, content in posts]
+
+    def metaWeblog_newPost(self, blog_id, user, password, content, publish):
+        with self.lock:
+            post_id = str(self._next_id)
+            self._next_id += 1
+        self._save(post_id, content)
+        return post_id
+
+    def metaWeblog_editPost(self, post_id, user, password, content, publish):
+        if str(post_id) not in self.posts:
+            raise xmlrpc.client.Fault(404, 'Invalid post ID.')
+        self._save(str(post_id), content)
+        return True
+
+    def metaWeblog_newMediaObject(self, blog_id, user, password, struct):
+        return {'file': struct['name'], 'type': struct.get('type', ''),
+                'url': '{0}wp-content/uploads/{1}'.format(self.url.replace('xmlrpc.php', ''),
+                                                          struct['name'])}
+
+    # wp.*
+
+    def wp_getOptions(self, blog_id, user, password, options=None):
+        return {'software_name': {'desc': 'Software Name', 'readonly': True, 'value': 'WordPress'},
+                'software_version': {'desc': 'Software Version', 'readonly': True, 'value': '6.0'}}
+
+    def wp_getTerms(self, blog_id, user, password, taxonomy, filter=None):
+        if taxonomy not in self.terms:
+            raise xmlrpc.client.Fault(403, 'Invalid taxonomy.')
+        filter = filter or {}
+        with self.lock:
+            found = list(self.terms[taxonomy])
+        if filter.get('search'):
+            search = filter['search'].lower()
+            found = [t for t in found if search in t['name'].lower()]
+        return found
+
+    def wp_newCategory(self, blog_id, user, password, category):
+        with self.lock:
+            existing = self._find_term('category', category['name'])
+            if existing:
+                raise xmlrpc.client.Fault(500, 'The category already exists.')
+            return int(self._add_term('category', category['name'])['term_id'])
+
+    def wp_newPage(self, blog_id, user, password, content, publish):
+        return self.metaWeblog_newPost(blog_id, user, password, content, publish)
+
+    def wp_editPage(self, blog_id, page_id, user, password, content, publish):
+        return self.metaWeblog_editPost(page_id, user, password, content, publish)
+
+    # mt.* and the rest
+
+    def mt_supportedMethods(self):
+        return self.server.system_listMethods()
+
+    def mt_getCategoryList(self, blog_id, user, password):
+        with self.lock:
+            return [{'categoryId': t['term_id'], 'categoryName': t['name']}
+                    for t in self.terms['category']]
+
+    def mt_getPostCategories(self, post_id, user, password):
+        content = self.metaWeblog_getPost(post_id, user, password)
+        return [{'categoryName': name, 'categoryId': '1', 'isPrimary': False}
+                for name in content['categories']]
+
+    def mt_setPostCategories(self, post_id, user, password, categories):
+        return True
+
+    def mt_publishPost(self, post_id, user, password):
+        return 1
+
+    def mt_getTrackbackPings(self, post_id):
+        return []
+
+    def pingback_extensions_getPingbacks(self, url):
+        return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every request')
+    parser.add_argument('--tags', type=int, default=0)
+    parser.add_argument('--categories', type=int, default=1)
+    parser.add_argument('--no-multicall', dest='multicall', action='store_false')
+    args = parser.parse_args()
+
+    blog = FakeWordPress(latency=args.latency, tags=args.tags, categories=args.categories,
+                         multicall=args.multicall, port=args.port)
+    print("Serving a fake WordPress at {0}".format(blog.url))
+    try:
+        blog.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+'''Time utils.replace_newlines against the version it replaced.
+
+Generates HTML bodies like the ones docutils produces for code-heavy
+posts (paragraphs alternating with <pre> blocks) of increasing size,
+runs both versions on each, checks that they agree, and reports the
+best of several runs.
+
+    python benchmarks/replace_newlines.py [--blocks 100,1000,4000] [--repeat 3] [--json FILE]
+'''
+from __future__ import print_function
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from rst2wp import utils
+
+
+def quadratic_replace_newlines(txt):
+    '''replace_newlines before it was rewritten.'''
+    start = 0
+    pre = re.compile("<pre( [^>]*)?>")
+    end_pre = re.compile("</pre>")
+    while True:
+        m = pre.search(txt, start)
+        if not m: break
+        txt = (txt[:start] +
+               txt[start:m.start()].replace('\n', ' ') +
+               txt[m.start():])
+        m = end_pre.search(txt, start)
+        if not m: break
+        start = m.end()
+
+    txt = txt[:start] + txt[start:].replace('\n', ' ')
+    return txt
+
+
+def make_body(blocks):
+    paragraph = '<p>Some text about the\nfunction below, which\ndoes things.</p>\n'
+    code = '<pre class="literal-block">\ndef f(x):\n    return x + 1\n' * 5 + '</pre>\n'
+    return (paragraph + code) * blocks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--blocks', default='100,1000,4000',
+                        help='comma-separated numbers of <pre> blocks')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', metavar='FILE',
+                        help='also write the results to FILE as JSON')
+    args = parser.parse_args()
+
+    results = []
+    print('{0:>8} {1:>10} {2:>14} {3:>14}'.format('blocks', 'size KiB', 'before s', 'after s'))
+    for blocks in [int(b) for b in args.blocks.split(',')]:
+        body = make_body(blocks)
+        if utils.replace_newlines(body) != quadratic_replace_newlines(body):
+            sys.exit("outputs differ for {0} blocks".format(blocks))
+
+        result = {'blocks': blocks, 'size_kib': len(body) / 1024.0}
+        for name, function in [('before', quadratic_replace_newlines),
+                               ('after', utils.replace_newlines)]:
+            result[name] = min(timeit.repeat(lambda: function(body),
+                                             number=1, repeat=args.repeat))
+        results.append(result)
+        print('{blocks:>8} {size_kib:>10.0f} {before:>14.4f} {after:>14.4f}'.format(**result))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+'''Time whole rst2wp runs against a local fake WordPress.
+
+Each scenario writes some posts (and images, and files to upload) to a
+temporary directory, starts a FakeWordPress (see fakewordpress.py),
+and runs rst2wp on the posts, from a fresh process with an empty
+config and cache directory, the way a first run would go. Every
+scenario is run several times and the fastest run is reported, with
+the number of requests it made, how much it sent, and how long each
+stage took (from rst2wp --profile).
+
+    python benchmarks/scenarios.py [--only single-post,tags-10k] [--repeat 3]
+        [--latency 0.05] [--config workers=4] [--json FILE]
+
+The scenarios are:
+
+single-post   one new post with a few tags
+batch-1000    --batch over 1,000 new posts
+images-100    one post with 100 JPEG images, half of them scaled
+tags-10k      one post with 20 tags, on a blog that has 10,000
+large-upload  one post that uploads a 64 MiB file
+
+All the posts, images and files are generated the same way every
+time, so results from different versions of rst2wp can be compared.
+'''
+from __future__ import print_function
+import argparse
+import collections
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from fakewordpress import FakeWordPress
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+CONFIG = '''[account]
+url = {url}
+username = bench
+password = bench
+blog_id = 1
+
+[config]
+data_storage = file
+publish_default = yes
+save_uploads = yes
+default_category = Uncategorized
+tab_width = 4
+initial_header_level = 2
+'''
+
+PARAGRAPH = '''Lorem ipsum dolor sit amet, *consectetur* adipiscing elit, sed
+do eiusmod tempor incididunt ut labore et dolore magna aliqua. Ut enim
+ad minim veniam, quis ``nostrud`` exercitation ullamco laboris nisi ut
+aliquip ex ea commodo consequat.
+'''
+
+CODE = '''::
+
+    def f(x):
+        return x + 1
+
+'''
+
+
+def write_post(filename, title, tags=(), body=''):
+    lines = [':title: {0}'.format(title)]
+    if tags:
+        lines.append(':tags: - {0}'.format(tags[0]))
+        lines.extend('       - {0}'.format(tag) for tag in tags[1:])
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n\n' + body)
+
+
+def text(paragraphs):
+    return '\n'.join(PARAGRAPH + '\n' + (CODE if i % 3 == 2 else '')
+                     for i in range(paragraphs))
+
+
+def single_post(dir, options):
+    write_post(os.path.join(dir, 'post.rst'), 'A single post',
+               ['tag00001', 'tag00002', 'tag00003'], text(20))
+    return ['post.rst']
+
+
+def batch(dir, options):
+    rng = random.Random(0)
+    for i in range(options.posts):
+        subdir = os.path.join(dir, 'posts', '{0:02d}'.format(i % 50))
+        os.makedirs(subdir, exist_ok=True)
+        tags = ['tag{0:05d}'.format(rng.randrange(options.tags)) for j in range(3)]
+        write_post(os.path.join(subdir, 'post{0:04d}.rst'.format(i)),
+                   'Post number {0}'.format(i), sorted(set(tags)), text(rng.randint(3, 30)))
+    return ['--batch', 'posts']
+
+
+def images(dir, options):
+    from PIL import Image, ImageDraw
+
+    body = [text(2)]
+    for i in range(options.images):
+        filename = os.path.join(dir, 'photo{0:03d}.jpg'.format(i))
+        # Something that compresses like a photo, more or less
+        image = Image.linear_gradient('L').resize((1600, 1200)).convert('RGB')
+        draw = ImageDraw.Draw(image)
+        for j in range(20):
+            x, y = (i * 37 + j * 151) % 1500, (i * 53 + j * 97) % 1100
+            draw.ellipse((x, y, x + 100, y + 100), fill=((i * 7) % 256, (j * 13) % 256, 128))
+        image.save(filename, quality=90)
+
+        body.append('.. image:: file://{0}\n'.format(filename))
+        if i % 2:
+            body.append('   :scale: 0.5\n')
+        body.append('\n')
+    write_post(os.path.join(dir, 'photos.rst'), 'Lots of photos', ['tag00001'], ''.join(body))
+    return ['photos.rst']
+
+
+def many_tags(dir, options):
+    rng = random.Random(0)
+    tags = sorted('tag{0:05d}'.format(i) for i in rng.sample(range(options.blog_tags), 20))
+    write_post(os.path.join(dir, 'post.rst'), 'A post with many tags', tags, text(5))
+    return ['post.rst']
+
+
+def large_upload(dir, options):
+    filename = os.path.join(dir, 'data.bin')
+    rng = random.Random(0)
+    with open(filename, 'wb') as f:
+        for i in range(options.upload_mib):
+            f.write(rng.randbytes(1024 * 1024))
+    write_post(os.path.join(dir, 'upload.rst'), 'A big file', ['tag00001'],
+               text(2) + '\n.. upload:: file://{0}\n'.format(filename))
+    return ['upload.rst']
+
+
+Scenario = collections.namedtuple('Scenario', 'name prepare blog_tags')
+
+SCENARIOS = [
+    Scenario('single-post', single_post, lambda options: options.tags),
+    Scenario('batch-1000', batch, lambda options: options.tags),
+    Scenario('images-100', images, lambda options: options.tags),
+    Scenario('tags-10k', many_tags, lambda options: options.blog_tags),
+    Scenario('large-upload', large_upload, lambda options: options.tags),
+    ]
+
+
+def trace_totals(filename):
+    '''{category: {name: seconds}} from an rst2wp --profile trace.'''
+    with open(filename) as f:
+        events = json.load(f)['traceEvents']
+    totals = collections.defaultdict(lambda: collections.defaultdict(float))
+    for event in events:
+        if event['ph'] == 'X':
+            totals[event['cat']][event['name']] += event['dur'] / 1e6
+    return dict((category, dict(names)) for category, names in totals.items())
+
+
+def run_once(scenario, blog, options):
+    '''Run rst2wp on a fresh copy of the scenario. Returns the result
+    for that run.'''
+    dir = tempfile.mkdtemp(prefix='rst2wp-bench-')
+    try:
+        posts = os.path.join(dir, 'work')
+        os.mkdir(posts)
+        args = scenario.prepare(posts, options)
+
+        config = os.path.join(dir, 'config', 'rst2wp')
+        os.makedirs(config)
+        with open(os.path.join(config, 'wordpressrc'), 'w') as f:
+            f.write(CONFIG.format(url=blog.url))
+            for setting in options.config:
+                f.write('{0} = {1}\n'.format(*setting.split('=', 1)))
+
+        env = dict(os.environ,
+                   XDG_CONFIG_HOME=os.path.join(dir, 'config'),
+                   XDG_CACHE_HOME=os.path.join(dir, 'cache'),
+                   XDG_DATA_HOME=os.path.join(dir, 'data'),
+                   PYTHONPATH=os.pathsep.join([os.path.abspath(ROOT)] +
+                                              [p for p in [os.environ.get('PYTHONPATH')] if p]))
+        trace = os.path.join(dir, 'trace.json')
+        command = [sys.executable, '-m', 'rst2wp', '--profile', trace] + args
+
+        blog.reset_counts()
+        start = time.perf_counter()
+        process = subprocess.run(command, cwd=posts, env=env, stdin=subprocess.DEVNULL,
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        seconds = time.perf_counter() - start
+        if process.returncode != 0:
+            sys.stdout.write(process.stdout.decode('utf-8', 'replace')[-4000:])
+            sys.exit("{0} failed".format(scenario.name))
+
+        totals = trace_totals(trace)
+        return {
+            'seconds': seconds,
+            'requests': blog.requests,
+            'bytes_sent': blog.bytes_received,
+            'calls': dict(blog.calls),
+            'stages': totals.get('stage', {}),
+            'rpc': totals.get('rpc', {}),
+            }
+    finally:
+        shutil.rmtree(dir)
+
+
+def run_scenario(scenario, options):
+    blog = FakeWordPress(latency=options.latency, tags=scenario.blog_tags(options))
+    blog.start()
+    try:
+        runs = [run_once(scenario, blog, options) for i in range(options.repeat)]
+    finally:
+        blog.stop()
+
+    result = dict(min(runs, key=lambda run: run['seconds']))
+    result['scenario'] = scenario.name
+    result['runs'] = [run['seconds'] for run in runs]
+    return result
+
+
+def version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', help='comma-separated scenarios to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the fake blog adds to every request')
+    parser.add_argument('--tags', type=int, default=100,
+                        help='tags on the blog, except in tags-10k')
+    parser.add_argument('--blog-tags', type=int, default=10000,
+                        help='tags on the blog in tags-10k')
+    parser.add_argument('--posts', type=int, default=1000, help='posts in batch-1000')
+    parser.add_argument('--images', type=int, default=100, help='images in images-100')
+    parser.add_argument('--upload-mib', type=int, default=64, help='size of the file in large-upload')
+    parser.add_argument('--config', metavar='KEY=VALUE', action='append', default=[],
+                        help='add a setting to [config] in the wordpressrc (may be repeated)')
+    parser.add_argument('--json', metavar='FILE',
+                        help='also write the results to FILE as JSON')
+    options = parser.parse_args()
+
+    scenarios = SCENARIOS
+    if options.only:
+        names = options.only.split(',')
+        unknown = set(names) - set(s.name for s in SCENARIOS)
+        if unknown:
+            parser.error("unknown scenarios: {0}".format(', '.join(sorted(unknown))))
+        scenarios = [s for s in SCENARIOS if s.name in names]
+
+    results = []
+    print('{0:<14} {1:>10} {2:>10} {3:>12}'.format('scenario', 'best s', 'requests', 'sent MiB'))
+    for scenario in scenarios:
+        result = run_scenario(scenario, options)
+        results.append(result)
+        print('{0:<14} {1:>10.3f} {2:>10} {3:>12.2f}'.format(
+            scenario.name, result['seconds'], result['requests'],
+            result['bytes_sent'] / (1024.0 * 1024)))
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump({
+                'version': version(),
+                'date': datetime.datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'options': vars(options),
+                'scenarios': results,
+                }, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
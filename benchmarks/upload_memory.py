@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+'''Peak memory used to upload a file: streaming vs. all at once.
+
+Starts a local HTTP server that swallows metaWeblog.newMediaObject
+requests, then uploads files of increasing size, each from a fresh
+child process, and reports the peak RSS of that process. "in-memory"
+is what WordPressClient used to do (read the whole file and let
+xmlrpc.client encode it); "streaming" is WordPressClient.upload_file.
+
+    python benchmarks/upload_memory.py [--sizes 16,64,256] [--json FILE]
+
+Sizes are in MiB. Linux only (uses ru_maxrss).
+'''
+from __future__ import print_function
+import argparse
+import http.server
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import xmlrpc.client
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+
+class SinkHandler(http.server.BaseHTTPRequestHandler):
+    '''Reads and discards the request, and claims the upload worked.'''
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        remaining = int(self.headers['Content-Length'])
+        while remaining:
+            remaining -= len(self.rfile.read(min(remaining, 1024*1024)))
+
+        body = xmlrpc.client.dumps(({'url': 'http://localhost/upload'},),
+                                   methodresponse=True).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def child(mode, filename, url):
+    from rst2wp.lib import wordpresslib
+    wp = wordpresslib.WordPressClient(url, 'user', 'password')
+    if mode == 'streaming':
+        wp.upload_file(filename)
+    else:
+        with open(filename, 'rb') as f:
+            bits = xmlrpc.client.Binary(f.read())
+        wp._server.metaWeblog.newMediaObject(0, 'user', 'password',
+                                             {'name': 'bench', 'bits': bits})
+
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def peak_rss_kib(mode, filename, url):
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                      '--child', mode, filename, url])
+    return int(output.split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='0,16,64,256',
+                        help='comma-separated file sizes in MiB')
+    parser.add_argument('--json', metavar='FILE',
+                        help='also write the results to FILE as JSON')
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(*args.child)
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), SinkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{0}/xmlrpc.php'.format(server.server_port)
+
+    results = []
+    print('{0:>10} {1:>16} {2:>16}'.format('size MiB', 'in-memory MiB', 'streaming MiB'))
+    for size in [int(s) for s in args.sizes.split(',')]:
+        with tempfile.NamedTemporaryFile() as f:
+            block = os.urandom(1024*1024)
+            for i in range(size):
+                f.write(block)
+            f.flush()
+
+            result = {'size_mib': size}
+            for mode in ['in-memory', 'streaming']:
+                result[mode] = peak_rss_kib(mode, f.name, url) / 1024.0
+            results.append(result)
+
+        print('{size_mib:>10} {in-memory:>16.1f} {streaming:>16.1f}'.format(**result))
+
+    server.shutdown()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,8 +9,43 @@ def images_location():
     return os.path.join(BaseDirectory.save_config_path('rst2wp', 'published'),
                         'images')
 
+def manifest_location():
+    return os.path.join(BaseDirectory.save_config_path('rst2wp', 'published'),
+                        'manifest')
+
+def media_index_location():
+    return os.path.join(BaseDirectory.save_config_path('rst2wp', 'published'),
+                        'media')
+
+def metadata_location():
+    return os.path.join(BaseDirectory.save_config_path('rst2wp', 'published'),
+                        'metadata.sqlite')
+
+def terms_cache_location():
+    return BaseDirectory.save_cache_path('rst2wp', 'terms')
+
+def known_links_cache_location():
+    return BaseDirectory.save_cache_path('rst2wp', 'known_links')
+
+def derived_images_location():
+    return BaseDirectory.save_cache_path('rst2wp', 'images')
+
+def downloads_location():
+    return os.path.join(BaseDirectory.save_cache_path('rst2wp'), 'downloads.json')
+
+def render_cache_location():
+    return BaseDirectory.save_cache_path('rst2wp', 'render')
+
 POSTS_LOCATION = posts_location
 IMAGES_LOCATION = images_location
+MANIFEST_LOCATION = manifest_location
+MEDIA_INDEX_LOCATION = media_index_location
+METADATA_LOCATION = metadata_location
+TERMS_CACHE_LOCATION = terms_cache_location
+RENDER_CACHE_LOCATION = render_cache_location
+DERIVED_IMAGES_LOCATION = derived_images_location
+DOWNLOADS_LOCATION = downloads_location
+KNOWN_LINKS_CACHE_LOCATION = known_links_cache_location
 
 TEMP_DIRECTORY = '/tmp'
 TEMP_FILES = []
@@ -0,0 +1,110 @@
+'''Memoized access to rst2wp's config files.
+
+search_configs used to parse the config files from disk on every
+lookup, and _save_config_info re-read and rewrote a file on every
+change. With data_storage = dotrc, a post with lots of images did
+that dozens of times. A ConfigStore parses each file once (again only
+if its mtime or size changes), answers lookups from memory, and keeps
+changes in memory until flush() writes each changed file once.'''
+from __future__ import absolute_import
+import configparser
+import os
+import threading
+from io import StringIO
+
+from . import utils
+
+
+class ConfigStore(object):
+    def __init__(self):
+        # filename -> (signature, ConfigParser)
+        self._files = {}
+        # filename -> [(section, key, value)] not yet written
+        self._pending = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _signature(filename):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _parser(self, filename):
+        '''The parsed contents of filename, plus our unwritten changes.'''
+        signature = self._signature(filename)
+        loaded = self._files.get(filename)
+        if loaded and loaded[0] == signature:
+            return loaded[1]
+
+        config = configparser.ConfigParser(interpolation=None)
+        if signature is not None:
+            try:
+                with open(filename) as f:
+                    config.read_file(f)
+            except FileNotFoundError:
+                # Removed since we looked
+                signature = None
+        # Someone else changed the file; keep our changes on top
+        for section, key, value in self._pending.get(filename, []):
+            self._set(config, section, key, value)
+        self._files[filename] = signature, config
+        return config
+
+    @staticmethod
+    def _set(config, section, key, value):
+        if not config.has_section(section):
+            config.add_section(section)
+        config.set(section, key, value)
+
+    def get(self, filenames, section, key, default=None):
+        '''The value of key in section in the first of filenames that
+        has it, or default.'''
+        with self._lock:
+            for filename in filenames:
+                config = self._parser(filename)
+                if config.has_option(section, key):
+                    return config.get(section, key)
+        return default
+
+    def has(self, filenames, section, key):
+        with self._lock:
+            return any(self._parser(filename).has_option(section, key)
+                       for filename in filenames)
+
+    def items(self, filenames, section):
+        '''Every key in section, with the value get would give it, as a
+        sorted list of (key, value).'''
+        found = {}
+        with self._lock:
+            for filename in filenames:
+                config = self._parser(filename)
+                if config.has_section(section):
+                    for key, value in config.items(section):
+                        found.setdefault(key, value)
+        return sorted(found.items())
+
+    def sections(self, filename):
+        with self._lock:
+            config = self._parser(filename)
+            return [(section, dict(config.items(section))) for section in config.sections()]
+
+    def set(self, filename, section, key, value):
+        '''Change a value. It can be read back straight away, but isn't
+        written to filename until flush().'''
+        with self._lock:
+            self._set(self._parser(filename), section, key, value)
+            self._pending.setdefault(filename, []).append((section, key, value))
+
+    def flush(self):
+        '''Write every file that has been changed.'''
+        with self._lock:
+            for filename in list(self._pending):
+                # Picks up changes made by anyone else in the meantime
+                config = self._parser(filename)
+                fp = StringIO()
+                config.write(fp)
+                utils.atomic_write(filename, fp.getvalue())
+                del self._pending[filename]
+                self._files[filename] = self._signature(filename), config
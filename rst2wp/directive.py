@@ -6,9 +6,16 @@ import urllib.request, urllib.parse, urllib.error
 import urllib.parse
 from docutils.parsers.rst import Directive
 from .config import POSTS_LOCATION, IMAGES_LOCATION, TEMP_DIRECTORY, TEMP_FILES
+from .pipeline import ImagePipeline
+from .mediaindex import MediaIndex, digest_file
+from .downloads import DownloadManager
+from .timings import Timings, DISABLED
 
 
 class DownloadDirective(Directive):
+    # Set by directives whose work is being done by an ImagePipeline
+    pipeline = None
+
     @property
     def save_uploads(self, *args, **kwargs):
         '''Needlessly memoized version of the save_uploads property.'''
@@ -29,24 +36,90 @@ class DownloadDirective(Directive):
         if self.save_uploads:
             dir = os.path.join(os.path.dirname(app.filename), 'uploads')
             if not os.path.exists(dir):
-                os.mkdir(dir)
+                try:
+                    os.mkdir(dir)
+                except FileExistsError:
+                    # Another directive got there first
+                    pass
 
         return dir
 
     def cleanup_file(self, filename):
         '''Mark file specified by 'filename' as temporary, with a need to be cleaned up.'''
-        if not self.save_uploads and filename.startswith(TEMP_DIRECTORY):
+        if not self.save_uploads and filename.startswith(TEMP_DIRECTORY) \
+                and filename not in TEMP_FILES:
             TEMP_FILES.append(filename)
 
-    def download_image(self, uri):
+    def get_pipeline(self):
+        '''The ImagePipeline to hand our work to, or None to do it now.'''
+        pipeline = getattr(self.document.settings, 'image_pipeline', None)
+        if isinstance(pipeline, ImagePipeline):
+            return pipeline
+
+    def once(self, key, fn):
+        '''Call fn(), unless another directive in the pipeline is already
+        doing the same thing, in which case wait for that instead.'''
+        if self.pipeline is None:
+            return fn()
+        return self.pipeline.once(key, fn)
+
+    def once_many(self, keys, fn):
+        '''Like once, for work that does several things at once. fn is
+        called with the keys nobody else is doing, and waits for
+        the others.'''
+        if self.pipeline is None:
+            return fn(keys)
+        return self.pipeline.once_many(keys, fn)
+
+    def span(self, name, **args):
+        '''A timings span for part of our work; see rst2wp.timings.'''
+        timings = getattr(self.document.settings, 'timings', None)
+        if not isinstance(timings, Timings):
+            timings = DISABLED
+        return timings.span(name, 'directive', **args)
+
+    def upload_media(self, filename, message):
+        '''Upload filename to the blog and return its URL -- unless a
+        file with the same contents has already been uploaded, in which
+        case return the URL it got then. message is printed if we
+        really do upload.'''
+        wp = self.document.settings.wordpress_instance
+        index = getattr(self.document.settings, 'media_index', None)
+        if not isinstance(index, MediaIndex):
+            print(message)
+            with self.span('upload', filename=filename):
+                return wp.upload_file(filename)
+
+        digest = digest_file(filename)
+        def upload():
+            url = index.get(digest)
+            if url:
+                print("{0} is already on the blog as {1}".format(filename, url))
+                return url
+            print(message)
+            with self.span('upload', filename=filename):
+                url = wp.upload_file(filename)
+            index.record(digest, url)
+            return url
+        # Identical forms of different images can be uploading at once
+        return self.once(('media', digest), upload)
+
+    def download_image(self, uri, target_filename=None):
         '''Download the image specified by uri to an appropriate uploads_dir. Return the filename of the local image.'''
-        target_filename = self.uri_filename(uri)
+        target_filename = target_filename or self.uri_filename(uri)
         dir = self.uploads_dir()
 
         filename = os.path.join(dir, target_filename)
-        if not os.path.exists(filename):
-            print("Downloading {0}".format(uri))
-            filename, headers = urllib.request.urlretrieve(uri, os.path.join(dir, target_filename))
+        manager = getattr(self.document.settings, 'download_manager', None)
+        def download():
+            with self.span('download', uri=uri):
+                if isinstance(manager, DownloadManager):
+                    return manager.fetch(uri, filename)
+                if not os.path.exists(filename):
+                    print("Downloading {0}".format(uri))
+                    return urllib.request.urlretrieve(uri, filename)[0]
+                return filename
+        filename = self.once(('download', filename), download)
 
         self.cleanup_file(filename)
         return filename
@@ -0,0 +1,223 @@
+'''Downloading the files that image:: and upload:: directives refer to.
+
+Files are downloaded into the uploads directory and kept there, so
+they don't have to be fetched again next time. The DownloadManager
+makes sure what's kept is worth keeping:
+
+- Files are downloaded to NAME.part and only renamed to NAME once
+  they're complete, so a file that exists is a whole file. An
+  interrupted download is resumed (with a Range request) next time.
+- The ETag and Last-Modified of every file are remembered, and a file
+  we already have is revalidated with a conditional request rather
+  than trusted forever or fetched again.
+- Connections to each server are kept open and reused, by however
+  many threads are downloading at once (see rst2wp.pipeline).
+
+URIs that aren't http or https are left to urllib, as before.'''
+from __future__ import absolute_import
+from __future__ import print_function
+import http.client
+import json
+import os
+import ssl
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+from . import utils
+
+CHUNK_SIZE = 64*1024
+MAX_REDIRECTS = 5
+REDIRECTS = (301, 302, 303, 307, 308)
+
+
+class DownloadError(IOError):
+    '''The server refused to give us the file.'''
+
+
+class DownloadManager(object):
+    def __init__(self, state_filename=None, timeout=60, retries=3):
+        '''Validators are remembered in state_filename, if given.
+        Failed downloads are retried (and resumed) up to retries
+        times.'''
+        self.state_filename = state_filename
+        self.timeout = timeout
+        self.retries = retries
+        self.connections_opened = 0
+        self._state = None
+        # (scheme, netloc) -> [idle connections]
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def fetch(self, uri, filename):
+        '''Make filename a complete, up to date copy of uri, downloading
+        it if we have to. Returns filename.'''
+        scheme = urllib.parse.urlsplit(uri).scheme.lower()
+        if scheme not in ('http', 'https'):
+            if not os.path.exists(filename):
+                print("Downloading {0}".format(uri))
+                part = filename + '.part'
+                urllib.request.urlretrieve(uri, part)
+                os.replace(part, filename)
+            return filename
+
+        for attempt in range(self.retries + 1):
+            try:
+                return self._fetch_http(uri, filename)
+            except DownloadError:
+                raise
+            except (IOError, OSError, http.client.HTTPException) as e:
+                if attempt == self.retries:
+                    raise
+                print("Problem downloading {0} ({1}); trying again".format(uri, e))
+                time.sleep(0.5 * 2**attempt)
+
+    def _fetch_http(self, uri, filename):
+        key = os.path.abspath(filename)
+        record = self._get_record(key)
+        if record and record['uri'] != uri:
+            record = None
+        validator = record and (record['etag'] or record['last_modified'])
+
+        headers = {}
+        part = filename + '.part'
+        offset = 0
+        if os.path.exists(filename):
+            if not validator:
+                # Downloaded before we kept records, or the server
+                # gave us nothing to check it with
+                return filename
+            if record['etag']:
+                headers['If-None-Match'] = record['etag']
+            if record['last_modified']:
+                headers['If-Modified-Since'] = record['last_modified']
+        elif validator and os.path.exists(part):
+            offset = os.path.getsize(part)
+            headers['Range'] = 'bytes={0}-'.format(offset)
+            headers['If-Range'] = validator
+
+        response, connection = self._request(uri, headers)
+        reusable = False
+        try:
+            if response.status == 304:
+                response.read()
+                reusable = True
+                return filename
+            if response.status == 206 and offset and \
+                    response.getheader('Content-Range', '').startswith('bytes {0}-'.format(offset)):
+                mode = 'ab'
+                print("Resuming download of {0} at {1} bytes".format(uri, offset))
+            elif response.status == 200:
+                mode, offset = 'wb', 0
+                print("Downloading {0}".format(uri))
+            elif response.status == 416:
+                # What we have of it is no good; start again
+                os.unlink(part)
+                raise http.client.HTTPException("{0}: can't resume".format(uri))
+            else:
+                raise DownloadError("{0}: {1} {2}".format(uri, response.status, response.reason))
+
+            record = {
+                'uri': uri,
+                'etag': response.getheader('ETag'),
+                'last_modified': response.getheader('Last-Modified'),
+                }
+            # So that we can resume if this download doesn't finish
+            self._set_record(key, record)
+
+            length = response.getheader('Content-Length')
+            received = 0
+            with open(part, mode) as f:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                    f.write(chunk)
+                    received += len(chunk)
+            if length is not None and received < int(length):
+                raise http.client.IncompleteRead(b'', int(length) - received)
+
+            os.replace(part, filename)
+            reusable = True
+            return filename
+        finally:
+            if reusable:
+                self._release(connection, response)
+            else:
+                connection.close()
+
+    def _request(self, uri, headers):
+        '''GET uri, following redirects. Returns (response, connection).'''
+        for i in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(uri)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            connection = self._connection(parts.scheme.lower(), parts.netloc)
+            try:
+                connection.request('GET', path, headers=dict(headers, **{'User-Agent': 'rst2wp'}))
+                response = connection.getresponse()
+            except BaseException:
+                connection.close()
+                raise
+
+            location = response.getheader('Location')
+            if response.status not in REDIRECTS or not location:
+                return response, connection
+            response.read()
+            self._release(connection, response)
+            uri = urllib.parse.urljoin(uri, location)
+
+        raise DownloadError("{0}: too many redirects".format(uri))
+
+    def _connection(self, scheme, netloc):
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop()
+            self.connections_opened += 1
+
+        if scheme == 'https':
+            connection = http.client.HTTPSConnection(netloc, timeout=self.timeout,
+                                                     context=ssl.create_default_context())
+        else:
+            connection = http.client.HTTPConnection(netloc, timeout=self.timeout)
+        connection.rst2wp_key = scheme, netloc
+        return connection
+
+    def _release(self, connection, response):
+        '''Keep connection for the next request, if it can be reused.'''
+        if response.will_close or not response.isclosed() or connection.sock is None:
+            connection.close()
+            return
+        with self._lock:
+            self._idle.setdefault(connection.rst2wp_key, []).append(connection)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def _load(self):
+        if self._state is None:
+            self._state = {}
+            if self.state_filename:
+                try:
+                    with open(self.state_filename) as f:
+                        self._state = json.load(f)
+                except (IOError, OSError, ValueError):
+                    pass
+        return self._state
+
+    def _get_record(self, key):
+        with self._lock:
+            return self._load().get(key)
+
+    def _set_record(self, key, record):
+        with self._lock:
+            state = self._load()
+            if state.get(key) == record:
+                return
+            state[key] = record
+            if self.state_filename:
+                utils.atomic_write(self.state_filename, json.dumps(state))
@@ -0,0 +1,73 @@
+'''Changes to write back into a post's source.
+
+rst2wp records what it learns while publishing a post (its id, the
+URLs of uploaded images, ...) in the post itself, as bibliographic
+fields and directive options. An EditBuffer collects those changes
+and applies them all at once, so the file only has to be rewritten
+once per post rather than once per change.'''
+from __future__ import absolute_import
+import re
+
+INDENT = re.compile(r'^\s*')
+
+
+class EditBuffer(object):
+    def __init__(self, text):
+        self.text = text
+        # key -> value, in the order they were first set
+        self.fields = {}
+        # (directive, uri, key, value), in the order they were added
+        self.options = []
+        self._patterns = {}
+
+    def __bool__(self):
+        return bool(self.fields or self.options)
+
+    def set_field(self, key, value):
+        '''Set a bibliographic field in the header, replacing it if it
+        exists and otherwise adding it after the other fields.'''
+        self.fields[key] = value
+
+    def add_directive_option(self, directive, uri, key, value):
+        '''Add an option to every directive:: uri in the text.'''
+        if (directive, uri) not in self._patterns:
+            self._patterns[directive, uri] = re.compile(
+                r'{name}::\s+({uri})'.format(name=directive, uri=re.escape(uri)))
+        self.options.append((directive, uri, key, value))
+
+    def apply(self):
+        '''The text with all the changes made.
+
+        The result is the same as making each change in turn: options
+        are added straight after the directive line, so the one added
+        last comes first.'''
+        fields = dict(self.fields)
+        in_fields = False
+        out = []
+        for line in self.text.split('\n'):
+            if fields:
+                if ':' == line[:1]:
+                    in_fields = True
+                if in_fields:
+                    if '' == line.strip():
+                        # Didn't have these fields
+                        out.extend(':{0}: {1}'.format(key, value)
+                                   for key, value in fields.items())
+                        fields = {}
+                    else:
+                        for key in fields:
+                            if line.startswith(':{0}:'.format(key)):
+                                line = ':{0}: {1}'.format(key, fields.pop(key))
+                                break
+
+            out.append(line)
+            if '::' not in line:
+                continue
+            matching = [(key, value) for directive, uri, key, value in self.options
+                        if self._patterns[directive, uri].search(line)]
+            if matching:
+                indent = (INDENT.search(line).end() + 3) * ' '
+                out.extend(indent + ':{0}: {1}'.format(key, value)
+                           for key, value in reversed(matching))
+
+        return '\n'.join(out)
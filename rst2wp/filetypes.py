@@ -0,0 +1,58 @@
+'''Working out what kind of file something is.
+
+upload:: shows what kind of file it uploaded, according to libmagic.
+Opening libmagic means loading its whole database, so rather than
+doing that for every file, a TypeDetector opens it once and answers
+for every file (from any thread), remembering the answers for as long
+as the files don't change.
+
+It also supplies the MIME type WordPressClient.upload_file sends: the
+one mimetypes guesses from the extension, which is what WordPress
+checks uploads against, or if mimetypes has no idea, what libmagic
+makes of the contents.'''
+from __future__ import absolute_import
+import mimetypes
+import os
+import threading
+
+import magic  # needed to guess file types
+
+GENERIC = 'application/octet-stream'
+
+
+class TypeDetector(object):
+    def __init__(self):
+        self._handles = {}
+        # (filename, flags, size, mtime) -> answer
+        self._answers = {}
+        # libmagic handles can't be shared between threads
+        self._lock = threading.Lock()
+
+    def _magic(self, filename, flags):
+        st = os.stat(filename)
+        key = os.path.abspath(filename), flags, st.st_size, st.st_mtime_ns
+        with self._lock:
+            if key not in self._answers:
+                if flags not in self._handles:
+                    handle = magic.open(flags)
+                    handle.load()
+                    self._handles[flags] = handle
+                self._answers[key] = self._handles[flags].file(filename)
+            return self._answers[key]
+
+    def describe(self, filename):
+        '''What file(1) would say about filename.'''
+        return self._magic(filename, magic.MAGIC_NONE)
+
+    def mime_type(self, filename):
+        '''The MIME type to upload filename as.'''
+        type = mimetypes.guess_type(filename)[0]
+        if type:
+            return type
+        return self._magic(filename, magic.MAGIC_MIME_TYPE) or GENERIC
+
+    def close(self):
+        with self._lock:
+            handles, self._handles = self._handles, {}
+        for handle in handles.values():
+            handle.close()
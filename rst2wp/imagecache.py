@@ -0,0 +1,203 @@
+'''Cache of derived images: the rotated and scaled forms of images.
+
+The forms of an image are generated from the downloaded original every
+time they're needed (which is whenever they haven't been uploaded in
+that form yet), and decoding and re-encoding a big JPEG is slow. The
+DerivedImageCache keeps every form it generates, under the hash of
+the original's contents and the transforms applied to it, so that a
+form is only ever generated once, whichever post it's for. Once the
+cache is bigger than max_size, the forms that were least recently
+used are deleted when it's closed.
+
+Generating a form is CPU-bound, so the cache can hand that to a pool
+of processes. transform() is a plain function for that reason.'''
+from __future__ import absolute_import
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from PIL import Image, ImageOps
+
+from .mediaindex import digest_file
+
+# The EXIF tag; the values of it that mean the picture has to be
+# turned or flipped; and those of them that mean it's on its side
+ORIENTATION = 0x0112
+TRANSPOSED = (2, 3, 4, 5, 6, 7, 8)
+SIDEWAYS = (5, 6, 7, 8)
+
+
+def scale_dimensions(size, scale):
+    '''The size :scale: asks for, for an image of the given size. scale
+    is a factor ("0.25") or a box to fit in ("200x200").'''
+    try:
+        factor = float(scale)
+        return int(size[0]*factor), int(size[1]*factor)
+    except ValueError as e:
+        dimensions = scale.split('x')
+        return int(dimensions[0]), int(dimensions[1])
+
+
+def transform(filename, steps, outputs):
+    '''Apply steps to the image in filename, one after the other. Each
+    step is (transform, argument), where transform is rotate or scale
+    and the argument is the directive option's value. The image after
+    step i is saved to outputs[i], unless that's None.
+
+    Before anything else, the picture is turned the way its EXIF data
+    says it should be, so the forms come out the right way up however
+    they're shown. The original file is left as it is.
+
+    The image is decoded once, and everything else is done in memory.
+    If the first image to be saved has been scaled down, a JPEG is
+    decoded at a fraction of its size in the first place, which is
+    much faster.'''
+    image = Image.open(filename)
+    orientation = image.getexif().get(ORIENTATION, 1)
+    icc_profile = image.info.get('icc_profile')
+
+    # Work out the sizes before anything is decoded
+    sizes = []
+    size = image.size
+    if orientation in SIDEWAYS:
+        size = size[1], size[0]
+    for name, argument in steps:
+        if name == 'scale':
+            size = scale_dimensions(size, argument)
+        sizes.append(size)
+
+    wanted = [i for i, output in enumerate(outputs) if output]
+    if not wanted:
+        return
+    if any(name == 'scale' for name, argument in steps[:wanted[0]+1]):
+        # Leaves some to spare, like Image.thumbnail does
+        first = sizes[wanted[0]]
+        if orientation in SIDEWAYS:
+            first = first[1], first[0]
+        image.draft(None, (first[0]*2, first[1]*2))
+    if orientation in TRANSPOSED:
+        image = ImageOps.exif_transpose(image)
+
+    options = {}
+    if isinstance(icc_profile, bytes):
+        options['icc_profile'] = icc_profile
+    for i, (name, argument) in enumerate(steps[:wanted[-1]+1]):
+        if name == 'rotate':
+            image = image.rotate(float(argument))
+        elif name == 'scale':
+            image.thumbnail(sizes[i], Image.LANCZOS)
+        else:
+            raise ValueError("unknown transform {0}".format(name))
+        if outputs[i]:
+            image.save(outputs[i], **options)
+
+
+class DerivedImageCache(object):
+    # Forms still being generated, perhaps by another rst2wp
+    TMP_PREFIX = 'tmp'
+
+    def __init__(self, directory, executor=None, max_size=None):
+        '''Forms are kept in directory, and generated by executor (a
+        ProcessPoolExecutor, say) if there is one. If max_size (in
+        bytes) is given, the cache is pruned to that size by close().'''
+        self.directory = directory
+        self.executor = executor
+        self.max_size = max_size
+        # filename -> ((mtime, size), digest)
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def source_digest(self, filename):
+        '''The hash of an original image, remembered while it doesn't
+        change.'''
+        st = os.stat(filename)
+        signature = st.st_mtime_ns, st.st_size
+        with self._lock:
+            known = self._digests.get(filename)
+        if known and known[0] == signature:
+            return known[1]
+
+        digest = digest_file(filename)
+        with self._lock:
+            self._digests[filename] = signature, digest
+        return digest
+
+    def cached_filename(self, digest, chain, ext):
+        '''Where the original with the given digest goes, once chain has
+        been applied to it.'''
+        key = json.dumps([digest, [list(step) for step in chain]])
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + ext.lower())
+
+    def derive(self, source, steps, outputs):
+        '''Like transform(source, steps, outputs), but forms that are
+        in the cache are copied from there, and the others are put in
+        the cache as well as in outputs.'''
+        digest = self.source_digest(source)
+        cached = [output and self.cached_filename(digest, steps[:i+1], os.path.splitext(output)[1])
+                  for i, output in enumerate(outputs)]
+
+        missing = [filename if filename and not os.path.exists(filename) else None
+                   for filename in cached]
+        if any(missing):
+            tmps = []
+            for filename in missing:
+                tmp = None
+                if filename:
+                    fd, tmp = tempfile.mkstemp(suffix=os.path.splitext(filename)[1],
+                                               prefix=self.TMP_PREFIX, dir=self.directory)
+                    os.close(fd)
+                tmps.append(tmp)
+            try:
+                self._run(transform, source, steps, tmps)
+                for tmp, filename in zip(tmps, missing):
+                    if tmp:
+                        os.replace(tmp, filename)
+            finally:
+                for tmp in tmps:
+                    if tmp and os.path.exists(tmp):
+                        os.unlink(tmp)
+
+        for filename, output in zip(cached, outputs):
+            if output:
+                # The mtime says when a form was last used (atime can't
+                # be trusted to), for prune()
+                os.utime(filename)
+                shutil.copyfile(filename, output)
+
+    def _run(self, fn, *args):
+        if self.executor is None:
+            return fn(*args)
+        return self.executor.submit(fn, *args).result()
+
+    def prune(self):
+        '''Delete the least recently used forms until the cache is no
+        bigger than max_size.'''
+        if not self.max_size:
+            return
+        forms = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(self.TMP_PREFIX) or not entry.is_file():
+                    continue
+                st = entry.stat()
+                forms.append((st.st_mtime, st.st_size, entry.path))
+
+        total = sum(size for mtime, size, path in forms)
+        for mtime, size, path in sorted(forms):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                # Another rst2wp got there first
+                pass
+            total -= size
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+        self.prune()
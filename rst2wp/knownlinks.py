@@ -0,0 +1,161 @@
+'''Known links: link targets that every post can use.
+
+Each known_links file in the config directories looks like::
+
+    [http://www.example.com/]
+    link = example link
+
+We used to turn all of them into ".. _`example link`: http://..."
+lines and append those to every post, so docutils had to parse every
+known link for every post. Instead, the files are compiled once into a
+table (cached on disk, and reloaded when a file changes), and
+KnownLinksTransform adds targets to a document for just the names it
+refers to.'''
+from __future__ import absolute_import
+from __future__ import print_function
+import configparser
+import hashlib
+import json
+import os
+import threading
+
+import docutils.nodes
+import docutils.transforms
+from docutils.parsers.rst.states import Inliner
+from docutils.utils import unescape, split_escaped_whitespace
+
+from . import utils
+
+
+def parse_link(link):
+    '''What ".. _name: link" would make of link: ('refname', name) for
+    a reference to another target, otherwise ('refuri', uri).'''
+    if link.strip()[-1:] == '_':
+        refname = link.strip()[:-1]
+        if refname.startswith('`') and refname.endswith('`'):
+            refname = refname[1:-1]
+        if refname and not refname.endswith('\\'):
+            return 'refname', refname
+    parts = split_escaped_whitespace(link)
+    return 'refuri', ' '.join(''.join(unescape(part).split()) for part in parts)
+
+
+class KnownLinks(object):
+    def __init__(self, filenames, cache_filename=None):
+        '''Links from filenames (later files win), cached in
+        cache_filename if it's given.'''
+        self.filenames = filenames
+        self.cache_filename = cache_filename
+        self._signature = None
+        self._links = {}
+        self._digest = None
+        self._lock = threading.Lock()
+
+    def _current_signature(self):
+        signature = []
+        for filename in self.filenames:
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            signature.append([filename, st.st_mtime_ns, st.st_size])
+        return signature
+
+    def _load(self):
+        '''Make sure the table reflects the files as they are now.'''
+        signature = self._current_signature()
+        if signature == self._signature:
+            return
+
+        cached = self._read_cache()
+        if cached and cached['signature'] == signature:
+            self._links, self._digest = cached['links'], cached['digest']
+        else:
+            self._links = self._compile(signature)
+            encoded = json.dumps(self._links, sort_keys=True).encode('utf-8')
+            self._digest = hashlib.sha256(encoded).hexdigest()
+            self._write_cache(signature)
+        self._signature = signature
+
+    def _compile(self, signature):
+        known_links = configparser.ConfigParser(interpolation=None)
+        for filename, mtime, size in signature:
+            print("loading known links from", filename)
+            with open(filename) as f:
+                known_links.read_file(f)
+
+        links = {}
+        for sectname in known_links.sections():
+            name = known_links.get(sectname, 'link')
+            name = docutils.nodes.fully_normalize_name(unescape(name))
+            links[name] = parse_link(sectname)
+        return links
+
+    def _read_cache(self):
+        if not self.cache_filename:
+            return None
+        try:
+            with open(self.cache_filename) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write_cache(self, signature):
+        if not self.cache_filename:
+            return
+        utils.atomic_write(self.cache_filename, json.dumps({
+                    'signature': signature,
+                    'links': self._links,
+                    'digest': self._digest,
+                    }))
+
+    @property
+    def links(self):
+        '''{normalized name: (kind, data)}, as returned by parse_link.'''
+        with self._lock:
+            self._load()
+            return self._links
+
+    @property
+    def digest(self):
+        '''A hash of all the links, for the render cache.'''
+        with self._lock:
+            self._load()
+            return self._digest
+
+
+class KnownLinksTransform(docutils.transforms.Transform):
+    # Before references.IndirectHyperlinks (460) starts resolving
+    # references to targets
+    default_priority = 455
+
+    def apply(self):
+        known_links = getattr(self.document.settings, 'known_links', None)
+        if known_links is None:
+            return
+        links = known_links.links
+
+        inliner = None
+        # Targets the document refers to but doesn't define. Adding an
+        # indirect one can refer to another.
+        wanted = set(self.document.refnames)
+        while wanted:
+            for name in sorted(wanted - set(self.document.nameids)):
+                if name not in links:
+                    continue
+                kind, data = links[name]
+                target = docutils.nodes.target('', '', names=[name])
+                if kind == 'refname':
+                    target['refname'] = docutils.nodes.fully_normalize_name(data)
+                    target.indirect_reference_name = data
+                    self.document += target
+                    self.document.note_explicit_target(target)
+                    self.document.note_indirect_target(target)
+                else:
+                    if inliner is None:
+                        inliner = Inliner()
+                        inliner.init_customizations(self.document.settings)
+                    target['refuri'] = inliner.adjust_uri(data)
+                    self.document += target
+                    self.document.note_explicit_target(target)
+            wanted = set(self.document.refnames) - set(self.document.nameids) - wanted
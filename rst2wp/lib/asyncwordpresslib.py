@@ -0,0 +1,519 @@
+"""
+    asyncwordpresslib: WordPressClient for asyncio.
+
+    AsyncWordPressClient has the same methods as
+    wordpresslib.WordPressClient (by their get_post/edit_post names),
+    but they're coroutines, so that the uploads, term fetches and post
+    saves for many posts can all be waiting on the server at once in
+    one event loop, rather than needing a thread each:
+
+        client = AsyncWordPressClient(url, user, password)
+        client.selectBlog(blog_id)
+        urls = await asyncio.gather(*[client.upload_file(f) for f in files])
+        await client.close()
+
+    Requests go over asyncio streams, marshalled by xmlrpc.client, and
+    at most pool_size of them are sent at once, over persistent
+    connections that are reused. Everything that isn't talking to the
+    server (what's known about the blog, and turning structs into
+    WordPressPosts and the like) is shared with WordPressClient; see
+    wordpresslib.WordPressClientBase.
+"""
+from __future__ import print_function
+
+import asyncio
+import gzip
+import ssl
+import time
+import urllib.parse
+import xmlrpc.client
+from functools import wraps
+
+try:
+    from . import wordpresslib
+except ImportError:
+    import wordpresslib
+
+CallTotals = wordpresslib.CallTotals
+StreamingRequest = wordpresslib.StreamingRequest
+WordPressException = wordpresslib.WordPressException
+
+# How much of a file upload to send before waiting for it to go
+CHUNK_SIZE = 3*64*1024
+
+
+class AsyncTransport(object):
+    """Sends XML-RPC requests to one URL, over up to pool_size
+    connections at a time.
+
+    Like wordpresslib.PooledTransport, every call's duration and size
+    is added to totals, a CallTotals, and passed on to timings.rpc()
+    if timings has been set.
+    """
+    timings = None
+
+    def __init__(self, url, pool_size=4, timeout=None, context=None):
+        parts = urllib.parse.urlsplit(url)
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.https else 80)
+        self.netloc = parts.netloc
+        self.handler = urllib.parse.urlunsplit(['', '', parts.path, parts.query, '']) or '/RPC2'
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.context = context
+        if self.https and context is None:
+            self.context = ssl.create_default_context()
+
+        self.totals = CallTotals()
+        self.connections_opened = 0
+        # (reader, writer) for connections not in use
+        self._idle = []
+        self._slots = None
+
+    async def request(self, method, body):
+        """Send body (bytes, or a StreamingRequest) and return what the
+        method returned. Raises xmlrpc.client.Fault if it failed."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        start = time.perf_counter()
+        async with self._slots:
+            # A connection that's been idle may have been closed by the
+            # server; if so, try again once on a new one.
+            for attempt in range(2):
+                reused = bool(self._idle)
+                connection = await self._connection()
+                try:
+                    exchange = self._exchange(connection, body)
+                    if self.timeout is not None:
+                        exchange = asyncio.wait_for(exchange, self.timeout)
+                    received, data, keep_alive = await exchange
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    self._discard(connection)
+                    if reused and attempt == 0:
+                        continue
+                    raise
+                except BaseException:
+                    self._discard(connection)
+                    raise
+                break
+
+            if keep_alive:
+                self._idle.append(connection)
+            else:
+                self._discard(connection)
+
+        self._record(method, body, received, start)
+        parser, unmarshaller = xmlrpc.client.getparser()
+        parser.feed(data)
+        parser.close()
+        return unmarshaller.close()
+
+    async def _connection(self):
+        if self._idle:
+            return self._idle.pop()
+        self.connections_opened += 1
+        return await asyncio.open_connection(self.host, self.port, ssl=self.context)
+
+    def _discard(self, connection):
+        reader, writer = connection
+        writer.close()
+
+    async def _exchange(self, connection, body):
+        """Send one request and read its response. Returns (how many
+        bytes the body was, the body, whether the connection can be
+        used again)."""
+        reader, writer = connection
+        headers = [
+            'POST {0} HTTP/1.1'.format(self.handler),
+            'Host: {0}'.format(self.netloc),
+            'User-Agent: {0}'.format(xmlrpc.client.Transport.user_agent),
+            'Content-Type: text/xml',
+            'Accept-Encoding: gzip',
+            'Content-Length: {0}'.format(len(body)),
+            '', '']
+        writer.write('\r\n'.join(headers).encode('ascii'))
+        if isinstance(body, bytes):
+            writer.write(body)
+        else:
+            for chunk in body:
+                writer.write(chunk)
+                await writer.drain()
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("server closed the connection")
+        version, status, reason = (status_line.decode('iso-8859-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('iso-8859-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == 'HTTP/1.1' and \
+            response_headers.get('connection', '').lower() != 'close'
+        if 'content-length' in response_headers:
+            data = await reader.readexactly(int(response_headers['content-length']))
+        elif response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            data = b''
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # Trailers, then a blank line
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                data += await reader.readexactly(size)
+                await reader.readexactly(2)
+        else:
+            data = await reader.read()
+            keep_alive = False
+
+        if int(status) != 200:
+            raise xmlrpc.client.ProtocolError(self.netloc + self.handler, int(status), reason,
+                                              response_headers)
+        received = len(data)
+        if response_headers.get('content-encoding', '').lower() == 'gzip':
+            data = gzip.decompress(data)
+        return received, data, keep_alive
+
+    def _record(self, method, body, received, start):
+        seconds = time.perf_counter() - start
+        self.totals = self.totals.add(seconds, len(body), received)
+        if self.timings is not None:
+            self.timings.rpc(method, start, seconds, len(body), received)
+
+    def summary(self):
+        """One line describing all the calls made so far."""
+        totals = self.totals
+        return "{0} XML-RPC calls in {1:.2f}s over {2} connections; {3} bytes sent, {4} received".format(
+            totals.calls, totals.seconds, self.connections_opened, totals.sent, totals.received)
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for reader, writer in idle:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+def wordpress_call(func):
+    '''wordpresslib.wordpress_call, for coroutines.'''
+    name = func.__name__.lstrip('_')
+    @wraps(func)
+    async def call(self, *args, **kwargs):
+        try:
+            if self.timings is None:
+                return await func(self, *args, **kwargs)
+            with self.timings.span(name, 'rpc'):
+                return await func(self, *args, **kwargs)
+        except xmlrpc.client.Fault as fault:
+            raise WordPressException(fault)
+
+    return call
+
+
+class AsyncWordPressClient(wordpresslib.WordPressClientBase):
+    """Client for the WordPress XML-RPC interface, for asyncio.
+    """
+    def __init__(self, url, user, password, transport=None):
+        wordpresslib.WordPressClientBase.__init__(self, url, user, password)
+        if transport is None:
+            transport = AsyncTransport(url)
+        self.transport = transport
+        # Guards the term lists, so they're only fetched once however
+        # many tasks want them at the same time
+        self._lock = None
+
+    def _terms_lock(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def call(self, method, *params):
+        """Call an XML-RPC method, and return its result."""
+        body = xmlrpc.client.dumps(params, method, encoding='utf-8')
+        body = body.encode('utf-8', 'xmlcharrefreplace')
+        result = await self.transport.request(method, body)
+        if len(result) == 1:
+            result = result[0]
+        return result
+
+    async def close(self):
+        await self.transport.close()
+
+    async def supported_methods(self):
+        return await self.call('mt.supportedMethods')
+
+    @wordpress_call
+    async def prefetch(self, options=False, user_info=False, tags=False, categories=False, posts=()):
+        """See WordPressClient.prefetch."""
+        calls = []
+        async with self._terms_lock():
+            if options and self.options is None:
+                calls.append((self._store_options, 'wp.getOptions',
+                              (self.blogId, self.user, self.password)))
+            if user_info and self.user_info is None:
+                calls.append((self._store_user_info, 'blogger.getUserInfo',
+                              ('', self.user, self.password)))
+            if tags and self.tags is None:
+                self.tags = self._load_cached_terms('post_tag', wordpresslib.WordPressTag)
+                if self.tags is None:
+                    calls.append((self._store_tags, 'wp.getTerms',
+                                  (self.blogId, self.user, self.password, 'post_tag', {'hide_empty': 0})))
+            if categories and self.categories is None:
+                self.categories = self._load_cached_terms('category', wordpresslib.WordPressCategory)
+                if self.categories is None:
+                    calls.append((self._store_categories, 'wp.getTerms',
+                                  (self.blogId, self.user, self.password, 'category', {'hide_empty': 0})))
+            for postId in posts:
+                if str(postId) not in self._prefetched_posts:
+                    calls.append((lambda post, postId=str(postId): self._prefetched_posts.__setitem__(postId, post),
+                                  'metaWeblog.getPost', (str(postId), self.user, self.password)))
+
+            results = await self._call_many([(method, args) for store, method, args in calls])
+            for (store, method, args), (result, fault) in zip(calls, results):
+                if fault is None:
+                    store(result)
+
+    async def _call_many(self, calls):
+        """See WordPressClient._call_many."""
+        if len(calls) > 1 and self._multicall is not False:
+            try:
+                results = await self.call('system.multicall',
+                                          [{'methodName': method, 'params': list(args)}
+                                           for method, args in calls])
+            except xmlrpc.client.Fault:
+                # Probably "requested method system.multicall does not exist"
+                self._multicall = False
+            else:
+                self._multicall = True
+                out = []
+                for result in results:
+                    if isinstance(result, dict):
+                        out.append((None, xmlrpc.client.Fault(result['faultCode'], result['faultString'])))
+                    else:
+                        out.append((result[0], None))
+                return out
+
+        out = []
+        for method, args in calls:
+            try:
+                out.append((await self.call(method, *args), None))
+            except xmlrpc.client.Fault as fault:
+                out.append((None, fault))
+        return out
+
+    @wordpress_call
+    async def get_options(self):
+        if self.options is None:
+            self._store_options(await self.call('wp.getOptions', self.blogId, self.user, self.password))
+        return self.options
+
+    async def get_last_post(self):
+        return (await self.get_recent_posts(1))[0]
+
+    @wordpress_call
+    async def get_recent_posts(self, numPosts=5):
+        posts = await self.call('metaWeblog.getRecentPosts', self.blogId, self.user,
+                                self.password, numPosts)
+        return [self._filterPost(post) for post in posts]
+
+    @wordpress_call
+    async def get_post(self, postId):
+        post = self._prefetched_posts.pop(str(postId), None)
+        if post is None:
+            post = await self.call('metaWeblog.getPost', str(postId), self.user, self.password)
+        return self._filterPost(post)
+
+    @wordpress_call
+    async def get_user_info(self):
+        if self.user_info is None:
+            self._store_user_info(await self.call('blogger.getUserInfo', '', self.user, self.password))
+        return self.user_info
+
+    @wordpress_call
+    async def get_users_blogs(self):
+        blogs = await self.call('blogger.getUsersBlogs', '', self.user, self.password)
+        return [wordpresslib.WordPressBlog.from_xmlrpc(blog) for blog in blogs]
+
+    @wordpress_call
+    async def new_post(self, post, publish):
+        id = int(await self._save_post('metaWeblog.newPost', [self.blogId], post, publish))
+        post.id = id
+        return id
+
+    @wordpress_call
+    async def new_page(self, page, publish):
+        id = int(await self._save_post('wp.newPage', [self.blogId], page, publish))
+        page.id = id
+        return id
+
+    @wordpress_call
+    async def edit_post(self, postId, post, publish):
+        """See WordPressClient.editPost."""
+        result = await self._save_post('metaWeblog.editPost', [postId], post, publish)
+        if result == 0:
+            raise WordPressException('Post edit failed')
+        return result
+
+    @wordpress_call
+    async def edit_page(self, pageId, post, publish):
+        result = await self._save_post('wp.editPage', [self.blogId, pageId], post, publish)
+        if result == 0:
+            raise WordPressException('Post edit failed')
+        return result
+
+    async def _save_post(self, method, args, post, publish):
+        blogContent = self._post_content(post)
+        result = await self.call(method, *(args+[self.user, self.password, blogContent, int(publish)]))
+        await self._learn_new_tags(post.tags)
+        return result
+
+    @wordpress_call
+    async def get_post_categories(self, postId):
+        categories = await self.call('mt.getPostCategories', postId, self.user, self.password)
+        return [self._filterCategory(cat) for cat in categories]
+
+    @wordpress_call
+    async def set_post_categories(self, postId, categories):
+        await self.call('mt.setPostCategories', postId, self.user, self.password, categories)
+
+    @wordpress_call
+    async def new_category(self, category, parent=None):
+        """See WordPressClient.newCategory."""
+        data = category.to_xmlrpc()
+        if parent:
+            if isinstance(parent, wordpresslib.WordPressCategory):
+                parent = parent.id
+            data['parent_id'] = parent
+
+        id = await self.call('wp.newCategory', self.blogId, self.user, self.password, data)
+        category.id = int(id)
+        await self._categories_index()
+        async with self._terms_lock():
+            if self.categories is not None:
+                self.categories.append(category)
+                self._category_index.add(category)
+                self._save_cached_terms('category', self.categories)
+        return category
+
+    @wordpress_call
+    async def delete_post(self, postId):
+        return await self.call('blogger.deletePost', '', postId, self.user, self.password)
+
+    @wordpress_call
+    async def get_categories(self):
+        async with self._terms_lock():
+            if self.categories is None:
+                self.categories = self._load_cached_terms('category', wordpresslib.WordPressCategory)
+            if self.categories is None:
+                self._store_categories(await self.call('wp.getTerms', self.blogId, self.user,
+                                                       self.password, 'category', {'hide_empty': 0}))
+        return self.categories
+
+    @wordpress_call
+    async def get_tags(self):
+        async with self._terms_lock():
+            if self.tags is None:
+                self.tags = self._load_cached_terms('post_tag', wordpresslib.WordPressTag)
+            if self.tags is None:
+                self._store_tags(await self.call('wp.getTerms', self.blogId, self.user,
+                                                 self.password, 'post_tag', {'hide_empty': 0}))
+        return self.tags
+
+    @wordpress_call
+    async def _learn_new_tags(self, tags):
+        """See WordPressClient._learn_new_tags."""
+        async with self._terms_lock():
+            if self.tags is None: return
+            known = self._tag_index.update(self.tags).by_name
+            new_tags = [t for t in tags if t.id is None and t.name not in known]
+
+        learned = []
+        for tag in new_tags:
+            found = await self.call('wp.getTerms', self.blogId, self.user, self.password,
+                                    'post_tag', {'search': tag.name, 'hide_empty': 0})
+            for t in found:
+                if t['name'] == tag.name:
+                    term = wordpresslib.WordPressTag.from_xmlrpc(t)
+                    tag.id = term.id
+                    learned.append(term)
+                    break
+
+        if learned:
+            async with self._terms_lock():
+                self._learned_tags(learned)
+
+    async def _tags_index(self):
+        return self._tag_index.update(await self.get_tags())
+
+    async def _categories_index(self):
+        return self._category_index.update(await self.get_categories())
+
+    async def get_category(self, name):
+        return (await self._categories_index()).by_name.get(name)
+
+    async def get_category_id_from_name(self, name):
+        c = await self.get_category(name)
+        if c:
+            return c.id
+
+    async def get_tag(self, name):
+        return (await self._tags_index()).by_name.get(name)
+
+    async def get_tag_id_from_name(self, name):
+        t = await self.get_tag(name)
+        if t:
+            return t.id
+
+    async def find_tag(self, name=None, slug=None, id=None, ignore_case=False):
+        """Look up a tag by exactly one of name, slug or id."""
+        return self._find_term(await self._tags_index(), name, slug, id, ignore_case)
+
+    async def find_category(self, name=None, slug=None, id=None, ignore_case=False):
+        """Look up a category by exactly one of name, slug or id."""
+        return self._find_term(await self._categories_index(), name, slug, id, ignore_case)
+
+    async def has_category(self, name):
+        return (await self.get_category_id_from_name(name)) != None
+
+    async def has_tag(self, name):
+        return (await self.get_tag_id_from_name(name)) != None
+
+    @wordpress_call
+    async def get_trackback_pings(self, postId):
+        return await self.call('mt.getTrackbackPings', postId)
+
+    @wordpress_call
+    async def publish_post(self, postId):
+        return (await self.call('mt.publishPost', postId, self.user, self.password)) == 1
+
+    @wordpress_call
+    async def get_pingbacks(self, postUrl):
+        return await self.call('pingback.extensions.getPingbacks', postUrl)
+
+    async def new_media_object(self, mediaFileName):
+        """Add new media object (image, movie, etc...)
+        """
+        return await self._upload_file(mediaFileName)
+
+    async def upload_file(self, filename, overwrite=False):
+        '''Same as new_media_object, but passes WP-specific fields'''
+        type = self.guess_mime_type(filename)
+        return await self._upload_file(filename, type=type, overwrite=overwrite)
+
+    @wordpress_call
+    async def _upload_file(self, mediaFileName, **fields):
+        # Streamed, like WordPressClient does; see StreamingRequest
+        request = StreamingRequest('metaWeblog.newMediaObject',
+                                   (self.blogId, self.user, self.password,
+                                    self._media_struct(mediaFileName, **fields)),
+                                   mediaFileName, CHUNK_SIZE)
+        result = await self.transport.request(request.methodname, request)
+        return result[0]['url']
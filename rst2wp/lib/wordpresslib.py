@@ -56,12 +56,18 @@ __license__ = "LGPL"
 
 import re
 import os
+import base64
+import collections
+import http.client
+import urllib.parse
+import uuid
 import xmlrpc.client
 import datetime
 import time
 from functools import wraps
 import mimetypes
 import warnings
+import threading
 
 class WordPressException(Exception):
     """Custom exception for WordPress client operations
@@ -213,6 +219,47 @@ class WordPressCategory(CategoryBase):
 
         return data
 
+class TermIndex(object):
+    """Lookup tables for a list of tags or categories.
+
+    Indexes by name, case-folded name, slug and id. The index notices
+    when it's asked about a different list, or the list has changed
+    length, and rebuilds itself. Where several terms share a key, the
+    first one in the list wins, same as a linear search would.
+    """
+    def __init__(self):
+        self.terms = None
+        self.size = -1
+
+    def update(self, terms):
+        """Make sure the index reflects terms, and return it."""
+        if terms is self.terms and len(terms) == self.size:
+            return self
+
+        self.terms = terms
+        self.by_name = {}
+        self.by_folded_name = {}
+        self.by_slug = {}
+        self.by_id = {}
+        for term in terms:
+            self._add(term)
+        self.size = len(terms)
+        return self
+
+    def add(self, term):
+        """Index a term that was just appended to the list."""
+        self._add(term)
+        self.size = len(self.terms)
+
+    def _add(self, term):
+        self.by_name.setdefault(term.name, term)
+        self.by_folded_name.setdefault(term.name.casefold(), term)
+        if term.slug:
+            self.by_slug.setdefault(term.slug, term)
+        if term.id is not None:
+            self.by_id.setdefault(term.id, term)
+
+
 class WordPressPost(object):
     """Represents post item
     """
@@ -235,20 +282,243 @@ class WordPressPost(object):
         self.allowComments = allowComments or False
 
 
+class StreamingRequest(object):
+    """An XML-RPC request with the contents of a file as one of its
+    parameters, base64-encoded as it is sent.
+
+    Wherever the string FILE_PLACEHOLDER appears in params (it must
+    appear exactly once), the contents of filename go, as an XML-RPC
+    base64 value. This can be passed as the body to
+    xmlrpc.client.Transport.request: it has a len(), and iterating over
+    it produces the body a chunk at a time, so memory use depends on
+    chunk_size rather than the size of the file.
+    """
+    FILE_PLACEHOLDER = 'rst2wp-file-' + uuid.uuid4().hex
+
+    def __init__(self, methodname, params, filename, chunk_size=3*64*1024):
+        self.methodname = methodname
+        self.filename = filename
+        # Keep chunks on base64 boundaries so they can be encoded separately
+        self.chunk_size = max(3, chunk_size - chunk_size % 3)
+
+        request = xmlrpc.client.dumps(params, methodname, encoding='utf-8')
+        request = request.encode('utf-8', 'xmlcharrefreplace')
+        placeholder = '<value><string>{0}</string></value>'.format(self.FILE_PLACEHOLDER)
+        head, placeholder, tail = request.partition(placeholder.encode('utf-8'))
+        if not placeholder or self.FILE_PLACEHOLDER.encode('utf-8') in tail:
+            raise ValueError("need exactly one FILE_PLACEHOLDER in params")
+
+        self.head = head + b'<value><base64>'
+        self.tail = b'</base64></value>' + tail
+        self.size = os.path.getsize(filename)
+
+    def __len__(self):
+        encoded_size = 4 * ((self.size + 2) // 3)
+        return len(self.head) + encoded_size + len(self.tail)
+
+    def __iter__(self):
+        yield self.head
+        with open(self.filename, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                # Short reads are only OK at the end of the file
+                while chunk and len(chunk) % 3:
+                    more = f.read(self.chunk_size - len(chunk))
+                    if not more: break
+                    chunk += more
+                if not chunk: break
+                yield base64.b64encode(chunk)
+        yield self.tail
+
+
+class _CountingResponse(object):
+    """Wraps an HTTPResponse to count the bytes read from it."""
+    def __init__(self, response):
+        self.response = response
+        self.count = 0
+
+    def getheader(self, *args):
+        return self.response.getheader(*args)
+
+    def read(self, *args):
+        data = self.response.read(*args)
+        self.count += len(data)
+        return data
+
+
+class CallTotals(collections.namedtuple('CallTotals', 'calls seconds sent received',
+                                        defaults=(0, 0.0, 0, 0))):
+    """How many calls a transport has made, how long they took and
+    how many bytes they sent and received, all told."""
+    def add(self, seconds, sent, received):
+        return CallTotals(self.calls + 1, self.seconds + seconds,
+                          self.sent + sent, self.received + received)
+
+
+class PooledTransport(xmlrpc.client.Transport):
+    """An XML-RPC transport that can be shared between threads.
+
+    The stock Transport keeps a single connection alive, and can only
+    be used by one thread at a time. This one keeps a pool of up to
+    pool_size persistent (HTTP/1.1 keep-alive) connections; each call
+    borrows one, and puts it back when the response has been read. If
+    pool_size calls are already in progress, the next one waits.
+
+    If gzip is true, requests are gzip-encoded (responses are accepted
+    gzipped either way). Every call's duration and size is added to
+    totals, a CallTotals, and passed on to timings.rpc() if timings
+    has been set (see rst2wp.timings).
+    """
+    # Don't bother compressing requests smaller than this
+    GZIP_THRESHOLD = 1400
+    timings = None
+    _METHOD_RE = re.compile(br'<methodName>([^<]*)</methodName>')
+
+    def __init__(self, https=False, pool_size=4, gzip=False, timeout=None, context=None):
+        xmlrpc.client.Transport.__init__(self)
+        self.https = https
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.context = context
+        if gzip:
+            self.encode_threshold = self.GZIP_THRESHOLD
+
+        self.totals = CallTotals()
+        self.connections_opened = 0
+        # (host, connection) for connections not in use
+        self._idle = []
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        # The connection (if any) the current thread has borrowed
+        self._local = threading.local()
+
+    def request(self, host, handler, request_body, verbose=False):
+        start = time.perf_counter()
+        self._local.received = 0
+        self._slots.acquire()
+        try:
+            return xmlrpc.client.Transport.request(self, host, handler,
+                                                   request_body, verbose)
+        finally:
+            self._give_back()
+            self._slots.release()
+            self._record(request_body, start)
+
+    def make_connection(self, host):
+        borrowed = getattr(self._local, 'connection', None)
+        if borrowed and borrowed[0] == host:
+            return borrowed[1]
+
+        connection = None
+        with self._pool_lock:
+            for i, (idle_host, idle) in enumerate(self._idle):
+                if idle_host == host:
+                    connection = self._idle.pop(i)[1]
+                    break
+
+        if connection is None:
+            connection = self._new_connection(host)
+        self._local.connection = (host, connection)
+        return connection
+
+    def _new_connection(self, host):
+        chost, self._extra_headers, x509 = self.get_host_info(host)
+        with self._pool_lock:
+            self.connections_opened += 1
+        if self.https:
+            return http.client.HTTPSConnection(chost, timeout=self.timeout,
+                                               context=self.context, **(x509 or {}))
+        return http.client.HTTPConnection(chost, timeout=self.timeout)
+
+    def _give_back(self):
+        borrowed = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        if borrowed:
+            with self._pool_lock:
+                self._idle.append(borrowed)
+
+    def close(self):
+        """Drop the current thread's connection, after an error.
+
+        The idle connections to the same host have probably gone stale
+        for the same reason, so drop those too."""
+        borrowed = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        if not borrowed:
+            return
+        host, connection = borrowed
+        connection.close()
+        with self._pool_lock:
+            stale = [c for h, c in self._idle if h == host]
+            self._idle = [(h, c) for h, c in self._idle if h != host]
+        for connection in stale:
+            connection.close()
+
+    def close_all(self):
+        with self._pool_lock:
+            idle, self._idle = self._idle, []
+        for host, connection in idle:
+            connection.close()
+
+    def send_content(self, connection, request_body):
+        if not isinstance(request_body, bytes):
+            # A StreamingRequest; don't try to compress it
+            connection.putheader("Content-Length", str(len(request_body)))
+            connection.endheaders(request_body)
+            return
+        xmlrpc.client.Transport.send_content(self, connection, request_body)
+
+    def parse_response(self, response):
+        response = _CountingResponse(response)
+        try:
+            return xmlrpc.client.Transport.parse_response(self, response)
+        finally:
+            self._local.received = response.count
+
+    def _record(self, request_body, start):
+        seconds = time.perf_counter() - start
+        method = getattr(request_body, 'methodname', None)
+        if method is None:
+            match = self._METHOD_RE.search(request_body[:200])
+            method = match.group(1).decode('utf-8') if match else '?'
+        sent, received = len(request_body), self._local.received
+        with self._pool_lock:
+            self.totals = self.totals.add(seconds, sent, received)
+        if self.timings is not None:
+            self.timings.rpc(method, start, seconds, sent, received)
+
+    def summary(self):
+        """One line describing all the calls made so far."""
+        with self._pool_lock:
+            totals = self.totals
+            opened = self.connections_opened
+        return "{0} XML-RPC calls in {1:.2f}s over {2} connections; {3} bytes sent, {4} received".format(
+            totals.calls, totals.seconds, opened, totals.sent, totals.received)
+
+
 def wordpress_call(func):
-    '''Decorator that handles the try/catch XMLRPC wrapping'''
+    '''Decorator that handles the try/catch XMLRPC wrapping, and times
+    the call if the client has timings (see rst2wp.timings).'''
+    name = func.__name__.lstrip('_')
     @wraps(func)
-    def call(*args, **kwargs):
+    def call(self, *args, **kwargs):
         try:
-            return func(*args, **kwargs)
+            if self.timings is None:
+                return func(self, *args, **kwargs)
+            with self.timings.span(name, 'rpc'):
+                return func(self, *args, **kwargs)
         except xmlrpc.client.Fault as fault:
             raise WordPressException(fault)
 
     return call
 
-class WordPressClient(object):
-    """Client for connect to WordPress XML-RPC interface
+class WordPressClientBase(object):
+    """What WordPressClient and AsyncWordPressClient have in common:
+    what they know about the blog, and turning XML-RPC structs into
+    objects and back. Nothing here talks to the server.
     """
+    # Times every call if set; see rst2wp.timings
+    timings = None
 
     def __init__(self, url, user, password):
         self.url = url
@@ -257,7 +527,18 @@ class WordPressClient(object):
         self.blogId = 0
         self.categories = None
         self.tags = None
-        self._server = xmlrpc.client.ServerProxy(self.url)
+        self.options = None
+        self.user_info = None
+        # Posts fetched by prefetch(), by id, until get_post asks for them
+        self._prefetched_posts = {}
+        # Whether the server has system.multicall; None until we know
+        self._multicall = None
+        # Optional persistent cache of tags and categories; see
+        # rst2wp.termcache.TermCache for the interface.
+        self.term_cache = None
+        self._terms_fetched = {}
+        self._tag_index = TermIndex()
+        self._category_index = TermIndex()
 
     def _filterPost(self, post):
         """Transform post struct in WordPressPost instance
@@ -291,6 +572,131 @@ class WordPressClient(object):
         # FIXME: this doesn't seem very pythonic
         self.blogId = blogId
 
+    def _store_options(self, options):
+        # Options come back as {name: {'desc': ..., 'value': ...}}
+        self.options = options
+
+    def _store_user_info(self, userinfo):
+        self.user_info = WordPressUser.from_xmlrpc(userinfo)
+
+    def _marshal_categories_ids(self, categories):
+        for c in categories:
+            if c.id == -1:
+                raise TypeError("bad mojo -- categories need IDs")
+        return [{'categoryId': cat.id} for cat in categories]
+
+    def _marshal_tags_names(self, tags):
+        tag_data = []
+        for tag in tags:
+            # This would have hopefully allowed you use existing tags
+            # even if they had funny names. OH WELL.
+#             if tag.id:
+#                 tag_data.append(str(tag.id))
+#             else:
+            tag_data.append(tag.name)
+        return ','.join(tag_data)
+
+    def _marshal_categories_names(self, categories):
+        return [cat.name for cat in categories]
+
+    def _store_categories(self, categories):
+        self.categories = [self._filterCategory(cat) for cat in categories]
+        self._save_cached_terms('category', self.categories, time.time())
+
+    def _store_tags(self, tags):
+        self.tags = [WordPressTag.from_xmlrpc(t) for t in tags]
+        self._save_cached_terms('post_tag', self.tags, time.time())
+
+    def _load_cached_terms(self, taxonomy, cls):
+        if self.term_cache is None: return None
+        cached = self.term_cache.load(self.url, self.blogId, taxonomy)
+        if cached is None: return None
+
+        terms, self._terms_fetched[taxonomy] = cached
+        return [cls(**term) for term in terms]
+
+    def _save_cached_terms(self, taxonomy, terms, fetched=None):
+        if self.term_cache is None: return
+        if fetched is not None:
+            self._terms_fetched[taxonomy] = fetched
+        self.term_cache.save(self.url, self.blogId, taxonomy, terms,
+                             self._terms_fetched.get(taxonomy))
+
+    def _learned_tags(self, learned):
+        """Add tags found by _learn_new_tags to the list, unless
+        someone else has added them in the meantime. Call with the
+        lock held."""
+        if self.tags is None: return
+        index = self._tag_index.update(self.tags)
+        for term in learned:
+            if term.name not in index.by_name:
+                self.tags.append(term)
+                index.add(term)
+        self._save_cached_terms('post_tag', self.tags)
+
+    def _find_term(self, index, name, slug, id, ignore_case):
+        if name is not None:
+            if ignore_case:
+                return index.by_folded_name.get(name.casefold())
+            return index.by_name.get(name)
+        if slug is not None:
+            return index.by_slug.get(slug)
+        if id is not None:
+            return index.by_id.get(int(id))
+        raise TypeError("need a name, slug or id to look up")
+
+    def guess_mime_type(self, filename):
+        '''The MIME type upload_file sends for filename. Set this to
+        something that knows better, if you have it.'''
+        return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    def _post_content(self, post):
+        """The struct newPost and editPost want for post."""
+        blogContent = {
+            'title' : post.title,
+            'description' : post.description,
+            'permaLink' : post.permaLink,
+            'mt_allow_pings' : post.allowPings,
+            'mt_text_more' : post.textMore,
+            'mt_excerpt' : post.excerpt,
+            'mt_keywords': self._marshal_tags_names(post.tags),
+            'categories' : self._marshal_categories_names(post.categories),
+        }
+
+        if post.date:
+            # Convert date to UTC
+            blogContent['date_created_gmt'] = xmlrpc.client.DateTime(time.gmtime(time.mktime(post.date)))
+            print("Back-converting dateCreated:", post.date, blogContent['date_created_gmt'])
+
+        return blogContent
+
+    def _media_struct(self, filename, **fields):
+        """The struct newMediaObject wants for filename, with the file's
+        contents left as StreamingRequest.FILE_PLACEHOLDER."""
+        mediaStruct = {
+            'name' : os.path.basename(filename),
+            'bits' : StreamingRequest.FILE_PLACEHOLDER,
+        }
+
+        mediaStruct.update(fields)
+        return mediaStruct
+
+
+class WordPressClient(WordPressClientBase):
+    """Client for connect to WordPress XML-RPC interface
+    """
+    def __init__(self, url, user, password, transport=None):
+        WordPressClientBase.__init__(self, url, user, password)
+        # Guards the term lists, which are shared between threads
+        self._lock = threading.RLock()
+        # ServerProxy itself keeps no state between calls, so one can be
+        # shared by every thread as long as the transport can be.
+        if transport is None:
+            https = urllib.parse.urlsplit(url).scheme == 'https'
+            transport = PooledTransport(https=https)
+        self.transport = transport
+        self._server = xmlrpc.client.ServerProxy(url, transport=transport)
+
     def supportedMethods(self):
         """Get supported methods list
         """
@@ -301,9 +707,84 @@ class WordPressClient(object):
 
     supported_methods = supportedMethods
 
+    @wordpress_call
+    def prefetch(self, options=False, user_info=False, tags=False, categories=False, posts=()):
+        """Fetch several things at once, so that the get_options,
+        get_user_info, get_tags, get_categories and get_post calls that
+        follow don't need a round trip each.
+
+        Uses system.multicall if the server has it, and otherwise just
+        makes the calls one after the other. Anything already known is
+        skipped; anything that fails is left for the later call to
+        fetch (and fail) as usual.
+        """
+        calls = []
+        with self._lock:
+            if options and self.options is None:
+                calls.append((self._store_options, 'wp.getOptions',
+                              (self.blogId, self.user, self.password)))
+            if user_info and self.user_info is None:
+                calls.append((self._store_user_info, 'blogger.getUserInfo',
+                              ('', self.user, self.password)))
+            if tags and self.tags is None:
+                self.tags = self._load_cached_terms('post_tag', WordPressTag)
+                if self.tags is None:
+                    calls.append((self._store_tags, 'wp.getTerms',
+                                  (self.blogId, self.user, self.password, 'post_tag', {'hide_empty': 0})))
+            if categories and self.categories is None:
+                self.categories = self._load_cached_terms('category', WordPressCategory)
+                if self.categories is None:
+                    calls.append((self._store_categories, 'wp.getTerms',
+                                  (self.blogId, self.user, self.password, 'category', {'hide_empty': 0})))
+            for postId in posts:
+                if str(postId) not in self._prefetched_posts:
+                    calls.append((lambda post, postId=str(postId): self._prefetched_posts.__setitem__(postId, post),
+                                  'metaWeblog.getPost', (str(postId), self.user, self.password)))
+
+            results = self._call_many([(method, args) for store, method, args in calls])
+            for (store, method, args), (result, fault) in zip(calls, results):
+                if fault is None:
+                    store(result)
+
+    def _call_many(self, calls):
+        """Make calls, a list of (method name, args), in one round trip
+        if we can. Returns a list of (result, fault), where fault is
+        the xmlrpc.client.Fault if that call failed."""
+        if len(calls) > 1 and self._multicall is not False:
+            multicall = xmlrpc.client.MultiCall(self._server)
+            for method, args in calls:
+                getattr(multicall, method)(*args)
+            try:
+                results = multicall()
+            except xmlrpc.client.Fault:
+                # Probably "requested method system.multicall does not exist"
+                self._multicall = False
+            else:
+                self._multicall = True
+                out = []
+                for i in range(len(calls)):
+                    try:
+                        out.append((results[i], None))
+                    except xmlrpc.client.Fault as fault:
+                        out.append((None, fault))
+                return out
+
+        out = []
+        for method, args in calls:
+            function = self._server
+            for name in method.split('.'):
+                function = getattr(function, name)
+            try:
+                out.append((function(*args), None))
+            except xmlrpc.client.Fault as fault:
+                out.append((None, fault))
+        return out
+
     @wordpress_call
     def get_options(self):
-        return self._server.wp.getOptions(self.blogId, self.user, self.password)
+        if self.options is None:
+            self._store_options(self._server.wp.getOptions(self.blogId, self.user, self.password))
+        return self.options
 
     getOptions = get_options
 
@@ -329,7 +810,10 @@ class WordPressClient(object):
     def getPost(self, postId):
         """Get post item
         """
-        return self._filterPost(self._server.metaWeblog.getPost(str(postId), self.user, self.password))
+        post = self._prefetched_posts.pop(str(postId), None)
+        if post is None:
+            post = self._server.metaWeblog.getPost(str(postId), self.user, self.password)
+        return self._filterPost(post)
 
     get_post = getPost
 
@@ -337,8 +821,9 @@ class WordPressClient(object):
     def getUserInfo(self):
         """Get user info
         """
-        userinfo = self._server.blogger.getUserInfo('', self.user, self.password)
-        return WordPressUser.from_xmlrpc(userinfo)
+        if self.user_info is None:
+            self._store_user_info(self._server.blogger.getUserInfo('', self.user, self.password))
+        return self.user_info
 
     get_user_info = getUserInfo
 
@@ -353,6 +838,7 @@ class WordPressClient(object):
 
     get_users_blogs = getUsersBlogs
 
+    @wordpress_call
     def newPost(self, post, publish):
         """Insert new post
 
@@ -364,6 +850,7 @@ class WordPressClient(object):
 
     new_post = newPost
 
+    @wordpress_call
     def newPage(self, page, publish):
         # FIXME: probably wrong
         id = int(self._save_post('wp', 'newPage', [self.blogId], page, publish))
@@ -372,6 +859,7 @@ class WordPressClient(object):
 
     new_page = newPage
 
+    @wordpress_call
     def editPost(self, postId, post, publish):
         """Save post.
 
@@ -387,6 +875,7 @@ class WordPressClient(object):
 
     edit_post = editPost
 
+    @wordpress_call
     def editPage(self, pageId, post, publish):
         '''FIXME: hacked up extremely roughly'''
         result = self._save_post('wp', 'editPage', [self.blogId, pageId], post, publish)
@@ -397,50 +886,17 @@ class WordPressClient(object):
     edit_page = editPage
 
     def _save_post(self, namespace, method_name, args, post, publish):
-        blogContent = {
-            'title' : post.title,
-            'description' : post.description,
-            'permaLink' : post.permaLink,
-            'mt_allow_pings' : post.allowPings,
-            'mt_text_more' : post.textMore,
-            'mt_excerpt' : post.excerpt,
-            'mt_keywords': self._marshal_tags_names(post.tags),
-            'categories' : self._marshal_categories_names(post.categories),
-        }
-
-        if post.date:
-            # Convert date to UTC
-            blogContent['date_created_gmt'] = xmlrpc.client.DateTime(time.gmtime(time.mktime(post.date)))
-            print("Back-converting dateCreated:", post.date, blogContent['date_created_gmt'])
+        blogContent = self._post_content(post)
 
         # Get remote method: e.g. self._server.metaWeblog.editPost
         ns = getattr(self._server, namespace)
         meth = getattr(ns, method_name)
         # call remote method: arg0 is blogId for newPost, postId for editPost
         result = meth(*(args+[self.user, self.password, blogContent, int(publish)]))
+        self._learn_new_tags(post.tags)
 
         return result
 
-    def _marshal_categories_ids(self, categories):
-        for c in categories:
-            if c.id == -1:
-                raise TypeError("bad mojo -- categories need IDs")
-        return [{'categoryId': cat.id} for cat in categories]
-
-    def _marshal_tags_names(self, tags):
-        tag_data = []
-        for tag in tags:
-            # This would have hopefully allowed you use existing tags
-            # even if they had funny names. OH WELL.
-#             if tag.id:
-#                 tag_data.append(str(tag.id))
-#             else:
-            tag_data.append(tag.name)
-        return ','.join(tag_data)
-
-    def _marshal_categories_names(self, categories):
-        return [cat.name for cat in categories]
-
     @wordpress_call
     def getPostCategories(self, postId):
         """Get post's categories
@@ -478,7 +934,14 @@ class WordPressClient(object):
 
         id = self._server.wp.newCategory(self.blogId, self.user, self.password,
                                          data)
-        category.id = id
+        # As from_xmlrpc does, so ids compare equal to the ones we fetch
+        category.id = int(id)
+        with self._lock:
+            if self.categories is not None:
+                self._categories_index()
+                self.categories.append(category)
+                self._category_index.add(category)
+                self._save_cached_terms('category', self.categories)
         return category
 
     new_category = newCategory
@@ -512,15 +975,15 @@ class WordPressClient(object):
     @wordpress_call
     def getCategories(self):
         '''Returns more data then getCategoryList, including description'''
-        if not self.categories:
-            self.categories = []
-            categories = self._server.wp.getTerms(self.blogId,
-                                                  self.user,
-                                                  self.password,
-                                                  'category',
-                                                  {'hide_empty': 0})
-            for cat in categories:
-                self.categories.append(self._filterCategory(cat))
+        with self._lock:
+            if self.categories is None:
+                self.categories = self._load_cached_terms('category', WordPressCategory)
+            if self.categories is None:
+                self._store_categories(self._server.wp.getTerms(self.blogId,
+                                                                self.user,
+                                                                self.password,
+                                                                'category',
+                                                                {'hide_empty': 0}))
 
         return self.categories
 
@@ -528,44 +991,95 @@ class WordPressClient(object):
 
     @wordpress_call
     def getTags(self):
-        if not self.tags:
-            self.tags = []
-            tags = self._server.wp.getTerms(self.blogId,
-                                            self.user,
-                                            self.password,
-                                            'post_tag',
-                                            {'hide_empty': 0})
-
-            for t in tags:
-                self.tags.append(WordPressTag.from_xmlrpc(t))
+        with self._lock:
+            if self.tags is None:
+                self.tags = self._load_cached_terms('post_tag', WordPressTag)
+            if self.tags is None:
+                self._store_tags(self._server.wp.getTerms(self.blogId,
+                                                          self.user,
+                                                          self.password,
+                                                          'post_tag',
+                                                          {'hide_empty': 0}))
 
         return self.tags
 
     get_tags = getTags
 
+    @wordpress_call
+    def _learn_new_tags(self, tags):
+        """Find out the ids of tags that the server just created for us.
+
+        Tags are created implicitly when a post uses them, so we
+        don't get told their ids. Look them up one at a time (which is
+        much cheaper than fetching all the tags again). The lookups
+        are made without the lock, so other threads aren't kept
+        waiting on them.
+        """
+        with self._lock:
+            if self.tags is None: return
+            known = self._tags_index().by_name
+            new_tags = [t for t in tags if t.id is None and t.name not in known]
+
+        learned = []
+        for tag in new_tags:
+            found = self._server.wp.getTerms(self.blogId, self.user, self.password,
+                                             'post_tag',
+                                             {'search': tag.name, 'hide_empty': 0})
+            for t in found:
+                if t['name'] == tag.name:
+                    term = WordPressTag.from_xmlrpc(t)
+                    tag.id = term.id
+                    learned.append(term)
+                    break
+
+        if learned:
+            with self._lock:
+                self._learned_tags(learned)
+
+    def _tags_index(self):
+        tags = self.getTags()
+        with self._lock:
+            return self._tag_index.update(tags)
+
+    def _categories_index(self):
+        categories = self.getCategories()
+        with self._lock:
+            return self._category_index.update(categories)
+
     def getCategoryIdFromName(self, name):
         """Get category id from category name
         """
-        for c in self.getCategories():
-            if c.name == name:
-                return c.id
+        c = self.getCategory(name)
+        if c:
+            return c.id
 
     get_category_id_from_name = getCategoryIdFromName
 
+    def getCategory(self, name):
+        return self._categories_index().by_name.get(name)
+
+    get_category = getCategory
+
     def getTagIdFromName(self, name):
-        for t in self.getTags():
-            if t.name == name:
-                return t.id
+        t = self.getTag(name)
+        if t:
+            return t.id
 
     get_tag_id_from_name = getTagIdFromName
 
     def getTag(self, name):
-        for t in self.getTags():
-            if t.name == name:
-                return t
+        return self._tags_index().by_name.get(name)
 
     get_tag = getTag
 
+    def find_tag(self, name=None, slug=None, id=None, ignore_case=False):
+        """Look up a tag by exactly one of name, slug or id."""
+        return self._find_term(self._tags_index(), name, slug, id, ignore_case)
+
+    def find_category(self, name=None, slug=None, id=None, ignore_case=False):
+        """Look up a category by exactly one of name, slug or id."""
+        return self._find_term(self._categories_index(), name, slug, id, ignore_case)
+
     def has_category(self, name):
         return self.getCategoryIdFromName(name) != None
 
@@ -604,24 +1118,29 @@ class WordPressClient(object):
     def upload_file(self, filename, overwrite=False):
         '''Same as newMediaObject, but passes WP-specific fields'''
         # FIXME: this doesn't seem to overwrite anything. Not sure why.
-        return self.__upload_file(filename, type=mimetypes.guess_type(filename)[0],
-                                  overwrite=overwrite)
+        type = self.guess_mime_type(filename)
+        return self.__upload_file(filename, type=type, overwrite=overwrite)
 
     @wordpress_call
     def __upload_file(self, mediaFileName, **fields):
-        f = open(mediaFileName, 'rb')
-        mediaBits = f.read()
-        f.close()
-
-        mediaStruct = {
-            'name' : os.path.basename(mediaFileName),
-            'bits' : xmlrpc.client.Binary(mediaBits)
-        }
-
-        mediaStruct.update(fields)
+        mediaStruct = self._media_struct(mediaFileName, **fields)
 
         # N.B. wnp.uploadFile is alias for newMediaObject,
-        # so it doesn't matter which one we call
-        result = self._server.metaWeblog.newMediaObject(self.blogId,
-                                self.user, self.password, mediaStruct)
+        # so it doesn't matter which one we call.
+        # The file is streamed, rather than read into memory and
+        # encoded all at once; see StreamingRequest.
+        request = StreamingRequest('metaWeblog.newMediaObject',
+                                   (self.blogId, self.user, self.password, mediaStruct),
+                                   mediaFileName)
+        result = self._send_request(request)
         return result['url']
+
+    def _send_request(self, request):
+        """Send a prepared request body, the same way ServerProxy would."""
+        url = urllib.parse.urlsplit(self.url)
+        handler = urllib.parse.urlunsplit(['', '', url.path, url.query, url.fragment])
+        response = self.transport.request(url.netloc, handler or '/RPC2',
+                                          request, verbose=False)
+        if len(response) == 1:
+            response = response[0]
+        return response
@@ -0,0 +1,37 @@
+'''Manifest of what we last sent for each post.
+
+Publishing a post that hasn't changed is a waste of a getPost and an
+editPost (and the whole body goes over the wire again). The manifest
+remembers a hash of everything we send for a post, so that unchanged
+posts can be skipped without talking to the server at all.'''
+from __future__ import absolute_import
+import hashlib
+import json
+
+from . import configstore
+
+
+class Manifest(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self._store = configstore.ConfigStore()
+
+    @staticmethod
+    def digest(**data):
+        '''Hash data, which must be JSON-serializable.'''
+        encoded = json.dumps(data, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def get(self, post_id):
+        '''The digest recorded for post_id, or None.'''
+        return self._store.get([self.filename], 'post {0}'.format(post_id), 'digest')
+
+    def record(self, post_id, digest):
+        '''Remember digest for post_id. It's written to the file by
+        flush().'''
+        self._store.set(self.filename, 'post {0}'.format(post_id), 'digest', digest)
+
+    def flush(self):
+        '''Write what's been recorded, on top of whatever else is in
+        the file by now (another rst2wp may have been publishing too).'''
+        self._store.flush()
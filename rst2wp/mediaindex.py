@@ -0,0 +1,73 @@
+'''Index of the media we've uploaded, by content.
+
+The uploaded-* options only remember what was uploaded for a given
+directive URI, so the same picture used in two posts (or downloaded
+from two places) is uploaded twice. The media index maps the SHA-256
+of every file we upload to the URL WordPress gave it, so that a file
+whose bytes have been seen before is never sent again.
+
+Entries are per blog, since a URL on one blog is no use to another.'''
+from __future__ import absolute_import
+from __future__ import print_function
+import hashlib
+import urllib.request
+
+from . import configstore
+
+CHUNK_SIZE = 1024*1024
+
+
+def digest_stream(fp):
+    h = hashlib.sha256()
+    for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+        h.update(chunk)
+    return h.hexdigest()
+
+
+def digest_file(filename):
+    with open(filename, 'rb') as fp:
+        return digest_stream(fp)
+
+
+class MediaIndex(object):
+    def __init__(self, filename, url, blog_id):
+        self.filename = filename
+        self.blog = '{0} {1}'.format(url, blog_id)
+        self._store = configstore.ConfigStore()
+
+    def _section(self, digest):
+        return 'media {0} {1}'.format(self.blog, digest)
+
+    def get(self, digest):
+        '''The URL of the media with this digest, or None.'''
+        return self._store.get([self.filename], self._section(digest), 'url')
+
+    def record(self, digest, url):
+        self.record_many([(digest, url)])
+
+    def record_many(self, entries):
+        '''Remember where entries' media are. They're written to the
+        file straight away (on top of whatever else is in it by now),
+        so that if we die, what we've uploaded isn't uploaded again.'''
+        for digest, url in entries:
+            self._store.set(self.filename, self._section(digest), 'url', url)
+        self._store.flush()
+
+    def rebuild(self, urls, urlopen=urllib.request.urlopen):
+        '''Index media that was uploaded before we kept an index.
+
+        Each of urls is fetched from the blog and hashed. URLs that
+        can't be fetched are skipped. Returns the number indexed.'''
+        entries = []
+        for url in urls:
+            try:
+                with urlopen(url) as fp:
+                    digest = digest_stream(fp)
+            except (IOError, OSError, ValueError) as e:
+                print("Couldn't fetch {0}: {1}".format(url, e))
+                continue
+            print("Indexed {0}".format(url))
+            entries.append((digest, url))
+
+        self.record_many(entries)
+        return len(entries)
@@ -2,15 +2,13 @@ from __future__ import print_function
 from __future__ import absolute_import
 ## MyImageDirective: a replacement for the Image directive that
 ## insinuates transforms when necessary.
-import subprocess
-
 import docutils.parsers.rst.directives.images
 from docutils import core, io, nodes, utils
 from docutils.parsers.rst import roles, directives, languages
 
 import os.path
 
-from PIL import Image
+from . import imagecache
 from .directive import DownloadDirective
 
 # Arguments starting with form-* are all OK.
@@ -63,6 +61,10 @@ class MyImageDirective(directives.images.Image, DownloadDirective):
         self.document = self.state_machine.document
         self.process_parameters()
 
+        self.pipeline = self.get_pipeline()
+        if self.pipeline is not None:
+            return self.defer_image()
+
         self.compute_image()
 
         return directives.images.Image.run(self)
@@ -72,45 +74,133 @@ class MyImageDirective(directives.images.Image, DownloadDirective):
             return 'uploaded-'+desired_form
         return'uploaded'
 
-    def compute_image(self):
+    def desired_forms(self):
+        '''The forms we'll end up using: (desired_form, non_scaled_form).
+
+        non_scaled_form is what the scaled image links to, if there
+        is a scale and no explicit target; otherwise it's None.'''
         desired_form = ''
         if 'rotate' in self.options:
             desired_form = self.update_form(desired_form, 'rot{0}'.format(self.options['rotate']))
+        non_scaled_form = desired_form
 
         if 'scale' in self.options:
             desired_form = self.update_form(desired_form, 'scale{0}'.format(self.options['scale']))
 
         desired_form = self.form_to_attribute_name(desired_form)
+        non_scaled_form = self.form_to_attribute_name(non_scaled_form)
+        if 'scale' not in self.options or 'target' in self.options:
+            non_scaled_form = None
+
+        return desired_form, non_scaled_form
+
+    def compute_image(self):
+        desired_form, non_scaled_form = self.desired_forms()
 
         if self.document.settings.application.has_directive_info(self.document, 'image', self.uri, desired_form):
             self.arguments[0] = self.document.settings.application.get_directive_info(self.document, 'image', self.uri, desired_form)
-            if 'scale' in self.options and 'target' not in self.options:
+            if non_scaled_form:
                 # Link to non-scaled form.
                 # This could get super-complicated. We assume for
                 # simplicity here that the rotated version must exist
                 # if the rotated-and-scaled version exists.
-                non_scaled_form = ''
-                if 'rotate' in self.options:
-                    non_scaled_form = 'rot{0}'.format(self.options['rotate'])
-
-                non_scaled_form = self.form_to_attribute_name(non_scaled_form)
                 self.options['target'] = \
                     self.document.settings.application.get_directive_info(self.document, 'image', self.uri, non_scaled_form)
             return
 
+        self.generate_image()
+
+    def generate_image(self):
         self.current_form = ''
         self.current_uri = None
-        self.current_filename = self.download_image(self.uri)
-
-        self.run_exiftran()
-
-        if 'rotate' in self.options:
-            self.run_rotate()
-
-        if 'scale' in self.options:
-            self.run_scale()
+        self.current_filename = self.download_image(self.uri, getattr(self, 'target_filename', None))
+
+        forms = self.plan_forms()
+        self.make_forms(forms)
+        for form, step, filename in forms:
+            if step[0] == 'scale':
+                self.run_scale()
+            self.current_form = form
+            self.current_filename = filename
         self.upload()
 
+    def defer_image(self):
+        '''Build this image's nodes now, and leave generating and
+        uploading it to the pipeline. See rst2wp.pipeline.
+
+        Mirrors compute_image: an image whose desired form is already
+        stored, or will be uploaded by a directive earlier in the
+        document, isn't generated again.'''
+        app = self.document.settings.application
+        desired_form, non_scaled_form = self.desired_forms()
+        self.used_forms = []
+
+        stored = app.has_directive_info(self.document, 'image', self.uri, desired_form)
+        planned = (self.uri, desired_form) in self.pipeline.planned
+        if stored and not planned:
+            self.compute_image()
+            return directives.images.Image.run(self)
+
+        options = dict(self.options)
+        self.arguments[0] = self.pipeline.placeholder()
+        if stored or planned:
+            # Sequentially, we'd find the form an earlier directive
+            # uploaded, so keep :scale: just like compute_image would.
+            self.deferred_forms = (desired_form, non_scaled_form)
+            work = None
+        else:
+            self.deferred_forms = None
+            # run_scale will take care of :scale:
+            self.options.pop('scale', None)
+            self.pipeline.planned.add((self.uri, desired_form))
+            if non_scaled_form:
+                self.pipeline.planned.add((self.uri, non_scaled_form))
+            # Ask for a filename now, if we need to, rather than from a worker
+            self.target_filename = self.uri_filename(self.uri)
+            work = self.generate_image
+        if non_scaled_form:
+            self.options['target'] = self.pipeline.placeholder()
+
+        result = directives.images.Image.run(self)
+        self.image_node = result[-1]
+        self.reference_node = None
+        if isinstance(self.image_node, nodes.reference):
+            self.reference_node = self.image_node
+            self.image_node = self.reference_node[0]
+
+        # Image.run consumed some options, but the work needs them
+        self.options = options
+        self.pipeline.submit(self, work)
+        return result
+
+    def finish_deferred(self, saved, update_nodes):
+        '''Save what we uploaded, and put the URLs into our nodes.'''
+        app = self.document.settings.application
+        for key, url, fresh in self.used_forms:
+            if fresh and (self.uri, key) not in saved:
+                saved.add((self.uri, key))
+                app.save_directive_info(self.document, 'image', self.uri, key, url)
+
+        if not update_nodes: return
+
+        target = self.options.get('target')
+        if self.deferred_forms:
+            desired_form, non_scaled_form = self.deferred_forms
+            self.arguments[0] = self.lookup_form(desired_form)
+            if non_scaled_form:
+                target = self.lookup_form(non_scaled_form)
+
+        self.image_node['uri'] = directives.uri(self.arguments[0])
+        if self.reference_node is not None:
+            self.reference_node['refuri'] = target
+
+    def lookup_form(self, key):
+        '''The URL for a form, from this run or a previous one.'''
+        if (self.uri, key) in self.pipeline.planned:
+            url, fresh = self.pipeline.result(('upload', self.uri, key))
+            return url
+        return self.document.settings.application.get_directive_info(self.document, 'image', self.uri, key)
+
     def process_parameters(self):
         '''Store all the uploaded forms for this directive with canonical names in document.settings'''
         for key, value in list(self.options.items()):
@@ -129,71 +219,87 @@ class MyImageDirective(directives.images.Image, DownloadDirective):
         new_filename = "{head}-{suffix}{ext}".format(head=head, suffix=suffix, ext=ext)
         return new_filename
 
-    def run_exiftran(self):
-        # Easiest way to get EXIF-rotation images to work when scaled
-        # down.
-        # current_filename is at this point taken from the original
-        # image, so could have any weird casing of .jpg
-        name, ext = os.path.splitext(self.current_filename)
-        if not ext.lower() == '.jpg': return
-        subprocess.check_call(["exiftran", "-a", self.current_filename, '-i'])
-
-    def run_rotate(self):
-        # N.B. doesn't upload previous version, since we don't want
-        # people to see it.
-        degrees = self.options['rotate']
-        suffix = 'rot{degrees}'.format(degrees=degrees)
-
-        new_filename = self.filename_insert_before_extension(self.current_filename, suffix)
-        degrees = float(degrees)
-
-        image = Image.open(self.current_filename)
-        image = image.rotate(degrees)
-        image.save(new_filename)
-
-        self.current_filename = new_filename
-        self.current_form = self.update_form(self.current_form, suffix)
+    def plan_forms(self):
+        '''The forms we make from current_filename, in order, as (form,
+        step, filename). Each is the one before it with step applied;
+        see imagecache.transform.'''
+        forms = []
+        form, filename = self.current_form, self.current_filename
+        for option, prefix in [('rotate', 'rot'), ('scale', 'scale')]:
+            if option not in self.options: continue
+            suffix = '{prefix}{value}'.format(prefix=prefix, value=self.options[option])
+            form = self.update_form(form, suffix)
+            filename = self.filename_insert_before_extension(filename, suffix)
+            forms.append((form, (option, self.options[option]), filename))
+        return forms
+
+    def make_forms(self, forms):
+        '''Write the files for forms (from plan_forms), all from one
+        decoding of current_filename. Every form gets uploaded (the
+        scaled form links to the one before it), but forms that
+        already have been aren't needed, so they aren't written.'''
+        app = self.document.settings.application
+        steps = [step for form, step, filename in forms]
+        outputs = [None if app.has_directive_info(self.document, 'image', self.uri,
+                                                  self.form_to_attribute_name(form))
+                   else filename
+                   for form, step, filename in forms]
+
+        source = self.current_filename
+        cache = getattr(self.document.settings, 'image_cache', None)
+        def generate(keys):
+            # Files another directive is already writing are left to it
+            mine = [output if ('generate', output) in keys else None for output in outputs]
+            with self.span('transform', filename=source):
+                if isinstance(cache, imagecache.DerivedImageCache):
+                    cache.derive(source, steps, mine)
+                else:
+                    imagecache.transform(source, steps, mine)
+        self.once_many([('generate', output) for output in outputs if output], generate)
 
     def run_scale(self):
+        '''Upload the form to be scaled, for the scaled form to link to.'''
         # Remove option for 'scale' because html4css1 writer tries to
         # do its own scaling on top of ours if it's present.
-        scale = self.options.pop('scale')
-
-        suffix = 'scale{scale}'.format(scale=scale)
-        new_filename = self.filename_insert_before_extension(self.current_filename, suffix)
+        self.options.pop('scale')
 
         self.upload()
         self.options['target'] = self.current_uri
 
-        image = Image.open(self.current_filename)
-        if scale:
-            dimensions = factor = None
-            try:
-                factor = float(scale)
-                dimensions = image.size
-                dimensions = int(dimensions[0]*factor), int(dimensions[1]*factor)
-            except ValueError as e:
-                dimensions = scale.split('x')
-                dimensions = int(dimensions[0]), int(dimensions[1])
-
-        image.thumbnail(dimensions, Image.ANTIALIAS)
-        image.save(new_filename)
-
-        self.current_filename = new_filename
-        self.current_form = self.update_form(self.current_form, suffix)
-
     def upload(self):
         key = self.form_to_attribute_name(self.current_form)
-        if not self.document.settings.application.has_directive_info(self.document, 'image', self.uri, key):
-            if getattr(self.document.settings.application, 'preview', None):
-                self.arguments[0] = self.current_uri = os.path.join(os.getcwd(), self.current_filename)
-                return
-            else:
-                print("Uploading {0} (for {1})".format(self.current_filename, self.uri))
-                uploaded = self.document.settings.wordpress_instance.upload_file(self.current_filename)
-                self.document.settings.application.save_directive_info(self.document, 'image', self.uri, key, uploaded)
+        if self.pipeline is not None:
+            # Only one directive uploads each form; finish_deferred saves it
+            url, fresh = self.pipeline.once(('upload', self.uri, key),
+                                            lambda: self.upload_form(key))
+            self.used_forms.append((key, url, fresh))
+            self.arguments[0] = self.current_uri = url
+            return
+
+        url, fresh = self.upload_form(key)
+        if not fresh:
+            self.arguments[0] = self.current_uri = url
+            return
 
+        self.document.settings.application.save_directive_info(self.document, 'image', self.uri, key, url)
         self.arguments[0] = self.current_uri = \
             self.document.settings.application.get_directive_info(self.document, 'image', self.uri, key)
 
+    def upload_form(self, key):
+        '''Upload current_filename as the given form, unless it already
+        has been.
+
+        Returns (url, fresh), where fresh is True if the URL needs to
+        be saved.'''
+        app = self.document.settings.application
+        if app.has_directive_info(self.document, 'image', self.uri, key):
+            return app.get_directive_info(self.document, 'image', self.uri, key), False
+
+        if getattr(app, 'preview', None):
+            return os.path.join(os.getcwd(), self.current_filename), False
+
+        uploaded = self.upload_media(self.current_filename,
+                                     "Uploading {0} (for {1})".format(self.current_filename, self.uri))
+        return uploaded, True
+
 directives.register_directive('image', MyImageDirective)
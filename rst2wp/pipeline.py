@@ -0,0 +1,126 @@
+'''Run the slow parts of image:: and upload:: directives concurrently.
+
+Normally each directive downloads, transforms and uploads its file
+while the document is being parsed, one after the other. When the
+document settings have an image_pipeline, directives instead build
+their nodes straight away (with placeholders where the uploaded URLs
+go), and hand the work to the pipeline's thread pool.
+ImagePipelineTransform then waits for all of it and fills in the
+results, before anything else looks at the nodes.
+
+Results are applied in document order, and uploaded-* info is saved in
+the same order a sequential run would have saved it, so the output and
+the written-back file come out the same.'''
+from __future__ import absolute_import
+import concurrent.futures
+import threading
+
+import docutils.transforms
+
+
+class ImagePipeline(object):
+    def __init__(self, executor):
+        self.executor = executor
+        # (directive, future) in document order; future is None for
+        # directives that only need to look at other directives' results
+        self.jobs = []
+        # (uri, form) pairs that jobs already submitted will upload
+        self.planned = set()
+        self._once = {}
+        self._lock = threading.Lock()
+        self._placeholders = 0
+
+    def placeholder(self):
+        '''A unique URI to use until the real one is known.'''
+        self._placeholders += 1
+        return 'rst2wp-pending:{0}'.format(self._placeholders)
+
+    def submit(self, directive, work):
+        '''Run work() in the pool, if there is any; either way, call
+        directive.finish_deferred(saved, update_nodes) when the document
+        is resolved.'''
+        future = None
+        if work is not None:
+            future = self.executor.submit(work)
+        self.jobs.append((directive, future))
+
+    def once(self, key, fn):
+        '''Call fn() for the first caller with this key; everyone else
+        waits for and shares its result.
+
+        Used for work on files that several directives might share
+        (downloading the same URI, generating the same form) so it
+        isn't done twice, or twice at the same time.'''
+        with self._lock:
+            future = self._once.get(key)
+            owner = future is None
+            if owner:
+                future = self._once[key] = concurrent.futures.Future()
+
+        if owner:
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+
+        return future.result()
+
+    def once_many(self, keys, fn):
+        '''Like once, for work that does several things at once: fn is
+        called with the keys nobody has claimed yet, and has to do
+        all of them. Then wait for the rest.
+
+        Used when one decoding of an image makes several forms, some of
+        which another directive might be making.'''
+        with self._lock:
+            mine = [key for key in keys if key not in self._once]
+            for key in mine:
+                self._once[key] = concurrent.futures.Future()
+
+        if mine:
+            try:
+                fn(mine)
+            except BaseException as e:
+                for key in mine:
+                    self._once[key].set_exception(e)
+                raise
+            for key in mine:
+                self._once[key].set_result(None)
+
+        for key in keys:
+            self._once[key].result()
+
+    def result(self, key):
+        '''The result of a finished once() call.'''
+        return self._once[key].result()
+
+    def resolve(self):
+        '''Wait for all the submitted work and apply the results.
+
+        Every directive gets to save what it uploaded, even if another
+        one failed; then the first failure is raised.'''
+        jobs, self.jobs = self.jobs, []
+        futures = [future for directive, future in jobs if future is not None]
+        concurrent.futures.wait(futures)
+        errors = [future.exception() for future in futures
+                  if future.exception() is not None]
+
+        # Shared between directives, so each uploaded form is saved once
+        saved = set()
+        for directive, future in jobs:
+            directive.finish_deferred(saved, update_nodes=not errors)
+
+        if errors:
+            raise errors[0]
+
+
+class ImagePipelineTransform(docutils.transforms.Transform):
+    # Before references.Substitutions (220) copies image nodes out of
+    # substitution definitions
+    default_priority = 100
+
+    def apply(self):
+        pipeline = getattr(self.document.settings, 'image_pipeline', None)
+        if pipeline is not None:
+            pipeline.resolve()
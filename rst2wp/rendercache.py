@@ -0,0 +1,158 @@
+'''Cache of rendered posts.
+
+Rendering a post with docutils is the slowest part of republishing it
+when only its metadata has changed, and rendering the same source the
+same way always gives the same HTML. The render cache remembers, for
+each post, the publish_parts output and the fields rst2wp read from
+it, along with a key: a hash of everything that goes into the
+rendering (the source, the files it includes, the known links, the
+settings). If the key still matches, docutils isn't needed at all.'''
+from __future__ import absolute_import
+import hashlib
+import json
+import os.path
+import re
+import threading
+
+import docutils
+
+from . import utils
+from .manifest import Manifest
+
+INCLUDE = re.compile(r'^\s*\.\. include::\s*(\S.*?)\s*$', re.M)
+# The directives rst2wp stores info about (see get_directive_info),
+# including in substitution definitions
+DIRECTIVE = re.compile(r'^\s*\.\. (?:\|[^|]+\|\s+)?(image|upload)::\s*(\S.*?)\s*$', re.M)
+
+
+def include_digests(source_path, text, _seen=None):
+    '''Hashes of the files text includes, directly or indirectly, as a
+    list of [path, hash]; hash is None for files that don't exist.
+
+    Paths are relative to the file that includes them, as in
+    docutils. Standard includes (<isonum.txt>) come with docutils and
+    are left out.'''
+    seen = _seen if _seen is not None else set()
+    digests = []
+    directory = os.path.dirname(os.path.abspath(source_path))
+    for match in INCLUDE.finditer(text):
+        path = match.group(1)
+        if path.startswith('<') and path.endswith('>'):
+            continue
+        path = os.path.normpath(os.path.join(directory, path))
+        if path in seen:
+            continue
+        seen.add(path)
+
+        try:
+            with open(path, 'rb') as f:
+                contents = f.read()
+        except (IOError, OSError):
+            digests.append([path, None])
+            continue
+        digests.append([path, hashlib.sha256(contents).hexdigest()])
+        digests.extend(include_digests(path, contents.decode('utf-8', 'replace'), seen))
+
+    return digests
+
+
+def directive_uris(source_path, text, _seen=None):
+    '''The (directive, uri) of every image:: and upload:: in text and
+    the files it includes, in order, without repeats.'''
+    seen = _seen if _seen is not None else set()
+    uris = []
+    for match in DIRECTIVE.finditer(text):
+        directive, uri = match.groups()
+        if directive == 'image':
+            # As directives.uri does
+            uri = ''.join(uri.split())
+        if (directive, uri) not in uris:
+            uris.append((directive, uri))
+
+    directory = os.path.dirname(os.path.abspath(source_path))
+    for match in INCLUDE.finditer(text):
+        path = match.group(1)
+        if path.startswith('<') and path.endswith('>'):
+            continue
+        path = os.path.normpath(os.path.join(directory, path))
+        if path in seen:
+            continue
+        seen.add(path)
+
+        try:
+            with open(path) as f:
+                contents = f.read()
+        except (IOError, OSError, UnicodeDecodeError):
+            continue
+        for uri in directive_uris(path, contents, seen):
+            if uri not in uris:
+                uris.append(uri)
+
+    return uris
+
+
+class CachedSettings(object):
+    def __init__(self, settings):
+        self.__dict__.update(settings)
+
+
+class CachedDocument(object):
+    '''Stands in for the docutils document of a cached rendering. All
+    rst2wp looks at once a post is rendered is its settings.'''
+    def __init__(self, **settings):
+        self.settings = CachedSettings(settings)
+
+
+class RenderCache(object):
+    # Change this when a change to rst2wp changes the HTML it produces
+    VERSION = 1
+
+    def __init__(self, directory):
+        self.directory = directory
+        # Entries we've loaded or stored, by source path
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def key(cls, **data):
+        '''Hash everything that affects how a post renders. data must
+        be JSON-serializable.'''
+        return Manifest.digest(version=cls.VERSION, docutils=docutils.__version__, **data)
+
+    def _filename(self, source_path):
+        name = hashlib.sha1(os.path.abspath(source_path).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.json')
+
+    def get(self, source_path, key):
+        '''The entry stored for source_path, if its key is key: a dict
+        with parts (from publish_parts), fields and directive_uris.
+        Otherwise None.'''
+        source_path = os.path.abspath(source_path)
+        with self._lock:
+            entry = self._memory.get(source_path)
+        if entry is None:
+            try:
+                with open(self._filename(source_path)) as f:
+                    entry = json.load(f)
+            except (IOError, OSError, ValueError):
+                return None
+            with self._lock:
+                self._memory[source_path] = entry
+
+        if entry.get('key') != key:
+            return None
+        return entry
+
+    def put(self, source_path, key, parts, fields, directive_uris):
+        '''Store the rendering of source_path, replacing any older one.'''
+        source_path = os.path.abspath(source_path)
+        entry = {
+            'key': key,
+            'source_path': source_path,
+            'parts': dict(parts),
+            'fields': fields,
+            'directive_uris': directive_uris,
+            }
+        utils.atomic_write(self._filename(source_path), json.dumps(entry))
+        with self._lock:
+            self._memory[source_path] = entry
@@ -19,6 +19,10 @@ import configparser
 import sys
 import os.path
 import tempfile, subprocess, time, datetime
+import traceback
+import copy
+import concurrent.futures
+import multiprocessing
 from docutils import core, io, nodes, utils
 from docutils.readers import standalone
 import docutils.writers.html4css1
@@ -33,7 +37,24 @@ from . import my_image # registers MyImageDirective
 from . import upload   # registers UploadDirective
 from . import nodes    # monkeypatches nodes.field_list
 from . import validity
-from .config import IMAGES_LOCATION, POSTS_LOCATION, TEMP_FILES
+from . import downloads
+from . import editbuffer
+from . import filetypes
+from . import imagecache
+from . import configstore
+from . import knownlinks
+from . import manifest
+from . import mediaindex
+from . import pipeline
+from . import rendercache
+from . import sqlitestore
+from . import termcache
+from . import timings
+from . import watch
+from .config import IMAGES_LOCATION, POSTS_LOCATION, MANIFEST_LOCATION, TEMP_FILES
+from .config import TERMS_CACHE_LOCATION, MEDIA_INDEX_LOCATION, RENDER_CACHE_LOCATION
+from .config import KNOWN_LINKS_CACHE_LOCATION, METADATA_LOCATION, DERIVED_IMAGES_LOCATION
+from .config import DOWNLOADS_LOCATION
 
 
 class UsageError(Exception):
@@ -99,6 +120,8 @@ class WordPressReader(standalone.Reader):
 
     def get_transforms(self):
         transforms = standalone.Reader.get_transforms(self)
+        transforms.append(pipeline.ImagePipelineTransform)
+        transforms.append(knownlinks.KnownLinksTransform)
         if self.preview: return transforms
 
         transforms.insert(1, ValidityCheckerTransform)
@@ -111,6 +134,7 @@ class Application(object):
     def __init__(self):
         super(Application, self).__init__()
         self._config = None
+        self.config_store = configstore.ConfigStore()
 
     @property
     def config(self):
@@ -124,7 +148,7 @@ class Application(object):
             if not os.path.exists(filename): continue
             print("loading {0} from".format(config_name), filename)
             with open(filename) as f:
-                config.readfp(f)
+                config.read_file(f)
             print('config loaded')
 
     def _load_config(self):
@@ -153,7 +177,7 @@ class Application(object):
 
             path = os.path.join(BaseDirectory.save_config_path('rst2wp'), 'wordpressrc')
             print('Need configuration! Edit %s'%(path,))
-            with open(path, 'wb') as fp:
+            with open(path, 'w') as fp:
                 config.write(fp)
             sys.exit()
 
@@ -166,35 +190,29 @@ class Application(object):
         self._config = config
         return config
 
-    def search_configs(self, configfile, section, key, default=None):
-        '''Looks through all configs named configfile for (section, key)'''
+    def config_filenames(self, configfile):
+        '''All the configs named configfile, most important first.
+        configfile can also be an absolute path.'''
+        filenames = []
         for dir in BaseDirectory.load_config_paths(self.config_name):
             filename = os.path.join(dir, configfile)
-            if not os.path.exists(filename): continue
-
-            config = configparser.ConfigParser()
-            with open(filename) as f:
-                config.readfp(f)
-            if not config.has_section(section): continue
+            if filename not in filenames:
+                filenames.append(filename)
+        return filenames
 
-            if not config.has_option(section, key): continue
-
-            return config.get(section, key)
-
-        return default
+    def search_configs(self, configfile, section, key, default=None):
+        '''Looks through all configs named configfile for (section, key)'''
+        return self.config_store.get(self.config_filenames(configfile), section, key, default)
 
 
 class Rst2Wp(Application):
-    def _known_link_stanza(self):
-        known_links = configparser.ConfigParser()
-        self._read_configs_into(known_links, 'known_links', 'known links')
-
-        links = []
-        for sectname in known_links.sections():
-            links.append('.. _`{name}`: {link}'.format(link=sectname,
-                                                       name=known_links.get(sectname, 'link')))
-
-        return '\n\n'+'\n'.join(links)
+    def create_known_links(self):
+        '''The KnownLinks from every known_links file in the config
+        directories.'''
+        filenames = [os.path.join(dir, 'known_links')
+                     for dir in BaseDirectory.load_config_paths(self.config_name)]
+        cache = os.path.join(KNOWN_LINKS_CACHE_LOCATION(), self.config_name + '.json')
+        return knownlinks.KnownLinks(filenames, cache)
 
     def __init__(self):
         super(Rst2Wp, self).__init__()
@@ -202,6 +220,12 @@ class Rst2Wp(Application):
         self.list_tags = False
         self.list_categories = False
         self.publish = None
+        self.filename = None
+        self.metadata = None
+        self.timings = timings.DISABLED
+        # filename -> what _save_post_updated last wrote there, so
+        # --watch can tell our own writes from the user's
+        self.write_backs = {}
 
     @property
     def data_storage(self):
@@ -216,9 +240,25 @@ class Rst2Wp(Application):
                             help='use alternate config (see README for details)')
         parser.add_argument('--dont-check-tags', action='store_true',
                             help="don't check categories/tags for existance")
-        group = parser.add_mutually_exclusive_group(required=True)
-        group.add_argument('filename', type=str, nargs='?',
-                            help='the ReStructuredText source file (optional if querying tags/categories)')
+        parser.add_argument('-f', '--force', action='store_true',
+                            help="send posts even if they haven't changed since they were last sent")
+        parser.add_argument('--refresh-terms', action='store_true',
+                            help="don't trust the cached list of tags and categories")
+        parser.add_argument('--rebuild-media-index', action='store_true',
+                            help="index media uploaded before rst2wp kept a media index, then exit")
+        parser.add_argument('--migrate-dotrc', action='store_true',
+                            help="copy the posts, images and media files into the data_storage = sqlite database, then exit")
+        parser.add_argument('filenames', metavar='filename', type=str, nargs='*',
+                            help='the ReStructuredText source file(s) (optional if querying tags/categories)')
+        parser.add_argument('--batch', metavar='DIR', action='append', default=[],
+                            help="publish every .rst file found under DIR (may be repeated)")
+        parser.add_argument('--watch', metavar='DIR', action='append', default=[],
+                            help="keep running, and publish .rst files under DIR whenever they change (may be repeated)")
+        parser.add_argument('--timings', dest='show_timings', action='store_true',
+                            help="print a table of where the time went")
+        parser.add_argument('--profile', metavar='FILE',
+                            help="write a trace of where the time went to FILE, in Chrome trace format")
+        group = parser.add_mutually_exclusive_group()
         group.add_argument('--list-tags', action='store_true',
                             help="list available tags for this Wordpress instance")
         group.add_argument('--list-categories', action='store_true',
@@ -233,6 +273,32 @@ class Rst2Wp(Application):
         options = parser.parse_args(args, self)
         if isinstance(self.alt_config, str): self.config_name = self.alt_config
 
+        querying = self.list_tags or self.list_categories or self.rebuild_media_index or \
+            self.migrate_dotrc
+        if querying and (self.filenames or self.batch or self.watch):
+            parser.error("can't publish posts and query tags/categories at the same time")
+        if self.watch and (self.filenames or self.batch):
+            parser.error("--watch can't be used with filenames or --batch")
+        if not querying and not (self.filenames or self.batch or self.watch):
+            parser.error("need a filename, --batch, --watch, --list-tags or --list-categories")
+        if self.rebuild_media_index and self.preview:
+            parser.error("--rebuild-media-index needs to talk to the blog")
+
+    def collect_filenames(self):
+        '''All the files to publish: the filenames given on the command
+        line, followed by the .rst files under each --batch directory.'''
+        filenames = list(self.filenames)
+        for top in self.batch:
+            found = []
+            for dirpath, dirnames, files in os.walk(top):
+                # uploads/ only ever holds files we downloaded or generated
+                dirnames[:] = sorted(d for d in dirnames if d != 'uploads')
+                found.extend(os.path.join(dirpath, f) for f in files
+                             if f.endswith('.rst'))
+            filenames.extend(sorted(found))
+
+        return filenames
+
     def prompt(self, msg):
         return input(msg)
 
@@ -242,54 +308,80 @@ class Rst2Wp(Application):
             section = 'post ' + self.filename
             self._save_config_info(section, key, value)
 
+        if data_storage == 'sqlite':
+            self.metadata.set_post(self.filename, key, value)
+
         if data_storage in ['both', 'file']:
             self.replace_field(document, key, value)
 
-        self._save_post_updated()
-
     def save_directive_info(self, document, directive, url, key, value):
         data_storage = self.data_storage
         if data_storage in ['both', 'dotrc']:
             section = directive + ' ' + url
             self._save_config_info(section, key, value, location=IMAGES_LOCATION)
 
+        if data_storage == 'sqlite':
+            self.metadata.set_directive(directive, url, key, value)
+
         if data_storage in ['both', 'file']:
             self.replace_directive(document, directive, url, key, value)
             # Also update document.settings with the new info.
             document.settings.directive_uris[directive][url+'.'+key] = value
 
-        self._save_post_updated()
-
     def _save_config_info(self, section, key, value, location=None):
+        '''Store (section, key) in a dotrc file. The file is written
+        when we're done with the post.'''
         location = location or POSTS_LOCATION
-        config = configparser.ConfigParser()
-        filename = location()
-        if os.path.exists(filename):
-            with open(filename) as f:
-                config.readfp(f)
-
-        if not config.has_section(section):
-            config.add_section(section)
-
-        config.set(section, key, value)
-        with open(filename, 'wb') as fp:
-            config.write(fp)
+        self.config_store.set(location(), section, key, value)
 
     def _save_post_updated(self):
-        # Save immediately, so as to not forget the location of an uploaded image
-        if self.should_save_file():
-            print("Saving file with new data")
-            open(self.filename, 'w').write(self.text)
+        '''Write the changes made by save_post_info and
+        save_directive_info back to the post, if there were any.
+
+        Called once, when we're done with the post, whether or not
+        publishing it worked. (If rst2wp dies before it gets here,
+        uploaded media aren't uploaded again next time, thanks to the
+        media index.)
+
+        If the file was changed while we were publishing it (easily
+        done with --watch), the changes are made to what's there now
+        instead, so nothing is lost. What we write then hasn't been
+        published, so it isn't recorded in write_backs, and --watch
+        publishes it again.'''
+        if not self.should_save_file():
+            return
+        text = self.edits.apply()
+        if text == self.text:
+            return
+
+        current = read_post(self.filename)
+        if current is None:
+            # Gone; don't bring it back
+            return
+        changed = current != self.text
+        if changed:
+            self.edits.text = current
+            text = self.edits.apply()
+
+        print("Saving file with new data")
+        self.text = text
+        utils.atomic_write(self.filename, self.text)
+        if not changed:
+            self.write_backs[self.filename] = text
 
     def get_post_info(self, document, key):
         '''Get stored information about a post.
 
         For data_storage=file, this means look at the bibliographic
         fields. For data_storage=dotrc, this means look through the
-        POSTS_LOCATION file and try to find the section about the post.'''
+        POSTS_LOCATION file and try to find the section about the post.
+        For data_storage=sqlite, it's in the posts table.'''
         if self.data_storage in ['both', 'file']:
             return document.settings.bibliographic_fields[key]
 
+        if self.data_storage == 'sqlite':
+            return self.metadata.get_post(self.filename, key)
+
         # FIXME: use document to get filename?
         section = "post " + self.filename
         return self.search_configs(POSTS_LOCATION(), section, key)
@@ -301,7 +393,8 @@ class Rst2Wp(Application):
         in the directive itself, which are then read into
         document.settings.directive_uris.  For data_storage=dotrc, it
         is stored under a correspondingly-named section in
-        IMAGES_LOCATION.
+        IMAGES_LOCATION. For data_storage=sqlite, it's in the
+        directives table.
         '''
         # Of course, this only really works with single-argument
         # directives.
@@ -313,16 +406,31 @@ class Rst2Wp(Application):
             if self.data_storage == 'file':
                 raise ValueError("uh oh.. don't know what the image URI should be for {uri}".format(uri=url))
 
+        if self.data_storage == 'sqlite':
+            return self.metadata.get_directive(directive, url, key)
+
         section = directive + ' ' + url
-        return self.search_configs(location(), section, key)
+        return self.search_configs(IMAGES_LOCATION(), section, key)
 
     def has_post_info(self, document, key):
         if self.data_storage in ['both', 'file']:
             return key in document.settings.bibliographic_fields
 
+        if self.data_storage == 'sqlite':
+            return self.metadata.get_post(self.filename, key) is not None
+
         section = 'post ' + self.filename
         return self._has_config_info(document, section, key)
 
+    def directive_items(self, directive, url):
+        '''Everything data_storage=dotrc or sqlite has stored about a
+        directive, as a sorted list of (key, value).'''
+        if self.data_storage == 'sqlite':
+            return self.metadata.directive_items(directive, url)
+
+        section = directive + ' ' + url
+        return self.config_store.items(self.config_filenames(IMAGES_LOCATION()), section)
+
     def has_directive_info(self, document, directive, url, key):
         if self.data_storage in ['both', 'file']:
             try:
@@ -330,65 +438,41 @@ class Rst2Wp(Application):
             except KeyError:
                 pass
 
+        if self.data_storage == 'sqlite':
+            return self.metadata.get_directive(directive, url, key) is not None
+
         return self._has_config_info(document, directive + ' ' + url, key, location=IMAGES_LOCATION)
 
     def _has_config_info(self, document, section, key, location=POSTS_LOCATION):
-        class NO_DEFAULT(object):
-            pass
-
-        return self.search_configs(location(), section, key, NO_DEFAULT) is not NO_DEFAULT
+        return self.config_store.has(self.config_filenames(location()), section, key)
 
 
     def replace_field(self, document, key, value):
         '''Inserts a bibliographic field into the header of an RST document.
 
-        Replaces an existing field of the same name.'''
-        keystring = ':{key}:'.format(key=key)
-        new_line = '{keystring} {value}'.format(keystring=keystring, value=value)
-
-        # Add field after other fields, or replace if exists
-        in_fields = False
-        lines = self.text.split('\n')
-        for i in range(len(lines)):
-            if ':' == lines[i][:1]:
-                in_fields = True
-            if not in_fields: continue
-            if '' == lines[i].strip():
-                # Didn't have that field
-                lines.insert(i, new_line)
-                break
-            if lines[i].startswith(keystring):
-                lines[i] = new_line
-                break
-
-        self.text = '\n'.join(lines)
-
-    def get_indent(self, s):
-        r = re.compile('^\s*')
-        m = r.search(s)
-        return m.end()
+        Replaces an existing field of the same name. The change is
+        made when the file is saved.'''
+        self.edits.set_field(key, value)
 
     def replace_directive(self, document, directive, uri, key, value):
-        '''Add a field to a URL-based directive.'''
-        r = re.compile('{name}::\s+({uri})'.format(name=directive, uri = re.escape(uri)))
-        lines = self.text.split('\n')
-
-        for i in range(len(lines)):
-            if r.search(lines[i]):
-                n = self.get_indent(lines[i])
-                # FIXME: check if it's already there
-                lines.insert(i+1, ((n+3)*' ')+':{key}: {value}'.format(key=key, value=value))
-
-        self.text = '\n'.join(lines)
+        '''Add a field to a URL-based directive, when the file is saved.'''
+        # FIXME: check if it's already there
+        self.edits.add_directive_option(directive, uri, key, value)
 
     def should_save_file(self):
         data_storage = self.config.get('config', 'data_storage')
         save_to_file = data_storage in ['both', 'file']
-        return self.text != open(self.filename).read() and save_to_file
+        return save_to_file and bool(self.edits)
 
     def create_client(self, url, username, password):
-        wp = wordpresslib.WordPressClient(url, username, password)
         config = self.config
+        gzip = config.has_option('config', 'compress_requests') and \
+            config.getboolean('config', 'compress_requests')
+        transport = wordpresslib.PooledTransport(
+            https=url.startswith('https:'), pool_size=self.connections, gzip=gzip)
+        wp = wordpresslib.WordPressClient(url, username, password, transport=transport)
+        if self.timings.enabled:
+            wp.timings = transport.timings = self.timings
 
         if not config.has_option('account', 'blog_id') or config.get('account', 'blog_id') == '':
             blogs = list(wp.get_users_blogs())
@@ -402,9 +486,111 @@ class Rst2Wp(Application):
 
         return wp
 
+    def create_term_cache(self):
+        '''A TermCache for the client, or None if config.term_cache_ttl is 0.'''
+        ttl = 3600
+        if self.config.has_option('config', 'term_cache_ttl'):
+            ttl = self.config.getint('config', 'term_cache_ttl')
+        if ttl <= 0:
+            return None
+        return termcache.TermCache(TERMS_CACHE_LOCATION(), ttl)
+
+    def create_render_cache(self):
+        '''A RenderCache, or None if config.render_cache is no.'''
+        if self.config.has_option('config', 'render_cache') and \
+                not self.config.getboolean('config', 'render_cache'):
+            return None
+        return rendercache.RenderCache(RENDER_CACHE_LOCATION())
+
+    def create_image_cache(self):
+        '''A DerivedImageCache, or None if config.image_cache is no.'''
+        if self.config.has_option('config', 'image_cache') and \
+                not self.config.getboolean('config', 'image_cache'):
+            return None
+        executor = None
+        if self.image_processes > 0:
+            # Not forked: we have threads and open connections
+            executor = concurrent.futures.ProcessPoolExecutor(
+                self.image_processes, mp_context=multiprocessing.get_context('spawn'))
+        max_size = 1024
+        if self.config.has_option('config', 'image_cache_size'):
+            max_size = max(0, self.config.getint('config', 'image_cache_size'))
+        return imagecache.DerivedImageCache(DERIVED_IMAGES_LOCATION(), executor,
+                                            max_size * 1024 * 1024)
+
+    def create_metadata_store(self):
+        '''A SqliteStore if config.data_storage is sqlite, otherwise None.'''
+        if self.data_storage != 'sqlite':
+            return None
+        return sqlitestore.SqliteStore(METADATA_LOCATION())
+
     def run(self, *args, **kwargs):
         if not args: args = sys.argv[1:]
         self.parse_args(args)
+        if self.show_timings or self.profile:
+            self.timings = timings.Timings()
+        try:
+            return self.run_stages()
+        finally:
+            self.report_timings()
+
+    def run_stages(self):
+        with self.timings.span('config'):
+            self.config
+        if self.migrate_dotrc:
+            return self.run_migrate_dotrc()
+        with self.timings.span('connect'):
+            self.connect()
+        filenames = self.collect_filenames()
+        with self.timings.span('prefetch'):
+            # With --watch, get ready for the posts that are there now
+            self.prefetch(filenames or self.watched_posts())
+
+        if not self.preview:
+            if self.list_tags:
+                return self.run_list_tags()
+            elif self.list_categories:
+                return self.run_list_categories()
+            elif self.rebuild_media_index:
+                return self.run_rebuild_media_index()
+
+        try:
+            if self.watch:
+                return self.run_watch()
+            if len(filenames) == 1 and not self.batch:
+                return self.publish_file(filenames[0])
+
+            return self.run_batch(filenames)
+        finally:
+            self.flush_manifest()
+            self.downloads.close()
+            if self.image_cache:
+                self.image_cache.close()
+            if self.VERBOSE and self.wp:
+                print(self.wp.transport.summary())
+
+    def flush_manifest(self):
+        '''Write the manifest. Done once per run (or per batch with
+        --watch) rather than per post, since each write is of the whole
+        file; losing what a crashed run recorded only means sending
+        some posts again. (The media index is written after each
+        upload, since sending media again costs much more.)'''
+        self.manifest.flush()
+
+    def report_timings(self):
+        '''Print the --timings table and write the --profile trace.'''
+        if self.show_timings:
+            print()
+            print(self.timings.summary())
+        if self.profile:
+            self.timings.write_trace(self.profile)
+            print("Wrote trace to {0}".format(self.profile))
+
+    def connect(self):
+        '''Load the config and open the connection to the blog.
+
+        This is done once per process, no matter how many posts we
+        publish.'''
         config = self.config
 
         url = config.get('account', 'url')
@@ -413,61 +599,247 @@ class Rst2Wp(Application):
         if config.has_option('account', 'verbose'):
             self.VERBOSE = config.get('account', 'verbose')
 
+        self.manifest = manifest.Manifest(MANIFEST_LOCATION())
+        self.render_cache = self.create_render_cache()
+        self.known_links = self.create_known_links()
+        self.metadata = self.create_metadata_store()
+        self.image_cache = self.create_image_cache()
+        self.downloads = downloads.DownloadManager(DOWNLOADS_LOCATION())
+        self.file_types = filetypes.TypeDetector()
+        # Shared by all the posts we publish, so the number of threads
+        # stays bounded even when posts are published in parallel
+        self.image_pool = None
+        if self.image_workers > 1:
+            self.image_pool = concurrent.futures.ThreadPoolExecutor(self.image_workers)
+
         print("Connecting to WP server at", url)
-        wp = None
+        self.wp = wp = None
+        self.media_index = None
         if not self.preview:
             self.wp = wp = self.create_client(url, username, password)
+            wp.guess_mime_type = self.file_types.mime_type
+            if self.metadata:
+                self.media_index = sqlitestore.SqliteMediaIndex(self.metadata, wp.url, wp.blogId)
+            else:
+                self.media_index = mediaindex.MediaIndex(MEDIA_INDEX_LOCATION(), wp.url, wp.blogId)
+            wp.term_cache = self.create_term_cache()
+            if wp.term_cache and self.refresh_terms:
+                wp.term_cache.invalidate(wp.url, wp.blogId)
+
+        return wp
+
+    def prefetch(self, filenames):
+        '''Ask the blog for everything publishing filenames will need,
+        in one round trip if it can do that.'''
+        wp = self.wp
+        if not wp:
+            return
+
+        new_posts = False
+        post_ids = []
+        for filename in filenames:
+            try:
+                post_id = self.peek_post_info(filename, 'id')
+                if not post_id:
+                    new_posts = True
+                elif not self.watch and self.will_fetch_post(filename, post_id):
+                    # (With --watch, most posts won't be published for
+                    # a while, if at all)
+                    post_ids.append(post_id)
+            except (IOError, OSError):
+                # Publishing it will say what's wrong
+                pass
+
+        wp.prefetch(options=self.VERBOSE,
+                    # Only needed for new posts
+                    user_info=new_posts,
+                    tags=bool(filenames) or self.list_tags,
+                    categories=bool(filenames) and not self.dont_check_tags or self.list_categories,
+                    posts=post_ids)
 
         if self.VERBOSE:
             options = wp.get_options()
             print("Talking to %s version %s"%(options['software_name'], options['software_version']))
 
-        if not self.preview:
-            if self.list_tags:
-                return self.run_list_tags()
-            elif self.list_categories:
-                return self.run_list_categories()
+    def peek_post_info(self, filename, key):
+        '''What get_post_info would say about key for the post in
+        filename, found without rendering the post. Only used to decide
+        what to prefetch, so it doesn't matter much if it's wrong.'''
+        if self.data_storage in ['both', 'file']:
+            with open(filename) as f:
+                match = re.search(r'^:{0}:\s*(\S.*?)\s*$'.format(key), f.read(), re.M)
+            if match:
+                return match.group(1)
+            if self.data_storage == 'file':
+                return None
 
-        with open(self.filename) as f:
-            self.text = text = f.read()
+        if self.data_storage == 'sqlite':
+            return self.metadata.get_post(filename, key)
 
-        # self.text is the version we eventually save;
-        # text is the version we render
-        text = text+self._known_link_stanza()
-        reader = WordPressReader(self.preview)
+        return self.search_configs(POSTS_LOCATION(), 'post ' + filename, key)
 
-        used_images = {}
-        writer = docutils.writers.html4css1.Writer()
-        writer.translator_class = MyTranslator
+    def will_fetch_post(self, filename, post_id):
+        '''Whether publishing filename, which is post post_id, is sure
+        to need the post from the blog: for its date, if we don't know
+        it, or to edit it, if it will be sent. Whether it will be sent
+        isn't known until it's been rendered, but it will be if it's
+        never been sent before or we're forcing it. Otherwise,
+        _publish_text fetches it if it has to, so that an unchanged
+        post costs nothing.'''
+        if self.peek_post_info(filename, 'date') is None:
+            return True
+        return self.force or self.manifest.get(post_id) is None
 
-        directive_uris = {'image': {}, 'upload': {}}
+    @property
+    def workers(self):
+        if self.config.has_option('config', 'workers'):
+            return max(1, self.config.getint('config', 'workers'))
+        return 1
 
-        categories = [self.config.get('config', 'default_category')]
-        if not self.dont_check_tags and not self.preview:
-            validity.Validity.verify_categories(wp, categories)
+    @property
+    def connections(self):
+        '''How many connections to keep open to the blog. By default,
+        enough for every thread that might be making calls at once.'''
+        if self.config.has_option('config', 'connections'):
+            return max(1, self.config.getint('config', 'connections'))
+        return self.workers + self.image_workers
 
-        # FIXME: probably a better way to ensure these are present
-        if not self.config.has_option('config', 'tab_width'):
-            self.config.set('config', 'tab_width', '4')
-            self.config.set('config', 'initial_header_level', '2')
+    @property
+    def image_workers(self):
+        if self.config.has_option('config', 'image_workers'):
+            return max(1, self.config.getint('config', 'image_workers'))
+        return 4
 
-        # Source path is for use include directive in rst file
-        output = core.publish_parts(source=text, writer=writer,
-                                    source_path=os.path.abspath(self.filename),
-                                    reader=reader,
-                                    settings_overrides={
-                'wordpress_instance' : wp,
-                'application': self,
-                'bibliographic_fields': {
-                    'categories': categories
-                    },
-                'directive_uris': directive_uris,
-                'used_images': used_images,
-                # FIXME: probably a nicer way to do this
-                'filename': self.filename,
-                'tab_width' : self.config.getint('config', 'tab_width'),
-                'initial_header_level' : self.config.getint('config', 'initial_header_level'),
-                })
+    @property
+    def image_processes(self):
+        '''How many processes rotate and scale images. 0 means the
+        image workers do it themselves.'''
+        if self.config.has_option('config', 'image_processes'):
+            return max(0, self.config.getint('config', 'image_processes'))
+        return os.cpu_count() or 1
+
+    def run_batch(self, filenames):
+        '''Publish each of filenames, reusing the connection.
+
+        With config.workers > 1, that many posts are rendered and sent
+        at once. A failure in one post doesn't stop the others. Prints
+        a summary at the end, and returns a nonzero exit status if
+        anything failed.'''
+        workers = min(self.workers, len(filenames))
+        if workers <= 1:
+            results = [self.publish_job(filename) for filename in filenames]
+            return self.print_batch_summary(results)
+
+        print("Publishing {0} posts with {1} workers".format(len(filenames), workers))
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            results = list(pool.map(self.publish_job, filenames))
+
+        return self.print_batch_summary(results)
+
+    def publish_job(self, filename):
+        '''Publish one post of a batch. Returns (filename, exception or None).
+
+        The post is published by a copy of this object, since
+        publish_file keeps per-post state (filename, text) on self.
+        The copy still shares our config, client and locks.'''
+        print()
+        print("==> {0}".format(filename))
+        try:
+            copy.copy(self).publish_file(filename)
+        except Exception as e:
+            traceback.print_exc()
+            return (filename, e)
+
+        return (filename, None)
+
+    @property
+    def watch_debounce(self):
+        '''How long a post has to be left alone after it changes before
+        --watch publishes it.'''
+        if self.config.has_option('config', 'watch_debounce'):
+            return max(0.0, self.config.getfloat('config', 'watch_debounce'))
+        return 1.0
+
+    def watched_posts(self):
+        return [filename for top in self.watch for filename in watch.find_posts(top)[0]]
+
+    def run_watch(self):
+        '''Publish the posts under the --watch directories whenever
+        they change, until interrupted.
+
+        Everything connect() set up (the connection, the tags and
+        categories, the render and image caches) is kept between
+        posts. A post is only published when what's in it has changed
+        since we last looked, so saving it without changes, or our
+        own writing back of ids and uploaded files, doesn't publish it
+        again.'''
+        watcher = watch.create_watcher(self.watch)
+        # filename -> what it said last time we looked
+        seen = {}
+        for filename in watcher.posts():
+            seen[filename] = read_post(filename)
+
+        print("Watching {0} for changes; press Ctrl-C to stop".format(', '.join(self.watch)))
+        try:
+            for filenames in watcher.batches(self.watch_debounce):
+                changed = []
+                for filename in filenames:
+                    text = read_post(filename)
+                    if text is None or text == seen.get(filename):
+                        continue
+                    seen[filename] = text
+                    if text != self.write_backs.get(filename):
+                        changed.append(filename)
+                if changed:
+                    self.run_batch(changed)
+                    self.flush_manifest()
+        except KeyboardInterrupt:
+            print()
+            print("Stopped watching")
+        finally:
+            watcher.close()
+
+    def print_batch_summary(self, results):
+        failures = [(filename, e) for filename, e in results if e is not None]
+        print()
+        print("Published {0} of {1} posts".format(len(results) - len(failures), len(results)))
+        for filename, error in results:
+            if error is None:
+                print("  ok      {0}".format(filename))
+            else:
+                # Some of our errors come with several lines of advice
+                message = (str(error).splitlines() or [''])[0]
+                print("  FAILED  {0}: {1}".format(filename, message or error.__class__.__name__))
+
+        if failures:
+            return 1
+
+    def publish_file(self, filename):
+        '''Render one post and upload it to the blog.'''
+        self.filename = filename
+        with open(self.filename) as f:
+            self.text = f.read()
+        self.edits = editbuffer.EditBuffer(self.text)
+
+        self.rendered = None
+
+        with self.timings.span('publish', filename=filename):
+            try:
+                return self._publish_text(self.text)
+            finally:
+                with self.timings.span('save'):
+                    self._save_post_updated()
+                    self.config_store.flush()
+                    if self.metadata:
+                        self.metadata.commit()
+                    self._cache_render()
+
+    def _publish_text(self, text):
+        wp = self.wp
+        config = self.config
+
+        with self.timings.span('render'):
+            output, document = self.render(text)
         #print yaml.dump(output, default_flow_style=False)
         body = output['body']
 
@@ -475,15 +847,12 @@ class Rst2Wp(Application):
             return self.run_preview(output)
 
 
-        fields = reader.document.settings.bibliographic_fields
+        fields = document.settings.bibliographic_fields
 
         categories = [wordpresslib.WordPressCategory(name=cat) for cat in fields['categories']]
         tags = []
         for tag in fields.get('tags', []):
-            if wp.has_tag(tag):
-                tags.append(wp.get_tag(tag))
-            else:
-                tags.append(wordpresslib.WordPressTag(name=tag))
+            tags.append(wp.get_tag(tag) or wordpresslib.WordPressTag(name=tag))
         # WP will replace \n with <br/>, which isn't what RST is
         # designed for. We short-circuit this by replacing all newlines
         # with spaces, which ought to be safe.
@@ -496,11 +865,12 @@ class Rst2Wp(Application):
             'description': body,
             }
 
-        if self.has_post_info(reader.document, 'id'):
+        if self.has_post_info(document, 'id'):
             new_post = False
-            post_id = self.get_post_info(reader.document, 'id')
+            post_id = self.get_post_info(document, 'id')
             post_id = str(post_id)
-            post = wp.get_post(post_id)
+            # Only fetched when needed; see below
+            post = None
         else:
             new_post = True
             post = None
@@ -511,16 +881,21 @@ class Rst2Wp(Application):
         # 3. Old post will retrieve publish and set
         # 4. Set :date: can only change in rst file manually
         # 5. :date: is NOT post last modify time, it's publish time in local dz
-        if not 'date' in fields:
+        date = fields.get('date')
+        if date is None and not new_post and self.has_post_info(document, 'date'):
+            # Where data_storage = dotrc or sqlite keep it
+            date = self.get_post_info(document, 'date')
+        if date is None:
             if new_post:
                 new_post_data['date'] = time.localtime()
             else:
+                post = wp.get_post(post_id)
                 # Convert post time in UTC to localtime
                 new_post_data['date'] = time.localtime(time.mktime(post.date) - time.timezone)
             # Write :date: field
-            self.save_post_info(reader.document, 'date', time.strftime("%Y-%m-%d %H:%M:%S", new_post_data['date']))
+            self.save_post_info(document, 'date', time.strftime("%Y-%m-%d %H:%M:%S", new_post_data['date']))
         else:
-            new_post_data['date'] = datetime.datetime.strptime(fields['date'], '%Y-%m-%d %H:%M:%S').timetuple()
+            new_post_data['date'] = datetime.datetime.strptime(date, '%Y-%m-%d %H:%M:%S').timetuple()
 
         # Publish priority:
         # 1. --publish/--no-publish
@@ -537,7 +912,15 @@ class Rst2Wp(Application):
             publish = config.getboolean('config', 'publish_default')
         if publish == None: publish = False
 
+        digest = self.post_digest(new_post_data, publish, fields.get('type'))
+        if not new_post and not self.force and self.manifest.get(post_id) == digest:
+            print("Post {0} hasn't changed since it was last sent; skipping.".format(post_id))
+            self.save_post_info(document, 'title', fields['title'])
+            return
+
         if not new_post:
+            if post is None:
+                post = wp.get_post(post_id)
             post.__dict__.update(new_post_data)
 
             if fields.get('type') == 'page':
@@ -554,9 +937,10 @@ class Rst2Wp(Application):
                 post_id = wp.new_page(post, publish)
             else:
                 post_id = wp.new_post(post, publish)
-            self.save_post_info(reader.document, 'id', str(post_id))
+            self.save_post_info(document, 'id', str(post_id))
 
-        self.save_post_info(reader.document, 'title', fields['title'])
+        self.manifest.record(post_id, digest)
+        self.save_post_info(document, 'title', fields['title'])
 
         # Print end messange and preview link
         print()
@@ -565,9 +949,145 @@ class Rst2Wp(Application):
 
         # No idea why I even wrote this in the first place.
         # for image_uri in used_images:
-        #     self.save_directive_info(reader.document, "image", image_uri,
+        #     self.save_directive_info(document, "image", image_uri,
         #                    'used in ' + str(post_id), fields['title'])
 
+    def render(self, text):
+        '''Render text (the contents of self.filename) with docutils.
+
+        Returns the publish_parts output, and the document (or, if it
+        came from the render cache, something that looks enough like
+        it).'''
+        wp = self.wp
+
+        # FIXME: probably a better way to ensure these are present
+        if not self.config.has_option('config', 'tab_width'):
+            self.config.set('config', 'tab_width', '4')
+            self.config.set('config', 'initial_header_level', '2')
+
+        categories = [self.config.get('config', 'default_category')]
+        if not self.dont_check_tags and not self.preview:
+            validity.Validity.verify_categories(wp, categories)
+
+        cached = self.cached_render(text)
+        if cached:
+            return cached
+
+        reader = WordPressReader(self.preview)
+
+        used_images = {}
+        writer = docutils.writers.html4css1.Writer()
+        writer.translator_class = MyTranslator
+
+        directive_uris = {'image': {}, 'upload': {}}
+
+        image_pipeline = None
+        if self.image_pool:
+            image_pipeline = pipeline.ImagePipeline(self.image_pool)
+
+        # Source path is for use include directive in rst file
+        output = core.publish_parts(source=text, writer=writer,
+                                    source_path=os.path.abspath(self.filename),
+                                    reader=reader,
+                                    settings_overrides={
+                'wordpress_instance' : wp,
+                'application': self,
+                'bibliographic_fields': {
+                    'categories': categories
+                    },
+                'directive_uris': directive_uris,
+                'image_pipeline': image_pipeline,
+                'media_index': self.media_index,
+                'image_cache': self.image_cache,
+                'download_manager': self.downloads,
+                'file_types': self.file_types,
+                'timings': self.timings,
+                'known_links': self.known_links,
+                'used_images': used_images,
+                # FIXME: probably a nicer way to do this
+                'filename': self.filename,
+                'tab_width' : self.config.getint('config', 'tab_width'),
+                'initial_header_level' : self.config.getint('config', 'initial_header_level'),
+                })
+
+        self.rendered = output, reader.document
+        return self.rendered
+
+    def render_key(self, text):
+        '''Hash of everything that affects how text renders.'''
+        images = None
+        if self.data_storage != 'file':
+            # What's stored about the images (and uploads) it uses,
+            # such as where they were uploaded to
+            images = [[directive, uri, self.directive_items(directive, uri)]
+                      for directive, uri in rendercache.directive_uris(self.filename, text)]
+
+        config = self.config
+        return rendercache.RenderCache.key(
+            source=text,
+            source_path=os.path.abspath(self.filename),
+            includes=rendercache.include_digests(self.filename, text),
+            known_links=self.known_links.digest,
+            tab_width=config.getint('config', 'tab_width'),
+            initial_header_level=config.getint('config', 'initial_header_level'),
+            default_category=config.get('config', 'default_category'),
+            data_storage=self.data_storage,
+            images=images,
+            preview=bool(self.preview),
+            blog=[self.wp.url, str(self.wp.blogId)] if self.wp else None,
+            )
+
+    def cached_render(self, text):
+        '''(output, document) from the render cache, or None.'''
+        cache = self.render_cache
+        if cache is None:
+            return None
+        entry = cache.get(self.filename, self.render_key(text))
+        if entry is None:
+            return None
+
+        print("{0} hasn't changed since it was last rendered; using the cached HTML.".format(self.filename))
+        document = rendercache.CachedDocument(
+            wordpress_instance=self.wp,
+            application=self,
+            bibliographic_fields=entry['fields'],
+            directive_uris=entry['directive_uris'],
+            )
+        # Rendering the post would have checked these
+        fields = entry['fields']
+        if 'tags' in fields:
+            validity.Validity.maybe_verify_tags(document, fields['tags'])
+        if 'categories' in fields:
+            validity.Validity.maybe_verify_categories(document, fields['categories'])
+        return entry['parts'], document
+
+    def _cache_render(self):
+        '''Remember the rendering of the post, under the key of the text
+        that will be read next time -- which includes any changes we've
+        written back to it.'''
+        cache = self.render_cache
+        if self.rendered is None or cache is None:
+            return
+        output, document = self.rendered
+        fields = dict(document.settings.bibliographic_fields)
+        # As they'll be read from the file
+        fields.update(self.edits.fields)
+        cache.put(self.filename, self.render_key(self.text), output,
+                  fields, document.settings.directive_uris)
+
+    def post_digest(self, post_data, publish, post_type):
+        '''Hash of everything we send to WordPress for a post.'''
+        return manifest.Manifest.digest(
+            blog=[self.wp.url, str(self.wp.blogId)],
+            title=post_data['title'],
+            description=post_data['description'],
+            tags=sorted(tag.name for tag in post_data['tags']),
+            categories=sorted(cat.name for cat in post_data['categories']),
+            date=time.strftime("%Y-%m-%d %H:%M:%S", post_data['date']),
+            publish=bool(publish),
+            type=post_type,
+            )
+
     def run_preview(self, output):
         body = output['body']
         fp = tempfile.NamedTemporaryFile(suffix='-rst2wp-preview.html',
@@ -591,9 +1111,51 @@ class Rst2Wp(Application):
         for category in categories:
             print('{name} (id {id})'.format(**category.__dict__))
 
+    def run_rebuild_media_index(self):
+        '''Fetch everything recorded in IMAGES_LOCATION (or the
+        directives table) and add it to the media index.'''
+        if self.metadata:
+            urls = self.metadata.uploaded_urls()
+        else:
+            urls = []
+            for section, items in self.config_store.sections(IMAGES_LOCATION()):
+                for key, value in items.items():
+                    if key.startswith('uploaded') and value not in urls:
+                        urls.append(value)
+
+        count = self.media_index.rebuild(urls)
+        print("Indexed {0} of {1} uploaded files".format(count, len(urls)))
+
+    def run_migrate_dotrc(self):
+        '''Copy the posts, images and media index files into the
+        database used by data_storage = sqlite. The files are left
+        alone, and running this again is harmless.'''
+        data_storage = self.data_storage
+        store = sqlitestore.SqliteStore(METADATA_LOCATION())
+        try:
+            posts, directives, media = store.import_dotrc(
+                self.config_store.sections(POSTS_LOCATION()),
+                self.config_store.sections(IMAGES_LOCATION()),
+                self.config_store.sections(MEDIA_INDEX_LOCATION()))
+        finally:
+            store.close()
+        print("Copied {0} posts, {1} directives and {2} media files into {3}".format(
+                posts, directives, media, store.filename))
+        if data_storage != 'sqlite':
+            print("Set data_storage = sqlite in the [config] section to use it")
+
+def read_post(filename):
+    '''What's in filename, or None if it's gone.'''
+    try:
+        with open(filename) as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
 def main():
     try:
-        Rst2Wp().run()
+        sys.exit(Rst2Wp().run())
     except UsageError as u:
         print(u.error_message())
         sys.exit(1)
@@ -0,0 +1,171 @@
+'''Post and directive metadata in an SQLite database.
+
+With data_storage = dotrc, everything rst2wp learns about posts and
+uploaded images goes into two INI files, which have to be parsed and
+written out whole. After a few years of blogging the images file can
+have tens of thousands of sections. With data_storage = sqlite, the
+same information is kept in indexed tables instead, and writing a
+value only touches that value.
+
+Tables:
+
+- posts: (filename, key) -> value, what's under "post <filename>" in
+  the posts file
+- directives: (directive, uri, key) -> value, what's under
+  "<directive> <uri>" in the images file
+- media: (blog, digest) -> url, the media index (see mediaindex)
+'''
+from __future__ import absolute_import
+import sqlite3
+import threading
+
+from .mediaindex import MediaIndex
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS posts (
+    filename TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (filename, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS directives (
+    directive TEXT NOT NULL,
+    uri TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (directive, uri, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS media (
+    blog TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (blog, digest)
+) WITHOUT ROWID;
+'''
+
+
+class SqliteStore(object):
+    def __init__(self, filename):
+        self.filename = filename
+        # Posts published in parallel share the connection, and so
+        # its transaction: whoever commits first saves everyone's
+        # changes. There's no transaction per post, and nothing is
+        # rolled back when a post fails, since what a post writes back
+        # (ids, uploaded media) is worth keeping either way, as it is
+        # with data_storage = file.
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        with self._lock:
+            self._db.execute('PRAGMA journal_mode = WAL')
+            self._db.executescript(SCHEMA)
+
+    def _get(self, sql, params):
+        with self._lock:
+            row = self._db.execute(sql, params).fetchone()
+        return row[0] if row else None
+
+    def get_post(self, filename, key):
+        return self._get('SELECT value FROM posts WHERE filename = ? AND key = ?',
+                         (filename, key))
+
+    def set_post(self, filename, key, value):
+        '''Change a value. It can be read back straight away, and is
+        saved by the next commit() or record_media(), whichever post
+        that's for.'''
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO posts VALUES (?, ?, ?)',
+                             (filename, key, value))
+
+    def get_directive(self, directive, uri, key):
+        return self._get('SELECT value FROM directives WHERE directive = ? AND uri = ? AND key = ?',
+                         (directive, uri, key))
+
+    def set_directive(self, directive, uri, key, value):
+        '''Like set_post.'''
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO directives VALUES (?, ?, ?, ?)',
+                             (directive, uri, key, value))
+
+    def directive_items(self, directive, uri):
+        '''Everything stored about a directive, as a sorted list of
+        (key, value).'''
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT key, value FROM directives WHERE directive = ? AND uri = ? ORDER BY key',
+                (directive, uri))
+            return [tuple(row) for row in rows]
+
+    def uploaded_urls(self):
+        '''Every URL recorded as an uploaded form of a directive.'''
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT DISTINCT value FROM directives WHERE key LIKE 'uploaded%' ORDER BY value")
+            return [row[0] for row in rows]
+
+    def get_media(self, blog, digest):
+        return self._get('SELECT url FROM media WHERE blog = ? AND digest = ?',
+                         (blog, digest))
+
+    def record_media(self, blog, entries):
+        '''Add (digest, url) entries to the media index. These are
+        saved straight away: they're what stops media being uploaded
+        again if we die before the post is finished.'''
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO media VALUES (?, ?, ?)',
+                                 [(blog, digest, url) for digest, url in entries])
+
+    def commit(self):
+        '''Save every change made so far.'''
+        with self._lock:
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+    def import_dotrc(self, posts, images, media):
+        '''Copy what's in the dotrc files into the database, in one
+        transaction. Each argument is a list of (section, {key:
+        value}), as returned by ConfigStore.sections. Returns the
+        number of posts, directives and media imported.'''
+        counts = [0, 0, 0]
+        with self._lock, self._db:
+            for section, items in posts:
+                if not section.startswith('post '):
+                    continue
+                filename = section[len('post '):]
+                self._db.executemany('INSERT OR REPLACE INTO posts VALUES (?, ?, ?)',
+                                     [(filename, key, value) for key, value in items.items()])
+                counts[0] += 1
+
+            for section, items in images:
+                if ' ' not in section:
+                    continue
+                directive, uri = section.split(' ', 1)
+                for key, value in items.items():
+                    self.set_directive(directive, uri, key, value)
+                counts[1] += 1
+
+            for section, items in media:
+                if not section.startswith('media ') or 'url' not in items:
+                    continue
+                blog, digest = section[len('media '):].rsplit(' ', 1)
+                self._db.execute('INSERT OR REPLACE INTO media VALUES (?, ?, ?)',
+                                 (blog, digest, items['url']))
+                counts[2] += 1
+
+        return tuple(counts)
+
+
+class SqliteMediaIndex(MediaIndex):
+    '''A MediaIndex kept in the media table of a SqliteStore.'''
+    def __init__(self, store, url, blog_id):
+        super(SqliteMediaIndex, self).__init__(store.filename, url, blog_id)
+        self.store = store
+
+    def get(self, digest):
+        return self.store.get_media(self.blog, digest)
+
+    def record_many(self, entries):
+        self.store.record_media(self.blog, entries)
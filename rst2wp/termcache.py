@@ -0,0 +1,63 @@
+'''On-disk cache of a blog's tags and categories.
+
+Fetching every term with wp.getTerms is the slowest part of publishing
+a post to a blog with lots of tags, and the list hardly ever changes.
+WordPressClient consults one of these (if it has one) before asking the
+server, and keeps it up to date as it creates new terms.'''
+from __future__ import absolute_import
+import hashlib
+import json
+import os
+import time
+
+from . import utils
+
+
+class TermCache(object):
+    def __init__(self, directory, ttl):
+        '''Cache terms in directory, trusting them for ttl seconds.'''
+        self.directory = directory
+        self.ttl = ttl
+
+    def _filename(self, url, blog_id, taxonomy):
+        blog = '{0} {1}'.format(url, blog_id).encode('utf-8')
+        return os.path.join(self.directory, '{0}-{1}.json'.format(
+                hashlib.sha1(blog).hexdigest(), taxonomy))
+
+    def load(self, url, blog_id, taxonomy):
+        '''Return (terms, fetched), where terms is a list of dicts and
+        fetched is when they were fetched; or None if there aren't any
+        cached (or they're too old).'''
+        filename = self._filename(url, blog_id, taxonomy)
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if data.get('url') != url or data.get('blog_id') != str(blog_id):
+            return None
+        if time.time() - data.get('fetched', 0) > self.ttl:
+            return None
+
+        return data['terms'], data['fetched']
+
+    def save(self, url, blog_id, taxonomy, terms, fetched=None):
+        '''Store terms (a list of WordPressTag/WordPressCategory).
+
+        fetched is when the list was last known to be complete; by
+        default, now. Incremental updates should pass the time of the
+        original fetch so they don't extend its lifetime.'''
+        data = {
+            'url': url,
+            'blog_id': str(blog_id),
+            'fetched': fetched or time.time(),
+            'terms': [term.__dict__ for term in terms],
+            }
+        utils.atomic_write(self._filename(url, blog_id, taxonomy), json.dumps(data))
+
+    def invalidate(self, url, blog_id, taxonomies=('post_tag', 'category')):
+        for taxonomy in taxonomies:
+            filename = self._filename(url, blog_id, taxonomy)
+            if os.path.exists(filename):
+                os.unlink(filename)
@@ -0,0 +1,142 @@
+'''Where the time goes: --timings and --profile.
+
+A Timings object records spans -- a named stretch of time on one
+thread, like "render" or "editPost" -- as rst2wp runs. Spans nest: the
+XML-RPC requests an editPost makes are spans inside the editPost
+span, which is inside the "publish" span for the post. The bytes each
+XML-RPC request sends and receives are counted, and added to every
+span it's inside, so you can see how much traffic a whole post
+caused as well as each call.
+
+At the end, summary() makes a table of the totals for each name, and
+chrome_trace() the lot in the Chrome trace event format, which
+chrome://tracing and https://ui.perfetto.dev can show as a timeline.
+
+When nothing asked for timings, DISABLED is used instead; its spans
+cost next to nothing and aren't kept.'''
+from __future__ import absolute_import
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+
+from . import utils
+
+Span = collections.namedtuple('Span', 'name category thread start seconds args')
+
+
+class Timings(object):
+    enabled = True
+
+    def __init__(self):
+        self.spans = []
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+        # The args of the spans we're in. A context variable rather
+        # than a thread-local, so that coroutines running at once in
+        # one thread (see asyncwordpresslib) each have their own.
+        self._open = contextvars.ContextVar('open_spans', default=())
+
+    @contextlib.contextmanager
+    def span(self, name, category='stage', **args):
+        '''Record the time the with block takes as a span called name.
+        args are kept with it, and shown in the trace.'''
+        token = self._open.set(self._open.get() + (args,))
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self._open.reset(token)
+            self.add(name, category, start, seconds, args)
+
+    def add(self, name, category, start, seconds, args=None):
+        '''Record a span that has already happened. start is a
+        time.perf_counter() value.'''
+        span = Span(name, category, threading.current_thread().name,
+                    start, seconds, args or {})
+        with self._lock:
+            self.spans.append(span)
+
+    def rpc(self, method, start, seconds, sent, received):
+        '''Record one XML-RPC request, and count its bytes towards the
+        spans this thread (or task) is in.'''
+        for args in self._open.get():
+            args['sent'] = args.get('sent', 0) + sent
+            args['received'] = args.get('received', 0) + received
+        self.add(method, 'xmlrpc', start, seconds, {'sent': sent, 'received': received})
+
+    def totals(self):
+        '''{(category, name): [count, seconds, longest, sent, received]},
+        in the order the names were first seen.'''
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        totals = collections.OrderedDict()
+        for span in spans:
+            total = totals.setdefault((span.category, span.name), [0, 0.0, 0.0, 0, 0])
+            total[0] += 1
+            total[1] += span.seconds
+            total[2] = max(total[2], span.seconds)
+            total[3] += span.args.get('sent', 0)
+            total[4] += span.args.get('received', 0)
+        return totals
+
+    def summary(self):
+        '''A table of where the time went, one line per kind of span.
+        Spans nest, so the times add up to more than the total.'''
+        lines = ["{0:<8} {1:<28} {2:>6} {3:>9} {4:>9} {5:>11} {6:>11}".format(
+            'kind', 'name', 'count', 'total', 'longest', 'sent', 'received')]
+        for (category, name), (count, seconds, longest, sent, received) in self.totals().items():
+            lines.append("{0:<8} {1:<28} {2:>6} {3:>8.3f}s {4:>8.3f}s {5:>11} {6:>11}".format(
+                category, name, count, seconds, longest, sent, received))
+        lines.append("{0:.3f}s in all".format(time.perf_counter() - self.origin))
+        return '\n'.join(lines)
+
+    def chrome_trace(self):
+        '''The spans as a Chrome trace (a dict ready for json.dump).'''
+        with self._lock:
+            spans = list(self.spans)
+        threads = {}
+        events = []
+        for span in sorted(spans, key=lambda span: span.start):
+            tid = threads.setdefault(span.thread, len(threads) + 1)
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': round((span.start - self.origin) * 1e6, 1),
+                'dur': round(span.seconds * 1e6, 1),
+                'pid': os.getpid(),
+                'tid': tid,
+                'args': span.args,
+                })
+        for thread, tid in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(),
+                           'tid': tid, 'args': {'name': thread}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_trace(self, filename):
+        utils.atomic_write(filename, json.dumps(self.chrome_trace(), indent=1))
+
+
+class DisabledTimings(Timings):
+    enabled = False
+
+    def __init__(self):
+        Timings.__init__(self)
+        self._nothing = contextlib.nullcontext()
+
+    def span(self, name, category='stage', **args):
+        return self._nothing
+
+    def add(self, name, category, start, seconds, args=None):
+        pass
+
+    def rpc(self, method, start, seconds, sent, received):
+        pass
+
+
+DISABLED = DisabledTimings()
@@ -8,6 +8,7 @@ from docutils.parsers.rst import roles, directives, languages
 from .config import IMAGES_LOCATION
 import magic  # needed to guess file types
 from .directive import DownloadDirective
+from .filetypes import TypeDetector
 
 from . import utils
 
@@ -25,45 +26,69 @@ class UploadDirective(DownloadDirective):
 
     def run(self):
         # FIXME: URL?
-        uri = self.arguments[0]
+        self.uri = self.arguments[0]
         self.document = self.state_machine.document
-        filename = self.download_image(uri)
-        basename = self.uri_filename(filename)
-        type = self.guess_type(filename)
-        new_url = self.options.get('uploaded')
-        if not new_url:
-            new_url = self.upload_file(filename)
-
-            document = self.document
-            app = document.settings.application
-            if not getattr(app, 'preview', None):
-                app.save_directive_info(document, 'upload', uri, 'uploaded', new_url)
+        self.para = nodes.paragraph()
+
+        self.pipeline = self.get_pipeline()
+        if self.pipeline is not None:
+            # Ask for a filename now, if we need to, rather than from a worker
+            self.target_filename = self.uri_filename(self.uri)
+            self.pipeline.submit(self, self.fetch)
+        else:
+            self.fetch()
+            self.save_uploaded()
+            self.fill_paragraph()
 
         node = nodes.container(classes=['wp-caption', 'alignleft'])
-        size = self.file_size(filename)
-        type = self.guess_type(filename)
+        node += self.para
 
-        reference = nodes.reference(refuri=new_url)
-        reference += nodes.Text(basename)
+        return [node, nodes.container(classes=['clear'])]
 
-        para = nodes.paragraph()
-        para.extend([nodes.Text("Uploaded: "), reference,
-                     nodes.Text(" ({type}, {size})".format(name=filename, type=type, size=size))])
+    def fetch(self):
+        '''Download the file and upload it, if it hasn't been already.'''
+        self.fresh = False
+        self.filename = self.download_image(self.uri, getattr(self, 'target_filename', None))
+        self.new_url = self.options.get('uploaded')
+        if not self.new_url:
+            self.new_url = self.upload_file(self.filename)
+            self.fresh = True
 
-        node += para
+        self.size = self.file_size(self.filename)
+        self.type = self.guess_type(self.filename)
 
-        return [node, nodes.container(classes=['clear'])]
+    def save_uploaded(self):
+        document = self.document
+        app = document.settings.application
+        if self.fresh and not getattr(app, 'preview', None):
+            app.save_directive_info(document, 'upload', self.uri, 'uploaded', self.new_url)
+
+    def fill_paragraph(self):
+        basename = self.uri_filename(self.filename)
+        reference = nodes.reference(refuri=self.new_url)
+        reference += nodes.Text(basename)
+
+        self.para.extend([nodes.Text("Uploaded: "), reference,
+                          nodes.Text(" ({type}, {size})".format(type=self.type, size=self.size))])
+
+    def finish_deferred(self, saved, update_nodes):
+        if getattr(self, 'fresh', False):
+            self.save_uploaded()
+        if update_nodes:
+            self.fill_paragraph()
 
     def upload_file(self, filename):
         if not self.state_machine.document.settings.wordpress_instance: return filename
-        print("Uploading {0}".format(filename))
-        self.wp = self.state_machine.document.settings.wordpress_instance
-        return self.wp.upload_file(filename)
+        return self.upload_media(filename, "Uploading {0}".format(filename))
 
     def file_size(self, filename):
         return utils.approximate_size(os.stat(filename).st_size)
 
     def guess_type(self, filename):
+        file_types = getattr(self.document.settings, 'file_types', None)
+        if isinstance(file_types, TypeDetector):
+            return file_types.describe(filename)
+
         m = magic.open(magic.MAGIC_NONE)
         m.load()
         type = m.file(filename)
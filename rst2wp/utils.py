@@ -1,4 +1,9 @@
 import re
+import os
+import tempfile
+
+PRE = re.compile("<pre( [^>]*)?>") # actual parsing? fuck that noise!
+END_PRE = re.compile("</pre>")      # whew, no </pre class="...">
 
 def replace_newlines(txt):
     '''Eliminate newlines from txt.
@@ -10,38 +15,69 @@ def replace_newlines(txt):
     whitespaces are identical to one whitespace.
 
     The only time this doesn't work is when handling <pre>
-    elements. Thus, we handle those specially.'''
-    start = 0                          # start eliminating from here
-    pre = re.compile("<pre( [^>]*)?>") # actual parsing? fuck that noise!
-    end_pre = re.compile("</pre>")     # whew, no </pre class="...">
-
-    # Loop invariant: start is the index at which text has already
-    # been processed. This means it either ends a </pre> or 0.
-    #
+    elements. Thus, we handle those specially.
+
+    The output is built up as a list of pieces and joined at the end,
+    so this is linear in the size of txt, however many <pre> blocks
+    it has.'''
+    pieces = []
+    done = 0                           # txt[:done] is already in pieces
+    start = 0                          # search for the next <pre> from here
+
     # <pre>hi there</pre>abcde fgh ijklm<pre>foo bar baz</pre>nopqrstu
-    # start -------------|
+    # start, done -------|
     # m.start() ------------------------|
     while True:
-        m = pre.search(txt, start)
+        if start < done:
+            # Only after a stray </pre> with no <pre> before it: the
+            # text from start to done has had its newlines replaced
+            # already, which can turn something like "<pre\n>" into a
+            # <pre>, so search what it looks like now.
+            seen = txt[start:done].replace('\n', ' ') + txt[done:]
+            m = PRE.search(seen)
+            m_start = m and m.start() + start
+        else:
+            m = PRE.search(txt, start)
+            m_start = m and m.start()
         if not m: break
 
-        txt = (txt[:start] +     # already replaced
-               txt[start:m.start()].replace('\n', ' ') +  # replace till next <pre>
-               txt[m.start():])    # <pre> and afterwards
+        if m_start > done:
+            pieces.append(txt[done:m_start].replace('\n', ' '))
+            done = m_start
 
-        # Indexes could change between start and m.start(), since
-        # that's where we replace text. (They don't, but whatever.)
-        # So to advance start, we search starting from start (instead
-        # of m.start()).
-        m = end_pre.search(txt, start)
+        # Searching from start rather than m_start means a stray
+        # </pre> before the <pre> counts as closing it. That's how
+        # it's always worked, so keep it.
+        m = END_PRE.search(txt, start)
+        if not m: break
 
-        if not m: break    # couldn't keep the invariant
+        if m.end() > done:
+            pieces.append(txt[done:m.end()])
+            done = m.end()
         start = m.end()
 
-    # No <pre> blocks between start and end of string, but still
-    # have to replace newlines there
-    txt = txt[:start] + txt[start:].replace('\n', ' ')
-    return txt
+    # No <pre> blocks left, but still have to replace newlines
+    pieces.append(txt[done:].replace('\n', ' '))
+    return ''.join(pieces)
+
+def atomic_write(filename, text):
+    '''Replace the contents of filename with text.
+
+    The new contents are written to a temporary file in the same
+    directory and renamed into place, so readers (and crashes) only
+    ever see the old file or the new one, never half of each.'''
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.'+os.path.basename(filename)+'.',
+                                   suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(text)
+        if os.path.exists(filename):
+            os.chmod(tmpname, os.stat(filename).st_mode & 0o7777)
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
 
 def list_wrap(obj):
     if isinstance(obj, list): return obj
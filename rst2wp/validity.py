@@ -3,6 +3,17 @@
 Encapsulates logic for whether to check existence of tags/categories,
 and how to check it based on a document.'''
 from __future__ import print_function
+from __future__ import absolute_import
+import sys
+import threading
+import weakref
+
+# Posts published in parallel mustn't ask their questions at the same
+# time, or about the same tag or category twice.
+_prompt_lock = threading.RLock()
+# client -> tags the user has agreed to create. They're only created
+# when a post using them is sent, so until then the blog doesn't know.
+_confirmed_tags = weakref.WeakKeyDictionary()
 
 class Validity(object):
     @classmethod
@@ -47,13 +58,24 @@ class Validity(object):
             raise ValueError("""Cannot use tags with ',' in the name.
 
 WordPress will break tags at commas. If you really want a tag with a comma, add it via the web interface.""")
-        if not wp.has_tag(tag):
-            tag = cls.read_tag(tag)
+        if wp.has_tag(tag):
+            return
+        with _prompt_lock:
+            confirmed = _confirmed_tags.setdefault(wp, set())
+            # Another post may have asked while we were waiting
+            if tag in confirmed or wp.has_tag(tag):
+                return
+            cls.read_tag(tag)
+            confirmed.add(tag)
 
     @classmethod
     def check_existing_category(cls, wp, cat):
-        if not wp.has_category(cat):
-            cat = cls.read_category(wp, cat)
+        if wp.has_category(cat):
+            return
+        with _prompt_lock:
+            # Another post may have created it while we were waiting
+            if not wp.has_category(cat):
+                cls.read_category(wp, cat)
 
     @classmethod
     def read_base(cls, name):
@@ -83,5 +105,9 @@ If you really want a tag with a comma in the name, create it via the web interfa
         data = cls.read_base(cat)
         parent_id = input("Parent id for {category} [none]: ".format(**fmt))
 
+        # From the client's own module: rst2wp.py imports wordpresslib
+        # from lib/ as a top-level module, and importing it again as
+        # rst2wp.lib.wordpresslib would give us a second set of classes
+        wordpresslib = sys.modules[wp.__class__.__module__]
         c = wordpresslib.WordPressCategory(parent_id=parent_id, **data)
         wp.new_category(c)
@@ -0,0 +1,193 @@
+'''Noticing when posts change, for --watch.
+
+A watcher keeps an eye on some directories and says which .rst files
+under them have been written to. InotifyWatcher asks the kernel to
+tell it (Linux only; it's called through ctypes, so there's nothing
+extra to install); PollingWatcher looks at every file's size and
+mtime every so often, which works anywhere. create_watcher() picks
+the best one there is.
+
+Editors often write a file several times when you save it (or save
+several files at once), so batches() waits until things have been
+quiet for a moment before it says what changed.
+
+As in --batch, uploads/ directories are skipped, since they only hold
+files rst2wp downloaded or generated.'''
+from __future__ import absolute_import
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+EVENT = struct.Struct('iIII')
+
+POLL_INTERVAL = 1.0
+
+
+def is_post(name):
+    '''Whether a file called name is one we publish. Hidden files are
+    left out, since editors' lock and backup files often are.'''
+    return name.endswith('.rst') and not name.startswith('.')
+
+
+def find_posts(top):
+    '''The posts under top, and the directories they're in.'''
+    posts, dirs = [], []
+    for dirpath, dirnames, files in os.walk(top):
+        dirnames[:] = sorted(d for d in dirnames if d != 'uploads')
+        dirs.append(dirpath)
+        posts.extend(os.path.join(dirpath, f) for f in sorted(files) if is_post(f))
+    return posts, dirs
+
+
+class Watcher(object):
+    def __init__(self, tops):
+        # Left as they were given, since posts' filenames are how
+        # data_storage = dotrc and sqlite find them
+        self.tops = list(tops)
+
+    def posts(self):
+        '''Every post there is now.'''
+        found = []
+        for top in self.tops:
+            found.extend(find_posts(top)[0])
+        return found
+
+    def wait(self, timeout=None):
+        '''The set of posts that have changed, once something has, or
+        after timeout seconds (when it might be empty).'''
+        raise NotImplementedError
+
+    def batches(self, debounce=1.0):
+        '''Yield lists of changed posts, each once they've stopped
+        changing for debounce seconds.'''
+        while True:
+            changed = self.wait()
+            while changed:
+                more = self.wait(debounce)
+                if not more:
+                    break
+                changed |= more
+            if changed:
+                yield sorted(changed)
+
+    def close(self):
+        pass
+
+
+class PollingWatcher(Watcher):
+    def __init__(self, tops, interval=POLL_INTERVAL):
+        Watcher.__init__(self, tops)
+        self.interval = interval
+        self.signatures = self._scan()
+
+    def _scan(self):
+        signatures = {}
+        for filename in self.posts():
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            signatures[filename] = st.st_mtime_ns, st.st_size
+        return signatures
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, max(0, deadline - time.monotonic()))
+            time.sleep(delay)
+
+            signatures = self._scan()
+            changed = set(filename for filename, signature in signatures.items()
+                          if self.signatures.get(filename) != signature)
+            self.signatures = signatures
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+
+class InotifyWatcher(Watcher):
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, tops):
+        Watcher.__init__(self, tops)
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        # watch descriptor -> directory
+        self.dirs = {}
+        for top in self.tops:
+            self._watch_tree(top)
+
+    def _watch_tree(self, top):
+        '''Watch top and the directories under it. Returns the posts
+        already in them.'''
+        posts, dirs = find_posts(top)
+        for dir in dirs:
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(dir), self.MASK)
+            if wd >= 0:
+                self.dirs[wd] = dir
+        return posts
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if deadline is not None:
+                timeout = max(0, deadline - time.monotonic())
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if not ready:
+                return set()
+            # Most events are for files that aren't posts
+            changed = self._read_events()
+            if changed:
+                return changed
+
+    def _read_events(self):
+        changed = set()
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0'))
+            offset += EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # Some events were lost; the caller will have to look
+                changed.update(self.posts())
+                continue
+            dir = self.dirs.get(wd)
+            if dir is None or not name:
+                continue
+            path = os.path.join(dir, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and name != 'uploads':
+                    # Posts may have been written before we got to it
+                    changed.update(self._watch_tree(path))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and is_post(name):
+                changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def create_watcher(tops):
+    '''An InotifyWatcher for tops if we can have one, and otherwise a
+    PollingWatcher.'''
+    try:
+        return InotifyWatcher(tops)
+    except (OSError, AttributeError, TypeError):
+        # No inotify here (AttributeError: libc hasn't got it;
+        # TypeError: there's no libc to be found)
+        return PollingWatcher(tops)
@@ -0,0 +1,199 @@
+import asyncio
+import hashlib
+import os
+import socketserver
+import tempfile
+import threading
+import xmlrpc.client
+import xmlrpc.server
+from rst2wp.lib import asyncwordpresslib, wordpresslib
+from rst2wp import timings
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest  # and hope for the best
+
+
+def term(id, name):
+    return {'term_id': str(id), 'name': name, 'slug': name.lower(),
+            'count': '0', 'description': '', 'parent': '0'}
+
+
+class Handler(xmlrpc.server.SimpleXMLRPCRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    rpc_paths = ('/xmlrpc.php',)
+
+    def do_POST(self):
+        self.server.connections.add(self.client_address)
+        self.server.requests += 1
+        xmlrpc.server.SimpleXMLRPCRequestHandler.do_POST(self)
+
+    def log_message(self, *args):
+        pass
+
+
+class OneShotHandler(Handler):
+    '''Closes the connection after every response.'''
+    protocol_version = 'HTTP/1.0'
+
+
+class Server(socketserver.ThreadingMixIn, xmlrpc.server.SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class TestAsyncWordPressClient(unittest.TestCase):
+    handler = Handler
+
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), self.handler, allow_none=True, logRequests=False)
+        self.server.connections = set()
+        self.server.requests = 0
+        self.server.register_multicall_functions()
+        self.posts = {}
+        self.tag_fetches = 0
+        functions = {
+            'metaWeblog.getPost': self.get_post,
+            'metaWeblog.newPost': self.new_post,
+            'metaWeblog.editPost': self.edit_post,
+            'metaWeblog.newMediaObject': self.new_media_object,
+            'wp.getTerms': self.get_terms,
+            'wp.getOptions': lambda *args: {'software_version': {'value': '6.0'}},
+            'blogger.getUserInfo': lambda *args: {'userid': '1', 'firstname': 'Joe',
+                                                  'lastname': 'User', 'nickname': 'joe'},
+            }
+        for name, function in functions.items():
+            self.server.register_function(function, name)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{0}/xmlrpc.php'.format(self.server.server_address[1])
+
+        self.loop = asyncio.new_event_loop()
+        self.wp = asyncwordpresslib.AsyncWordPressClient(
+            self.url, 'joe', 'secret', asyncwordpresslib.AsyncTransport(self.url, pool_size=3))
+        self.wp.selectBlog(1)
+
+    def tearDown(self):
+        self.wait(self.wp.close())
+        self.loop.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def wait(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def get_post(self, post_id, user, password):
+        if post_id not in self.posts:
+            raise xmlrpc.client.Fault(404, 'Invalid post ID.')
+        content = self.posts[post_id]
+        return {'postid': post_id, 'title': content['title'], 'description': content['description'],
+                'permaLink': 'http://example.com/?p=' + post_id, 'link': '', 'userid': '1',
+                'mt_excerpt': '', 'mt_text_more': '', 'mt_allow_comments': 1, 'mt_allow_pings': 1,
+                'categories': content['categories'],
+                'date_created_gmt': xmlrpc.client.DateTime('20200101T00:00:00'),
+                'dateCreated': xmlrpc.client.DateTime('20200101T00:00:00')}
+
+    def new_post(self, blog_id, user, password, content, publish):
+        post_id = str(len(self.posts) + 1)
+        self.posts[post_id] = content
+        return post_id
+
+    def edit_post(self, post_id, user, password, content, publish):
+        self.posts[post_id] = content
+        return True
+
+    def new_media_object(self, blog_id, user, password, struct):
+        self.uploaded = struct['type'], hashlib.md5(struct['bits'].data).hexdigest()
+        return {'url': 'http://example.com/' + struct['name']}
+
+    def get_terms(self, blog_id, user, password, taxonomy, filter):
+        if taxonomy == 'category':
+            return [term(1, 'Uncategorized')]
+        self.tag_fetches += 1
+        tags = [term(i, 'tag{0}'.format(i)) for i in range(10, 20)]
+        if 'search' in filter:
+            tags = [term(99, filter['search'])]
+        return tags
+
+    def test_posts(self):
+        post = wordpresslib.WordPressPost(title='Hello', description='<p>Hi</p>',
+                                          categories=[wordpresslib.WordPressCategory(name='Uncategorized')],
+                                          tags=[wordpresslib.WordPressTag(name='new tag')])
+        post_id = self.wait(self.wp.new_post(post, True))
+        self.assertEqual(post_id, 1)
+        self.assertEqual(post.id, 1)
+        self.assertEqual(self.posts['1']['mt_keywords'], 'new tag')
+
+        post.title = 'Hello again'
+        self.assertTrue(self.wait(self.wp.edit_post('1', post, True)))
+        fetched = self.wait(self.wp.get_post('1'))
+        self.assertEqual((fetched.id, fetched.title), (1, 'Hello again'))
+        self.assertEqual([c.name for c in fetched.categories], ['Uncategorized'])
+
+        with self.assertRaises(wordpresslib.WordPressException) as raised:
+            self.wait(self.wp.get_post('2'))
+        self.assertEqual(raised.exception.id, 404)
+
+    def test_terms_fetched_once(self):
+        async def lookups():
+            return await asyncio.gather(*[self.wp.get_tag('tag{0}'.format(i)) for i in range(10, 20)])
+        tags = self.wait(lookups())
+        self.assertEqual([t.id for t in tags], list(range(10, 20)))
+        self.assertEqual(self.tag_fetches, 1)
+        self.assertTrue(self.wait(self.wp.has_category('Uncategorized')))
+        self.assertEqual(self.wait(self.wp.find_tag(slug='tag12')).name, 'tag12')
+
+    def test_prefetch(self):
+        self.wait(self.wp.prefetch(options=True, user_info=True, tags=True, categories=True))
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(self.wait(self.wp.get_user_info()).nickname, 'joe')
+        self.assertEqual(len(self.wait(self.wp.get_tags())), 10)
+        self.assertEqual(self.server.requests, 1)
+
+    def test_upload(self):
+        with tempfile.NamedTemporaryFile(suffix='.png') as f:
+            contents = os.urandom(1000001)
+            f.write(contents)
+            f.flush()
+            before = self.wp.transport.totals
+            self.assertEqual(self.wait(self.wp.upload_file(f.name)),
+                             'http://example.com/' + os.path.basename(f.name))
+        self.assertEqual(self.uploaded, ('image/png', hashlib.md5(contents).hexdigest()))
+        self.assertEqual(self.wp.transport.totals.calls, before.calls + 1)
+        self.assertGreater(self.wp.transport.totals.sent - before.sent, 1333333)
+
+    def test_connections_bounded(self):
+        async def calls():
+            return await asyncio.gather(*[self.wp.call('wp.getTerms', 1, 'joe', 'secret', 'category', {})
+                                          for i in range(30)])
+        results = self.wait(calls())
+        self.assertEqual(len(results), 30)
+        self.assertEqual(self.server.requests, 30)
+        self.assertLessEqual(self.wp.transport.connections_opened, 3)
+        self.assertEqual(len(self.server.connections), self.wp.transport.connections_opened)
+
+    def test_timings(self):
+        self.wp.timings = self.wp.transport.timings = timings.Timings()
+        async def both():
+            await asyncio.gather(self.wp.get_options(), self.wp.get_user_info())
+        self.wait(both())
+
+        spans = dict((span.name, span) for span in self.wp.timings.spans)
+        # Each call's bytes count towards its own span, not the other's
+        for name, method in [('get_options', 'wp.getOptions'), ('get_user_info', 'blogger.getUserInfo')]:
+            self.assertEqual(spans[name].args, spans[method].args)
+        self.assertEqual(self.wp.transport.totals.sent,
+                         spans['get_options'].args['sent'] + spans['get_user_info'].args['sent'])
+
+
+class TestConnectionNotKept(TestAsyncWordPressClient):
+    '''The same, against a server that hangs up after every response.'''
+    handler = OneShotHandler
+
+    def test_connections_bounded(self):
+        async def calls():
+            return await asyncio.gather(*[self.wp.call('wp.getTerms', 1, 'joe', 'secret', 'category', {})
+                                          for i in range(30)])
+        self.assertEqual(len(self.wait(calls())), 30)
+        self.assertEqual(self.wp.transport.connections_opened, 30)
+
+if __name__ == '__main__':
+    unittest.main()
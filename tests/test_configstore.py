@@ -0,0 +1,86 @@
+import configparser
+import os
+import shutil
+import tempfile
+from rst2wp import configstore
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest  # and hope for the best
+from unittest import mock
+
+
+class TestConfigStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.user = os.path.join(self.dir, 'user')
+        self.system = os.path.join(self.dir, 'system')
+        self.write(self.user, '[account]\nusername = me\n')
+        self.write(self.system, '[account]\nusername = nobody\nurl = http://example.com/\n')
+        self.store = configstore.ConfigStore()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, filename, text, mtime=None):
+        with open(filename, 'w') as f:
+            f.write(text)
+        if mtime is not None:
+            os.utime(filename, (mtime, mtime))
+
+    def test_layered(self):
+        filenames = [self.user, self.system, os.path.join(self.dir, 'missing')]
+        self.assertEqual(self.store.get(filenames, 'account', 'username'), 'me')
+        self.assertEqual(self.store.get(filenames, 'account', 'url'), 'http://example.com/')
+        self.assertEqual(self.store.get(filenames, 'account', 'password', 'x'), 'x')
+        self.assertEqual(self.store.get(filenames, 'nosuch', 'url'), None)
+        self.assertTrue(self.store.has(filenames, 'account', 'url'))
+        self.assertFalse(self.store.has(filenames, 'account', 'password'))
+        self.assertEqual(self.store.items(filenames, 'account'),
+                         [('url', 'http://example.com/'), ('username', 'me')])
+        self.assertEqual(self.store.items(filenames, 'nosuch'), [])
+
+    def test_parsed_once(self):
+        filenames = [self.user, self.system]
+        with mock.patch.object(configparser.ConfigParser, 'read_file', autospec=True,
+                               side_effect=configparser.ConfigParser.read_file) as read_file:
+            for i in range(10):
+                self.store.get(filenames, 'account', 'url')
+        self.assertEqual(read_file.call_count, 2)
+
+    def test_reloads_changed_file(self):
+        self.assertEqual(self.store.get([self.user], 'account', 'username'), 'me')
+        self.write(self.user, '[account]\nusername = someone else\n', mtime=1000)
+        self.assertEqual(self.store.get([self.user], 'account', 'username'), 'someone else')
+
+    def test_set_is_written_on_flush(self):
+        self.store.set(self.user, 'http://example.com/a.jpg', 'uploaded', 'http://blog/a.jpg')
+        self.store.set(self.user, 'http://example.com/a.jpg', 'uploaded-scaled', 'http://blog/a-1.jpg')
+        self.assertEqual(self.store.get([self.user], 'http://example.com/a.jpg', 'uploaded'),
+                         'http://blog/a.jpg')
+        with open(self.user) as f:
+            self.assertNotIn('uploaded', f.read())
+
+        self.store.flush()
+        fresh = configstore.ConfigStore()
+        self.assertEqual(fresh.get([self.user], 'http://example.com/a.jpg', 'uploaded-scaled'),
+                         'http://blog/a-1.jpg')
+        self.assertEqual(fresh.get([self.user], 'account', 'username'), 'me')
+
+    def test_pending_changes_survive_reload(self):
+        self.store.set(self.user, 'post', 'id', '12')
+        self.write(self.user, '[account]\nusername = someone else\n', mtime=1000)
+        self.store.flush()
+
+        fresh = configstore.ConfigStore()
+        self.assertEqual(fresh.get([self.user], 'post', 'id'), '12')
+        self.assertEqual(fresh.get([self.user], 'account', 'username'), 'someone else')
+
+    def test_no_interpolation(self):
+        self.store.set(self.user, 'http://example.com/a%20b.jpg', 'uploaded', 'http://blog/a%20b.jpg')
+        self.store.flush()
+        self.assertEqual(configstore.ConfigStore().sections(self.user)[-1],
+                         ('http://example.com/a%20b.jpg', {'uploaded': 'http://blog/a%20b.jpg'}))
+
+if __name__ == '__main__':
+    unittest.main()
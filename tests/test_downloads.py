@@ -0,0 +1,178 @@
+from rst2wp import downloads
+import concurrent.futures
+import http.client
+import http.server
+import json
+import os
+import tempfile
+import threading
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest  # and hope for the best
+
+
+class FileHandler(http.server.BaseHTTPRequestHandler):
+    '''Serves server.files: {path: (etag, contents)}.'''
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        self.server.requests.append((self.path, dict(self.headers)))
+        if self.path == '/moved':
+            self.reply(302, b'', Location='/a.jpg')
+            return
+        if self.path not in self.server.files:
+            self.reply(404, b'not found')
+            return
+
+        etag, contents = self.server.files[self.path]
+        if self.headers.get('If-None-Match') == etag:
+            self.reply(304, None, ETag=etag)
+            return
+
+        range = self.headers.get('Range')
+        if range and self.headers.get('If-Range') == etag:
+            start = int(range[len('bytes='):-1])
+            self.reply(206, contents[start:], ETag=etag,
+                       **{'Content-Range': 'bytes {0}-{1}/{2}'.format(start, len(contents) - 1, len(contents))})
+            return
+
+        if self.server.truncate:
+            self.server.truncate -= 1
+            # Say it's all coming, then hang up halfway
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(contents)))
+            self.end_headers()
+            self.wfile.write(contents[:len(contents)//2])
+            self.close_connection = True
+            return
+
+        self.reply(200, contents, ETag=etag)
+
+    def reply(self, status, body, **headers):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if body is not None:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDownloadManager(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+        self.server.daemon_threads = True
+        self.server.connections = set()
+        self.server.requests = []
+        self.server.truncate = 0
+        self.server.files = {
+            '/a.jpg': ('"a1"', b'a' * 100000),
+            '/b.jpg': ('"b1"', b'b' * 1000),
+            '/c.jpg': ('"c1"', b'c' * 1000),
+            }
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{0}'.format(self.server.server_port)
+
+        self.dir = tempfile.TemporaryDirectory()
+        self.state = os.path.join(self.dir.name, 'downloads.json')
+        self.manager = downloads.DownloadManager(self.state, retries=1)
+
+    def tearDown(self):
+        self.manager.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def contents(self, name):
+        with open(self.path(name), 'rb') as f:
+            return f.read()
+
+    def test_download_and_revalidate(self):
+        self.manager.fetch(self.url + '/a.jpg', self.path('a.jpg'))
+        self.assertEqual(self.contents('a.jpg'), b'a' * 100000)
+        self.assertFalse(os.path.exists(self.path('a.jpg.part')))
+
+        # Another run: asks whether it's changed, and it hasn't
+        manager = downloads.DownloadManager(self.state)
+        manager.fetch(self.url + '/a.jpg', self.path('a.jpg'))
+        path, headers = self.server.requests[-1]
+        self.assertEqual(headers['If-None-Match'], '"a1"')
+        self.assertEqual(self.contents('a.jpg'), b'a' * 100000)
+
+        # Now it has
+        self.server.files['/a.jpg'] = ('"a2"', b'A' * 10)
+        manager.fetch(self.url + '/a.jpg', self.path('a.jpg'))
+        self.assertEqual(self.contents('a.jpg'), b'A' * 10)
+        manager.close()
+
+    def test_resume(self):
+        with open(self.path('a.jpg.part'), 'wb') as f:
+            f.write(b'a' * 30000)
+        with open(self.state, 'w') as f:
+            json.dump({self.path('a.jpg'): {'uri': self.url + '/a.jpg', 'etag': '"a1"',
+                                            'last_modified': None}}, f)
+
+        self.manager.fetch(self.url + '/a.jpg', self.path('a.jpg'))
+        path, headers = self.server.requests[-1]
+        self.assertEqual(headers['Range'], 'bytes=30000-')
+        self.assertEqual(self.contents('a.jpg'), b'a' * 100000)
+
+    def test_no_validators(self):
+        with open(self.path('a.jpg'), 'wb') as f:
+            f.write(b'a' * 100000)
+        with open(self.state, 'w') as f:
+            json.dump({self.path('a.jpg'): {'uri': self.url + '/a.jpg', 'etag': None,
+                                            'last_modified': None}}, f)
+
+        # Nothing to revalidate it with, so it's kept as it is
+        self.manager.fetch(self.url + '/a.jpg', self.path('a.jpg'))
+        self.assertEqual(self.server.requests, [])
+
+    def test_interrupted(self):
+        self.server.truncate = 1
+        self.manager.fetch(self.url + '/a.jpg', self.path('a.jpg'))
+        self.assertEqual(self.contents('a.jpg'), b'a' * 100000)
+        # The second try picked up where the first left off
+        path, headers = self.server.requests[-1]
+        self.assertEqual(headers['Range'], 'bytes=50000-')
+
+    def test_interrupted_file_not_kept(self):
+        self.server.truncate = 1
+        manager = downloads.DownloadManager(self.state, retries=0)
+        with self.assertRaises(http.client.IncompleteRead):
+            manager.fetch(self.url + '/a.jpg', self.path('a.jpg'))
+        self.assertFalse(os.path.exists(self.path('a.jpg')))
+        self.assertEqual(os.path.getsize(self.path('a.jpg.part')), 50000)
+
+    def test_not_found(self):
+        with self.assertRaises(downloads.DownloadError):
+            self.manager.fetch(self.url + '/nope.jpg', self.path('nope.jpg'))
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertFalse(os.path.exists(self.path('nope.jpg')))
+
+    def test_redirect(self):
+        self.manager.fetch(self.url + '/moved', self.path('moved.jpg'))
+        self.assertEqual(self.contents('moved.jpg'), b'a' * 100000)
+
+    def test_connections_reused(self):
+        names = ['a.jpg', 'b.jpg', 'c.jpg'] * 4
+        with concurrent.futures.ThreadPoolExecutor(3) as pool:
+            list(pool.map(lambda i: self.manager.fetch(self.url + '/' + names[i], self.path(str(i))),
+                          range(len(names))))
+        for i, name in enumerate(names):
+            self.assertEqual(self.contents(str(i)), self.server.files['/' + name][1])
+        self.assertLessEqual(self.manager.connections_opened, 3)
+        self.assertEqual(len(self.server.connections), self.manager.connections_opened)
+
+if __name__ == '__main__':
+    unittest.main()
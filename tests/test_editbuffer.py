@@ -0,0 +1,87 @@
+import re
+from rst2wp import editbuffer
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest  # and hope for the best
+
+TEXT = """:title: Hello
+:tags: - a
+       - b
+
+Some text.
+
+.. image:: http://example.com/a.jpg
+   :rotate: 90
+
+  .. image:: http://example.com/b.jpg
+
+.. |sub| image:: http://example.com/a.jpg
+
+.. upload:: /tmp/file.odf
+"""
+
+def replace_field(text, key, value):
+    '''One change at a time, the way rst2wp used to.'''
+    keystring = ':{key}:'.format(key=key)
+    new_line = '{keystring} {value}'.format(keystring=keystring, value=value)
+    in_fields = False
+    lines = text.split('\n')
+    for i in range(len(lines)):
+        if ':' == lines[i][:1]:
+            in_fields = True
+        if not in_fields: continue
+        if '' == lines[i].strip():
+            lines.insert(i, new_line)
+            break
+        if lines[i].startswith(keystring):
+            lines[i] = new_line
+            break
+    return '\n'.join(lines)
+
+def replace_directive(text, directive, uri, key, value):
+    r = re.compile('{name}::\\s+({uri})'.format(name=directive, uri=re.escape(uri)))
+    lines = text.split('\n')
+    for i in range(len(lines)):
+        if r.search(lines[i]):
+            n = len(lines[i]) - len(lines[i].lstrip())
+            lines.insert(i+1, ((n+3)*' ')+':{key}: {value}'.format(key=key, value=value))
+    return '\n'.join(lines)
+
+class TestEditBuffer(unittest.TestCase):
+    def check(self, text, changes):
+        buffer = editbuffer.EditBuffer(text)
+        expected = text
+        for change in changes:
+            if len(change) == 2:
+                buffer.set_field(*change)
+                expected = replace_field(expected, *change)
+            else:
+                buffer.add_directive_option(*change)
+                expected = replace_directive(expected, *change)
+        self.assertEqual(buffer.apply(), expected)
+        return buffer.apply()
+
+    def test_empty(self):
+        buffer = editbuffer.EditBuffer(TEXT)
+        self.assertFalse(buffer)
+        self.assertEqual(buffer.apply(), TEXT)
+
+    def test_same_as_one_at_a_time(self):
+        output = self.check(TEXT, [
+            ('image', 'http://example.com/a.jpg', 'uploaded-rot90', 'http://wp/a-rot90.jpg'),
+            ('date', '2020-01-01 00:00:00'),
+            ('image', 'http://example.com/b.jpg', 'uploaded', 'http://wp/b.jpg'),
+            ('image', 'http://example.com/a.jpg', 'uploaded', 'http://wp/a.jpg'),
+            ('upload', '/tmp/file.odf', 'uploaded', 'http://wp/file.odf'),
+            ('id', '12'),
+            ('title', 'Hello again'),
+            ('date', '2020-01-02 00:00:00'),
+            ])
+        self.assertTrue(output.startswith(':title: Hello again\n:tags: - a\n       - b\n'
+                                          ':date: 2020-01-02 00:00:00\n:id: 12\n\n'))
+        self.assertIn('  .. image:: http://example.com/b.jpg\n     :uploaded: http://wp/b.jpg\n', output)
+
+    def test_no_fields(self):
+        self.check('Just text.\n\nMore.', [('id', '3')])
+        self.check(':title: No blank line after', [('id', '3'), ('title', 'x')])
@@ -15,6 +15,8 @@ from docutils import core
 from rst2wp import nodes
 from rst2wp import my_image
 from rst2wp import rst2wp
+from rst2wp import pipeline
+import concurrent.futures
 
 class TestImage(unittest.TestCase):
     def find_images(self, output):
@@ -40,7 +42,7 @@ class TestImage(unittest.TestCase):
             if image[x] != spec[x]:
                 raise AssertionError("Image {0} did not match spec {1}".format(image, spec))
 
-    def mock_run(self, text):
+    def mock_run(self, text, **settings):
         application = mock.Mock(rst2wp.Rst2Wp)
         application.filename = '/home/ethan/some/directory/test.rst'
         application.config.has_option.return_value = True
@@ -54,12 +56,14 @@ class TestImage(unittest.TestCase):
         wp.upload_file.side_effect = lambda filename, overwrite=True: "http://wordpress/"+os.path.basename(filename)
 
         directive_uris = {'image': {}}
-        with mock.patch('subprocess.check_call') as check_call:
-            output = core.publish_parts(source=text, writer_name='html4css1',
-                                        settings_overrides = {'bibliographic_fields': {},
-                                                              'application': application,
-                                                              'directive_uris': directive_uris,
-                                                              'wordpress_instance': wp})
+        settings_overrides = {'bibliographic_fields': {},
+                              'application': application,
+                              'directive_uris': directive_uris,
+                              'wordpress_instance': wp}
+        settings_overrides.update(settings)
+        output = core.publish_parts(source=text, writer_name='html4css1',
+                                    reader=rst2wp.WordPressReader(preview=True),
+                                    settings_overrides=settings_overrides)
         return {'output': output['whole'], 'directive_uris': directive_uris,
                 'application': application, 'wordpress_instance': wp}
 
@@ -202,11 +206,7 @@ class TestImage(unittest.TestCase):
         os_path_exists.side_effect = lambda filename: not filename.startswith('/home/ethan/some/directory/uploads/foo')
         urlretrieve.side_effect = lambda filename, target: (target, [])
 
-        images = [mock.Mock(), mock.Mock()]
-        images[1].size = (4000, 3000)
-        images_iter = iter(images)
-
-        image_open.side_effect = lambda filename: next(images_iter)
+        image_open.return_value.size = (4000, 3000)
 
         output = self.mock_run(text)
         html = output['output']
@@ -215,15 +215,17 @@ class TestImage(unittest.TestCase):
         #os_path_exists.assert_called_with('/home/ethan/some/directory/uploads')
         assert not os_mkdir.called
         urlretrieve.assert_called_with('/tmp/foo.jpg', '/home/ethan/some/directory/uploads/foo.jpg')
-        self.assertEqual(image_open.call_args_list, [(('/home/ethan/some/directory/uploads/foo.jpg',), {}),
-                                                     (('/home/ethan/some/directory/uploads/foo-rot90.jpg',), {})])
-        images[0].rotate.assert_called_with(90)
-        images[0].rotate.return_value.\
-            save.assert_called_with('/home/ethan/some/directory/uploads/foo-rot90.jpg')
-
-        images[1].thumbnail.assert_called_with((1000, 750), Image.ANTIALIAS)
-        images[1].\
-            save.assert_called_with('/home/ethan/some/directory/uploads/foo-rot90-scale0.25.jpg')
+        # Decoded once; rotated and scaled in memory
+        self.assertEqual(image_open.call_args_list, [(('/home/ethan/some/directory/uploads/foo.jpg',), {})])
+        image_open.return_value.rotate.assert_called_with(90)
+        rotated = image_open.return_value.rotate.return_value
+        rotated.thumbnail.assert_called_with((1000, 750), Image.LANCZOS)
+        self.assertEqual(rotated.save.call_args_list, [
+                (('/home/ethan/some/directory/uploads/foo-rot90.jpg',), {}),
+                (('/home/ethan/some/directory/uploads/foo-rot90-scale0.25.jpg',), {})
+        ])
+        # Needed at full size for foo-rot90.jpg
+        self.assertFalse(image_open.return_value.draft.called)
 
         document = application.save_directive_info.call_args_list[0][0][0]
         self.assertEqual(application.save_directive_info.call_args_list, [
@@ -237,3 +239,44 @@ class TestImage(unittest.TestCase):
                 'reference': 'http://wordpress/foo-rot90.jpg',
                 'src': 'http://wordpress/foo-rot90-scale0.25.jpg'
                 })
+
+    @mock.patch('PIL.Image.open')
+    @mock.patch('urllib.request.urlretrieve')
+    @mock.patch('os.mkdir')
+    @mock.patch('os.path.exists')
+    def test_pipeline(self, os_path_exists, os_mkdir, urlretrieve, image_open):
+        text = """
+:title: Hello
+
+.. image:: /tmp/foo.jpg
+   :rotate: 90
+
+Some text.
+
+.. image:: /tmp/bar.jpg
+
+.. image:: /tmp/foo.jpg
+   :rotate: 90
+
+|sub|
+
+.. |sub| image:: /tmp/bar.jpg
+"""
+
+        os_path_exists.side_effect = lambda filename: not filename.startswith('/home/ethan/some/directory/uploads/')
+        urlretrieve.side_effect = lambda filename, target: (target, [])
+
+        sequential = self.mock_run(text)
+        with concurrent.futures.ThreadPoolExecutor(4) as pool:
+            parallel = self.mock_run(text, image_pipeline=pipeline.ImagePipeline(pool))
+
+        self.assertEqual(sequential['output'], parallel['output'])
+        self.assertEqual(sequential['directive_uris'], parallel['directive_uris'])
+        saves = [c[0][1:] for c in parallel['application'].save_directive_info.call_args_list]
+        self.assertEqual(saves, [('image', '/tmp/foo.jpg', 'uploaded-rot90', 'http://wordpress/foo-rot90.jpg'),
+                                 ('image', '/tmp/bar.jpg', 'uploaded', 'http://wordpress/bar.jpg')])
+        self.assertEqual(parallel['wordpress_instance'].upload_file.call_count, 2)
+
+        images = self.find_images(parallel['output'])
+        self.assertEqual([i['src'] for i in images], ['http://wordpress/foo-rot90.jpg', 'http://wordpress/bar.jpg',
+                                                      'http://wordpress/foo-rot90.jpg', 'http://wordpress/bar.jpg'])
@@ -0,0 +1,168 @@
+from rst2wp import imagecache
+import concurrent.futures
+import multiprocessing
+import os
+import tempfile
+from PIL import Image, ImageCms
+from PIL.JpegImagePlugin import JpegImageFile
+from unittest import mock
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest  # and hope for the best
+
+
+class TestTransform(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.dir.name, 'foo.jpg')
+        Image.new('RGB', (1600, 1200), 'red').save(self.source)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def output(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def test_only_wanted_forms_written(self):
+        imagecache.transform(self.source, [('rotate', '90'), ('scale', '200x200')],
+                             [None, self.output('foo-rot90-scale200x200.jpg')])
+        self.assertFalse(os.path.exists(self.output('foo-rot90.jpg')))
+        self.assertEqual(Image.open(self.output('foo-rot90-scale200x200.jpg')).size, (200, 150))
+
+    def test_draft(self):
+        draft = mock.patch('PIL.JpegImagePlugin.JpegImageFile.draft', autospec=True,
+                           side_effect=JpegImageFile.draft)
+        with draft as draft:
+            imagecache.transform(self.source, [('rotate', '90'), ('scale', '0.1')],
+                                 [None, self.output('small.jpg')])
+            draft.assert_called_with(mock.ANY, None, (320, 240))
+            self.assertEqual(Image.open(self.output('small.jpg')).size, (160, 120))
+
+            # Full size needed
+            draft.reset_mock()
+            imagecache.transform(self.source, [('rotate', '90'), ('scale', '0.1')],
+                                 [self.output('rot90.jpg'), self.output('small.jpg')])
+            self.assertFalse(draft.called)
+            self.assertEqual(Image.open(self.output('rot90.jpg')).size, (1600, 1200))
+            self.assertEqual(Image.open(self.output('small.jpg')).size, (160, 120))
+
+
+class TestOrientation(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.dir.name, 'foo.JPEG')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def save(self, orientation):
+        image = Image.new('RGB', (400, 300), 'red')
+        image.paste('blue', (0, 0, 200, 300))
+        exif = Image.Exif()
+        exif[imagecache.ORIENTATION] = orientation
+        self.icc_profile = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+        image.save(self.filename, exif=exif, icc_profile=self.icc_profile)
+        with open(self.filename, 'rb') as f:
+            self.original = f.read()
+
+    def transform(self, steps):
+        outputs = [os.path.join(self.dir.name, 'form{0}.jpg'.format(i)) for i in range(len(steps))]
+        imagecache.transform(self.filename, steps, outputs)
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(f.read(), self.original)
+        return [Image.open(output) for output in outputs]
+
+    def test_rotated(self):
+        self.save(6)
+        image, = self.transform([('scale', '0.5')])
+        self.assertEqual(image.size, (150, 200))
+        self.assertEqual(image.getexif().get(imagecache.ORIENTATION), None)
+        self.assertEqual(image.info.get('icc_profile'), self.icc_profile)
+        # Blue was on the left; turned clockwise, it's on top
+        self.assertEqual(image.getpixel((75, 25)), image.getpixel((5, 5)))
+        self.assertNotEqual(image.getpixel((75, 175)), image.getpixel((5, 5)))
+
+    def test_normal(self):
+        self.save(1)
+        rotated, scaled = self.transform([('rotate', '90'), ('scale', '0.5')])
+        self.assertEqual(scaled.size, (200, 150))
+        self.assertEqual(rotated.info.get('icc_profile'), self.icc_profile)
+
+
+class TestDerivedImageCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.uploads = os.path.join(self.dir.name, 'uploads')
+        os.mkdir(self.uploads)
+        os.mkdir(os.path.join(self.dir.name, 'cache'))
+        self.source = os.path.join(self.uploads, 'foo.jpg')
+        Image.new('RGB', (400, 300), 'red').save(self.source)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def derive_all(self, cache, uploads):
+        '''What MyImageDirective does for :rotate: 90 and :scale: 0.5.'''
+        rotated = os.path.join(uploads, 'foo-rot90.jpg')
+        scaled = os.path.join(uploads, 'foo-rot90-scale0.5.jpg')
+        cache.derive(self.source, [('rotate', '90'), ('scale', '0.5')], [rotated, scaled])
+        return rotated, scaled
+
+    def test_generated_once(self):
+        cache = imagecache.DerivedImageCache(os.path.join(self.dir.name, 'cache'))
+        with mock.patch('rst2wp.imagecache.transform', wraps=imagecache.transform) as transform:
+            rotated, scaled = self.derive_all(cache, self.uploads)
+            self.assertEqual(transform.call_count, 1)
+            self.assertEqual(Image.open(rotated).size, (400, 300))
+            self.assertEqual(Image.open(scaled).size, (200, 150))
+
+            # Another post, another run
+            os.unlink(rotated)
+            other = os.path.join(self.dir.name, 'other')
+            os.mkdir(other)
+            cache = imagecache.DerivedImageCache(os.path.join(self.dir.name, 'cache'))
+            rotated, scaled = self.derive_all(cache, other)
+            self.assertEqual(transform.call_count, 1)
+            self.assertEqual(Image.open(scaled).size, (200, 150))
+
+    def test_changed_source(self):
+        cache = imagecache.DerivedImageCache(os.path.join(self.dir.name, 'cache'))
+        rotated, scaled = self.derive_all(cache, self.uploads)
+        Image.new('RGB', (40, 30), 'blue').save(self.source)
+        os.utime(self.source, (1000, 1000))
+        rotated, scaled = self.derive_all(cache, self.uploads)
+        self.assertEqual(Image.open(scaled).size, (20, 15))
+
+    def test_pruned(self):
+        cache = imagecache.DerivedImageCache(os.path.join(self.dir.name, 'cache'))
+        self.derive_all(cache, self.uploads)
+        forms = dict((name, os.path.getsize(os.path.join(cache.directory, name)))
+                     for name in os.listdir(cache.directory))
+        self.assertEqual(len(forms), 2)
+        # Used long ago, apart from the scaled one
+        scaled = cache.cached_filename(cache.source_digest(self.source),
+                                       [('rotate', '90'), ('scale', '0.5')], '.jpg')
+        for name in forms:
+            os.utime(os.path.join(cache.directory, name), (1000, 1000))
+        os.utime(scaled, (2000, 2000))
+        open(os.path.join(cache.directory, 'tmpabc.jpg'), 'w').close()
+
+        cache.max_size = forms[os.path.basename(scaled)]
+        cache.close()
+        self.assertEqual(sorted(os.listdir(cache.directory)),
+                         sorted([os.path.basename(scaled), 'tmpabc.jpg']))
+
+        # Using a form makes it the most recent
+        self.derive_all(cache, self.uploads)
+        self.assertGreater(os.path.getmtime(scaled), 2000)
+
+    def test_process_pool(self):
+        with concurrent.futures.ProcessPoolExecutor(
+                1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            cache = imagecache.DerivedImageCache(os.path.join(self.dir.name, 'cache'), pool)
+            rotated, scaled = self.derive_all(cache, self.uploads)
+        self.assertEqual(Image.open(scaled).size, (200, 150))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import configparser
+import os
+import tempfile
+from unittest import mock
+from docutils import core
+from docutils.readers import standalone
+from rst2wp import knownlinks
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest  # and hope for the best
+
+KNOWN_LINKS = """
+[http://www.example.com/]
+link = example link
+
+[http://python.org/]
+link = Python
+
+[someone@example.com]
+link = Mail Me
+
+[`example link`_]
+link = alias of example
+"""
+
+POST = """
+A link to `example link`_, to python_, to `Mail me`_ and to `alias of example`_.
+
+|sub|
+
+.. |sub| replace:: `example link`_
+
+.. _python: http://python.org/3/
+
+The post's own target wins.
+"""
+
+class Reader(standalone.Reader):
+    def get_transforms(self):
+        return standalone.Reader.get_transforms(self) + [knownlinks.KnownLinksTransform]
+
+class TestKnownLinks(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, 'known_links')
+        self.cache = os.path.join(self.tmp.name, 'cache.json')
+        with open(self.filename, 'w') as f:
+            f.write(KNOWN_LINKS)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def render(self, text, links):
+        return core.publish_parts(source=text, writer_name='html4css1', reader=Reader(),
+                                  settings_overrides={'known_links': links,
+                                                      'report_level': 5})['body']
+
+    def test_same_as_stanza(self):
+        config = configparser.ConfigParser()
+        config.read_string(KNOWN_LINKS)
+        # What we used to append to every post
+        stanza = '\n\n' + '\n'.join('.. _`{name}`: {link}'.format(link=sectname, name=config.get(sectname, 'link'))
+                                    for sectname in config.sections())
+        post = POST.replace('.. _python: http://python.org/3/', '')
+        expected = core.publish_parts(source=post + stanza, writer_name='html4css1',
+                                      settings_overrides={'report_level': 5})['body']
+
+        self.assertEqual(self.render(post, knownlinks.KnownLinks([self.filename])), expected)
+        self.assertIn('href="mailto:someone&#64;example.com"', expected)
+
+    def test_own_target_wins(self):
+        body = self.render(POST, knownlinks.KnownLinks([self.filename]))
+        self.assertIn('href="http://python.org/3/"', body)
+        self.assertNotIn('href="http://python.org/"', body)
+        self.assertNotIn('problematic', body)
+
+    def test_cache(self):
+        links = knownlinks.KnownLinks([self.filename], self.cache)
+        self.assertEqual(tuple(links.links['python']), ('refuri', 'http://python.org/'))
+        digest = links.digest
+
+        # A new KnownLinks reads the compiled table instead of the file
+        with mock.patch.object(knownlinks.KnownLinks, '_compile') as compile:
+            self.assertEqual(knownlinks.KnownLinks([self.filename], self.cache).digest, digest)
+            self.assertFalse(compile.called)
+
+        with open(self.filename, 'a') as f:
+            f.write('\n[http://docutils.sourceforge.io/]\nlink = docutils\n')
+        self.assertNotEqual(links.digest, digest)
+        self.assertEqual(tuple(links.links['docutils']), ('refuri', 'http://docutils.sourceforge.io/'))
@@ -0,0 +1,33 @@
+from rst2wp import manifest
+import os
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest  # and hope for the best
+
+
+class TestManifest(unittest.TestCase):
+    def test_written_on_flush(self):
+        with tempfile.TemporaryDirectory() as dir:
+            filename = os.path.join(dir, 'manifest')
+            first = manifest.Manifest(filename)
+            second = manifest.Manifest(filename)
+            self.assertEqual(first.get(1), None)
+            self.assertEqual(second.get(2), None)
+
+            first.record(1, 'aaa')
+            second.record(2, 'bbb')
+            self.assertEqual(first.get(1), 'aaa')
+            self.assertFalse(os.path.exists(filename))
+
+            # Like two rst2wp processes finishing one after the other
+            first.flush()
+            second.flush()
+            third = manifest.Manifest(filename)
+            self.assertEqual((third.get(1), third.get(2)), ('aaa', 'bbb'))
+            self.assertEqual(first.get(2), 'bbb')
+
+
+if __name__ == '__main__':
+    unittest.main()
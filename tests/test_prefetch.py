@@ -0,0 +1,78 @@
+from rst2wp import manifest, rst2wp
+import os
+import tempfile
+from unittest import mock
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest  # and hope for the best
+
+
+class TestPrefetch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.app = rst2wp.Rst2Wp()
+        self.app.force = False
+        self.app.watch = None
+        self.app.dont_check_tags = False
+        self.app.VERBOSE = False
+        self.app.wp = mock.Mock()
+        self.app.manifest = manifest.Manifest(os.path.join(self.tmp.name, 'manifest'))
+        self.app.manifest.record('7', 'digest')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, text):
+        filename = os.path.join(self.tmp.name, name)
+        with open(filename, 'w') as f:
+            f.write(text)
+        return filename
+
+    def prefetched_posts(self, text, data_storage='file'):
+        filename = self.write('post.rst', text)
+        with mock.patch.object(rst2wp.Rst2Wp, 'data_storage', data_storage):
+            self.app.prefetch([filename])
+        kwargs = self.app.wp.prefetch.call_args[1]
+        self.assertFalse(kwargs['user_info'])
+        return kwargs['posts']
+
+    def test_sent_before(self):
+        # Whether it has changed isn't known yet, and it probably hasn't
+        self.assertEqual(self.prefetched_posts(':title: Post\n:id: 7\n:date: 2020-01-01 00:00:00\n\nHi\n'), [])
+        self.app.force = True
+        self.assertEqual(self.prefetched_posts(':title: Post\n:id: 7\n:date: 2020-01-01 00:00:00\n\nHi\n'), ['7'])
+
+    def test_no_date(self):
+        self.assertEqual(self.prefetched_posts(':title: Post\n:id: 7\n\nHi\n'), ['7'])
+
+    def test_never_sent(self):
+        self.assertEqual(self.prefetched_posts(':title: Post\n:id: 8\n:date: 2020-01-01 00:00:00\n\nHi\n'), ['8'])
+
+    def test_date_stored_elsewhere(self):
+        self.app.metadata = mock.Mock()
+        stored = {'id': '7', 'date': '2020-01-01 00:00:00'}
+        self.app.metadata.get_post.side_effect = lambda filename, key: stored.get(key)
+        self.assertEqual(self.prefetched_posts(':title: Post\n\nHi\n', 'sqlite'), [])
+        del stored['date']
+        self.assertEqual(self.prefetched_posts(':title: Post\n\nHi\n', 'sqlite'), ['7'])
+
+    def test_batch(self):
+        sent = self.write('sent.rst', ':title: Post\n:id: 7\n:date: 2020-01-01 00:00:00\n\nHi\n')
+        undated = self.write('undated.rst', ':title: Post\n:id: 8\n\nHi\n')
+        new = self.write('new.rst', ':title: Post\n\nHi\n')
+        with mock.patch.object(rst2wp.Rst2Wp, 'data_storage', 'file'):
+            self.app.prefetch([sent, undated])
+            kwargs = self.app.wp.prefetch.call_args[1]
+            # Nothing's new, so there's no need to know who we are
+            self.assertFalse(kwargs['user_info'])
+            self.assertEqual(kwargs['posts'], ['8'])
+
+            self.app.prefetch([sent, new])
+            kwargs = self.app.wp.prefetch.call_args[1]
+            self.assertTrue(kwargs['user_info'])
+            self.assertEqual(kwargs['posts'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
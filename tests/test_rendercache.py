@@ -0,0 +1,68 @@
+import os
+import tempfile
+from rst2wp import rendercache
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest  # and hope for the best
+
+class TestRenderCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, text):
+        filename = os.path.join(self.dir, name)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+            f.write(text)
+        return filename
+
+    def test_include_digests(self):
+        post = self.write('post.rst', 'Hi.\n\n.. include:: parts/a.rst\n.. include:: <isonum.txt>\n.. include:: missing.rst\n')
+        self.write('parts/a.rst', '.. include:: b.rst\n')
+        self.write('parts/b.rst', '.. include:: a.rst\n')
+
+        with open(post) as f:
+            text = f.read()
+        digests = rendercache.include_digests(post, text)
+        self.assertEqual([os.path.relpath(path, self.dir) for path, digest in digests],
+                         ['parts/a.rst', 'parts/b.rst', 'missing.rst'])
+        self.assertEqual(digests[2][1], None)
+
+        self.write('parts/b.rst', 'changed\n')
+        self.assertNotEqual(rendercache.include_digests(post, text), digests)
+
+    def test_directive_uris(self):
+        post = self.write('post.rst', '.. image:: a.jpg\n   :scale: 0.5\n\n'
+                          '.. |b| image:: http://example.com/b.jpg\n\n'
+                          '.. upload:: notes.odt\n\n'
+                          '.. include:: parts/a.rst\n')
+        self.write('parts/a.rst', '.. image:: a.jpg\n\n.. image:: c.jpg\n')
+
+        with open(post) as f:
+            text = f.read()
+        self.assertEqual(rendercache.directive_uris(post, text),
+                         [('image', 'a.jpg'), ('image', 'http://example.com/b.jpg'),
+                          ('upload', 'notes.odt'), ('image', 'c.jpg')])
+
+    def test_get_put(self):
+        cache = rendercache.RenderCache(self.dir)
+        key = rendercache.RenderCache.key(source='Hi.', tab_width=4)
+        self.assertNotEqual(key, rendercache.RenderCache.key(source='Hi.', tab_width=8))
+        self.assertEqual(cache.get('post.rst', key), None)
+
+        cache.put('post.rst', key, {'body': '<p>Hi.</p>'}, {'title': 'Hi'}, {'image': {}})
+
+        # From disk, not just memory
+        entry = rendercache.RenderCache(self.dir).get('post.rst', key)
+        self.assertEqual(entry['parts']['body'], '<p>Hi.</p>')
+        self.assertEqual(entry['fields'], {'title': 'Hi'})
+        self.assertEqual(cache.get('post.rst', 'some other key'), None)
+
+        document = rendercache.CachedDocument(bibliographic_fields=entry['fields'])
+        self.assertEqual(document.settings.bibliographic_fields['title'], 'Hi')
@@ -1,4 +1,5 @@
-from rst2wp import nodes
+from rst2wp import nodes, validity
+import threading
 from unittest import mock
 from rst2wp.lib import wordpresslib
 try:
@@ -74,3 +75,26 @@ This is a test.'''
         wordpress_instance.has_tag.asssert_called_with("tag1")
         wordpress_instance.has_tag.asssert_called_with("tag2")
         assert not raw_input.called
+
+    @mock.patch('rst2wp.validity.input')
+    def test_validity_shared_by_threads(self, raw_input):
+        wordpress_instance = mock.Mock(wordpresslib.WordPressClient)
+        categories = set()
+        wordpress_instance.has_category.side_effect = lambda name: name in categories
+        wordpress_instance.new_category.side_effect = lambda c: categories.add(c.name)
+        wordpress_instance.has_tag.return_value = False
+        # Make the first thread's questions slow, so the second has to wait
+        raw_input.side_effect = lambda prompt: threading.Event().wait(0.05) and ''
+
+        def verify():
+            validity.Validity.verify_categories(wordpress_instance, ['new category'])
+            validity.Validity.verify_tags(wordpress_instance, ['new tag'])
+        threads = [threading.Thread(target=verify) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(wordpress_instance.new_category.call_count, 1)
+        # Confirm, slug, description and parent for the category; confirm for the tag
+        self.assertEqual(raw_input.call_count, 5)
@@ -0,0 +1,113 @@
+from rst2wp import configstore
+from rst2wp import mediaindex
+from rst2wp import sqlitestore
+import os
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest  # and hope for the best
+
+POSTS = '''[post posts/hello.rst]
+id = 12
+saved_as = http://blog/?p=12
+
+[post posts/other.rst]
+id = 13
+'''
+
+IMAGES = '''[image http://example.com/a%20b.jpg]
+uploaded = http://blog/a-b.jpg
+uploaded-scaled = http://blog/a-b-1.jpg
+
+[upload /tmp/file.odf]
+uploaded = http://blog/file.odf
+'''
+
+MEDIA = '''[media http://blog/xmlrpc.php 1 abc123]
+url = http://blog/a-b.jpg
+'''
+
+
+class TestSqliteStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.dir.name, 'metadata.sqlite')
+        self.store = sqlitestore.SqliteStore(self.filename)
+
+    def tearDown(self):
+        self.store.close()
+        self.dir.cleanup()
+
+    def reopen(self):
+        self.store.close()
+        self.store = sqlitestore.SqliteStore(self.filename)
+
+    def test_commit(self):
+        self.store.set_post('hello.rst', 'id', '12')
+        self.store.set_directive('image', 'http://example.com/a.jpg', 'uploaded', 'http://blog/a.jpg')
+        self.assertEqual(self.store.get_post('hello.rst', 'id'), '12')
+        self.assertEqual(self.store.get_post('hello.rst', 'saved_as'), None)
+        self.assertEqual(self.store.get_directive('image', 'http://example.com/a.jpg', 'uploaded'),
+                         'http://blog/a.jpg')
+
+        self.store.commit()
+        self.reopen()
+        self.assertEqual(self.store.get_post('hello.rst', 'id'), '12')
+        self.assertEqual(self.store.uploaded_urls(), ['http://blog/a.jpg'])
+
+    def test_uncommitted_changes_are_lost(self):
+        self.store.set_post('hello.rst', 'id', '12')
+        self.store._db.rollback()
+        self.reopen()
+        self.assertEqual(self.store.get_post('hello.rst', 'id'), None)
+
+    def test_directive_items(self):
+        self.store.set_directive('image', 'http://example.com/a.jpg', 'uploaded', 'http://blog/a.jpg')
+        self.store.set_directive('image', 'http://example.com/a.jpg', 'saved_as', 'a.jpg')
+        self.store.set_directive('image', 'http://example.com/b.jpg', 'uploaded', 'http://blog/b.jpg')
+        self.assertEqual(self.store.directive_items('image', 'http://example.com/a.jpg'),
+                         [('saved_as', 'a.jpg'), ('uploaded', 'http://blog/a.jpg')])
+        self.assertEqual(self.store.directive_items('upload', 'http://example.com/a.jpg'), [])
+
+    def test_media_index(self):
+        index = sqlitestore.SqliteMediaIndex(self.store, 'http://blog/xmlrpc.php', 1)
+        self.assertIsInstance(index, mediaindex.MediaIndex)
+        index.record('abc123', 'http://blog/a.jpg')
+        self.reopen()
+
+        index = sqlitestore.SqliteMediaIndex(self.store, 'http://blog/xmlrpc.php', 1)
+        self.assertEqual(index.get('abc123'), 'http://blog/a.jpg')
+        other = sqlitestore.SqliteMediaIndex(self.store, 'http://blog/xmlrpc.php', 2)
+        self.assertEqual(other.get('abc123'), None)
+
+    def test_import_dotrc(self):
+        files = {}
+        for name, text in [('posts', POSTS), ('images', IMAGES), ('media', MEDIA)]:
+            files[name] = os.path.join(self.dir.name, name)
+            with open(files[name], 'w') as f:
+                f.write(text)
+        config = configstore.ConfigStore()
+
+        counts = self.store.import_dotrc(config.sections(files['posts']),
+                                         config.sections(files['images']),
+                                         config.sections(files['media']))
+        self.assertEqual(counts, (2, 2, 1))
+        self.reopen()
+
+        self.assertEqual(self.store.get_post('posts/hello.rst', 'saved_as'), 'http://blog/?p=12')
+        self.assertEqual(self.store.get_post('posts/other.rst', 'id'), '13')
+        self.assertEqual(self.store.get_directive('image', 'http://example.com/a%20b.jpg', 'uploaded-scaled'),
+                         'http://blog/a-b-1.jpg')
+        self.assertEqual(self.store.get_directive('upload', '/tmp/file.odf', 'uploaded'),
+                         'http://blog/file.odf')
+        index = sqlitestore.SqliteMediaIndex(self.store, 'http://blog/xmlrpc.php', 1)
+        self.assertEqual(index.get('abc123'), 'http://blog/a-b.jpg')
+
+        # Again, with nothing new
+        self.assertEqual(self.store.import_dotrc(config.sections(files['posts']), [], []),
+                         (2, 0, 0))
+        self.assertEqual(self.store.get_post('posts/hello.rst', 'id'), '12')
+
+if __name__ == '__main__':
+    unittest.main()
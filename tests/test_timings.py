@@ -0,0 +1,71 @@
+from rst2wp import timings
+import json
+import os
+import tempfile
+import threading
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest  # and hope for the best
+
+
+class TestTimings(unittest.TestCase):
+    def setUp(self):
+        self.timings = timings.Timings()
+
+    def test_bytes_counted_in_enclosing_spans(self):
+        with self.timings.span('publish', filename='post.rst'):
+            with self.timings.span('editPost', 'rpc'):
+                self.timings.rpc('metaWeblog.editPost', 0, 0.1, 100, 20)
+            self.timings.rpc('wp.getTerms', 0, 0.1, 5, 1000)
+        # Another thread's calls aren't part of those spans
+        thread = threading.Thread(target=self.timings.rpc, args=('wp.getOptions', 0, 0.1, 1, 1))
+        thread.start()
+        thread.join()
+
+        spans = dict((span.name, span) for span in self.timings.spans)
+        self.assertEqual(spans['publish'].args, {'filename': 'post.rst', 'sent': 105, 'received': 1020})
+        self.assertEqual(spans['editPost'].args, {'sent': 100, 'received': 20})
+        self.assertEqual(spans['editPost'].category, 'rpc')
+        self.assertNotEqual(spans['wp.getOptions'].thread, spans['publish'].thread)
+
+    def test_summary(self):
+        for i in range(3):
+            with self.timings.span('render'):
+                pass
+        self.timings.rpc('wp.getTerms', 0, 0.5, 5, 1000)
+        self.assertEqual(self.timings.totals()[('stage', 'render')][0], 3)
+        self.assertEqual(self.timings.totals()[('xmlrpc', 'wp.getTerms')], [1, 0.5, 0.5, 5, 1000])
+
+        lines = self.timings.summary().splitlines()
+        self.assertEqual(lines[0].split(), ['kind', 'name', 'count', 'total', 'longest', 'sent', 'received'])
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[2].split()[:3], ['stage', 'render', '3'])
+
+    def test_chrome_trace(self):
+        with self.timings.span('connect'):
+            self.timings.rpc('wp.getUsersBlogs', self.timings.origin + 0.001, 0.002, 10, 20)
+
+        with tempfile.TemporaryDirectory() as dir:
+            filename = os.path.join(dir, 'trace.json')
+            self.timings.write_trace(filename)
+            with open(filename) as f:
+                trace = json.load(f)
+
+        events = trace['traceEvents']
+        connect, call, thread = events
+        self.assertEqual((connect['name'], connect['ph'], connect['cat']), ('connect', 'X', 'stage'))
+        self.assertEqual(call['ts'], 1000)
+        self.assertEqual(call['dur'], 2000)
+        self.assertEqual(call['args'], {'sent': 10, 'received': 20})
+        self.assertEqual(connect['tid'], call['tid'])
+        self.assertEqual(thread, {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(),
+                                  'tid': call['tid'], 'args': {'name': threading.current_thread().name}})
+
+    def test_disabled(self):
+        with timings.DISABLED.span('render'):
+            timings.DISABLED.rpc('wp.getTerms', 0, 0.1, 5, 1000)
+        self.assertEqual(timings.DISABLED.spans, [])
+
+if __name__ == '__main__':
+    unittest.main()
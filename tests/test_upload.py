@@ -1,4 +1,10 @@
 from rst2wp import upload
+from rst2wp.lib import wordpresslib
+from rst2wp import mediaindex
+from rst2wp import filetypes
+import io
+import os
+import tempfile
 from unittest import mock
 try:
     import unittest2 as unittest
@@ -6,8 +12,8 @@ except ImportError:
     import unittest  # and hope for the best
 
 class TestUpload(unittest.TestCase):
-    def create_directive(self, filename, **kwargs):
-        self.state_machine = mock.Mock()
+    def create_directive(self, filename, state_machine=None, **kwargs):
+        self.state_machine = state_machine or mock.Mock()
         self.up = upload.UploadDirective('upload', [filename], {}, None, 'lineno', 'content_offset', '.. upload::', 'state', self.state_machine)
 
     def mock_run(self):
@@ -40,3 +46,98 @@ class TestUpload(unittest.TestCase):
 
         output = self.mock_run()
         self.assertFalse(self.state_machine.document.settings.wordpress_instance.upload_file.called)
+
+    def test_same_contents_uploaded_once(self):
+        with tempfile.TemporaryDirectory() as dir:
+            state_machine = mock.Mock()
+            settings = state_machine.document.settings
+            settings.wordpress_instance.upload_file.return_value = 'http://example.com/file.odf'
+            settings.media_index = mediaindex.MediaIndex(os.path.join(dir, 'media'),
+                                                         'http://example.com/xmlrpc.php', 1)
+
+            with mock.patch('rst2wp.directive.digest_file') as digest_file:
+                digest_file.return_value = 'abc123'
+                self.create_directive('/path/to/file.odf', state_machine)
+                self.mock_run()
+                self.create_directive('/elsewhere/file.odf', state_machine)
+                self.mock_run()
+
+            self.assertEqual(settings.wordpress_instance.upload_file.call_count, 1)
+            self.assertEqual(self.up.new_url, 'http://example.com/file.odf')
+
+            # Already written, in case we die before the post is saved
+            again = mediaindex.MediaIndex(os.path.join(dir, 'media'),
+                                          'http://example.com/xmlrpc.php', 1)
+            self.assertEqual(again.get('abc123'), 'http://example.com/file.odf')
+
+            # Another blog doesn't get to share it
+            other = mediaindex.MediaIndex(os.path.join(dir, 'media'),
+                                          'http://example.com/xmlrpc.php', 2)
+            self.assertEqual(other.get('abc123'), None)
+
+
+class TestMediaIndex(unittest.TestCase):
+    def test_rebuild(self):
+        contents = {'http://example.com/a.jpg': b'a', 'http://example.com/b.jpg': b'b'}
+        def urlopen(url):
+            if url not in contents:
+                raise IOError('404')
+            return io.BytesIO(contents[url])
+
+        with tempfile.TemporaryDirectory() as dir:
+            filename = os.path.join(dir, 'media')
+            index = mediaindex.MediaIndex(filename, 'http://example.com/xmlrpc.php', 1)
+            count = index.rebuild(['http://example.com/a.jpg', 'http://example.com/gone.jpg',
+                                   'http://example.com/b.jpg'], urlopen=urlopen)
+            self.assertEqual(count, 2)
+
+            index = mediaindex.MediaIndex(filename, 'http://example.com/xmlrpc.php', 1)
+            self.assertEqual(index.get(mediaindex.digest_stream(io.BytesIO(b'b'))),
+                             'http://example.com/b.jpg')
+
+
+class TestTypeDetector(unittest.TestCase):
+    def test_loaded_once(self):
+        detector = filetypes.TypeDetector()
+        with tempfile.TemporaryDirectory() as dir:
+            filenames = []
+            for i in range(5):
+                filenames.append(os.path.join(dir, 'notes{0}.txt'.format(i)))
+                with open(filenames[-1], 'w') as f:
+                    f.write('Hello\n')
+
+            with mock.patch('magic.open', wraps=filetypes.magic.open) as magic_open:
+                for filename in filenames * 3:
+                    self.assertIn('text', detector.describe(filename))
+            self.assertEqual(magic_open.call_count, 1)
+
+    def test_changed_file(self):
+        detector = filetypes.TypeDetector()
+        with tempfile.TemporaryDirectory() as dir:
+            filename = os.path.join(dir, 'file')
+            with open(filename, 'w') as f:
+                f.write('Hello\n')
+            self.assertEqual(detector.mime_type(filename), 'text/plain')
+
+            with open(filename, 'wb') as f:
+                f.write(b'%PDF-1.4\n' + b'\0' * 100)
+            os.utime(filename, (1000, 1000))
+            self.assertEqual(detector.mime_type(filename), 'application/pdf')
+
+    def test_mime_type(self):
+        detector = filetypes.TypeDetector()
+        with tempfile.TemporaryDirectory() as dir:
+            # The extension wins, since that's what WordPress goes by
+            filename = os.path.join(dir, 'post.rst')
+            with open(filename, 'wb') as f:
+                f.write(b'%PDF-1.4\n')
+            self.assertEqual(detector.mime_type(filename), 'text/plain')
+
+            wp = wordpresslib.WordPressClient('http://example.com/xmlrpc.php', 'joe', 'secret')
+            wp.guess_mime_type = detector.mime_type
+            with mock.patch.object(wp, '_send_request') as send_request:
+                send_request.return_value = {'url': 'http://example.com/post.rst'}
+                wp.upload_file(filename)
+            request = send_request.call_args[0][0]
+            self.assertIn(b'<string>text/plain</string>', request.tail)
+
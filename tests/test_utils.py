@@ -0,0 +1,43 @@
+import random
+import re
+from rst2wp import utils
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest  # and hope for the best
+
+def quadratic_replace_newlines(txt):
+    '''replace_newlines as it was before it was made linear.'''
+    start = 0
+    pre = re.compile("<pre( [^>]*)?>")
+    end_pre = re.compile("</pre>")
+    while True:
+        m = pre.search(txt, start)
+        if not m: break
+        txt = (txt[:start] +
+               txt[start:m.start()].replace('\n', ' ') +
+               txt[m.start():])
+        m = end_pre.search(txt, start)
+        if not m: break
+        start = m.end()
+
+    txt = txt[:start] + txt[start:].replace('\n', ' ')
+    return txt
+
+class TestReplaceNewlines(unittest.TestCase):
+    def test_examples(self):
+        self.assertEqual(utils.replace_newlines('a\nb\n'), 'a b ')
+        self.assertEqual(utils.replace_newlines('<p>a\nb</p>\n<pre class="code">x\ny\n</pre>\n<p>c\n</p>'),
+                         '<p>a b</p> <pre class="code">x\ny\n</pre> <p>c </p>')
+        self.assertEqual(utils.replace_newlines('<pre>x\ny</pre>\n<pre>z\n'),
+                         '<pre>x\ny</pre> <pre>z ')
+        # Not a <pre>
+        self.assertEqual(utils.replace_newlines('<preface>\n</preface>'), '<preface> </preface>')
+
+    def test_same_as_before(self):
+        pieces = ['<pre>', '</pre>', '<pre class="x">', '<pre\n>', '<pre\nclass="y">',
+                  '\n', 'a', ' ', '<pre', '>', '</pre', 'pre>']
+        rng = random.Random(1234)
+        for i in range(20000):
+            txt = ''.join(rng.choice(pieces) for j in range(rng.randint(0, 16)))
+            self.assertEqual(utils.replace_newlines(txt), quadratic_replace_newlines(txt), repr(txt))
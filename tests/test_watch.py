@@ -0,0 +1,179 @@
+from rst2wp import editbuffer, manifest, rst2wp, utils, watch
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest  # and hope for the best
+
+
+class WatcherTests(object):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        os.mkdir(os.path.join(self.dir, 'uploads'))
+        self.write('old.rst', 'Old post\n')
+        self.watcher = self.create_watcher([self.dir])
+
+    def tearDown(self):
+        self.watcher.close()
+        self.tmp.cleanup()
+
+    def write(self, name, text):
+        filename = os.path.join(self.dir, name)
+        utils.atomic_write(filename, text)
+        return filename
+
+    def test_changed_posts(self):
+        self.assertEqual(self.watcher.posts(), [os.path.join(self.dir, 'old.rst')])
+        self.assertEqual(self.watcher.wait(0.2), set())
+
+        # Make sure the new mtime is a different one
+        time.sleep(0.01)
+        old = self.write('old.rst', 'Old post, edited\n')
+        new = self.write('new.rst', 'New post\n')
+        self.write('notes.txt', 'Not a post\n')
+        self.write('.new.rst', 'An editor\'s backup\n')
+        self.write(os.path.join('uploads', 'upload.rst'), 'Downloaded\n')
+        changed = self.watcher.wait(2)
+        changed |= self.watcher.wait(0.2)
+        self.assertEqual(changed, set([old, new]))
+
+    def test_new_directory(self):
+        os.makedirs(os.path.join(self.dir, 'drafts', '2020'))
+        self.watcher.wait(0.2)
+        post = self.write(os.path.join('drafts', '2020', 'post.rst'), 'Draft\n')
+        changed = self.watcher.wait(2)
+        changed |= self.watcher.wait(0.2)
+        self.assertEqual(changed, set([post]))
+
+    def test_debounce(self):
+        def edit():
+            for i in range(5):
+                self.write('post{0}.rst'.format(i % 2), 'Edit {0}\n'.format(i))
+                time.sleep(0.1)
+        thread = threading.Thread(target=edit)
+        thread.start()
+        batches = self.watcher.batches(debounce=0.3)
+        self.assertEqual(next(batches), [os.path.join(self.dir, 'post0.rst'),
+                                         os.path.join(self.dir, 'post1.rst')])
+        thread.join()
+
+
+class TestPollingWatcher(WatcherTests, unittest.TestCase):
+    def create_watcher(self, tops):
+        return watch.PollingWatcher(tops, interval=0.05)
+
+
+class TestInotifyWatcher(WatcherTests, unittest.TestCase):
+    def create_watcher(self, tops):
+        try:
+            return watch.InotifyWatcher(tops)
+        except (OSError, AttributeError, TypeError):
+            self.skipTest("no inotify here")
+
+
+class FakeWatcher(object):
+    def __init__(self, filename, edits):
+        self.filename = filename
+        self.edits = edits
+
+    def posts(self):
+        return [self.filename]
+
+    def batches(self, debounce):
+        for edit in self.edits:
+            edit()
+            yield [self.filename]
+
+    def close(self):
+        pass
+
+
+class TestRunWatch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, 'post.rst')
+        utils.atomic_write(self.filename, ':title: Post\n\nFirst\n')
+        self.app = rst2wp.Rst2Wp()
+        self.app.watch = [self.tmp.name]
+        self.app.manifest = mock.Mock(manifest.Manifest)
+        self.app.media_index = None
+        self.published = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_batch(self, filenames):
+        '''Like publishing, gives the post an id.'''
+        self.published.append(filenames)
+        for filename in filenames:
+            with open(filename) as f:
+                text = f.read()
+            if ':id:' not in text:
+                text = ':id: 1\n' + text
+                utils.atomic_write(filename, text)
+                self.app.write_backs[filename] = text
+
+    def edit(self, text):
+        return lambda: utils.atomic_write(self.filename, text)
+
+    def test_own_writes_ignored(self):
+        edits = [
+            self.edit(':title: Post\n\nFirst\n'),                 # saved without changes
+            self.edit(':title: Post\n\nSecond\n'),
+            lambda: None,                                         # our own write-back
+            self.edit(':id: 1\n:title: Post\n\nThird\n'),
+            lambda: os.unlink(self.filename),
+            ]
+        watcher = FakeWatcher(self.filename, edits)
+        with mock.patch('rst2wp.watch.create_watcher', return_value=watcher), \
+             mock.patch.object(rst2wp.Rst2Wp, 'watch_debounce', 0), \
+             mock.patch.object(self.app, 'run_batch', self.run_batch):
+            self.app.run_watch()
+
+        self.assertEqual(self.published, [[self.filename], [self.filename]])
+        self.assertEqual(self.app.manifest.flush.call_count, 2)
+
+
+class TestWriteBack(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.app = rst2wp.Rst2Wp()
+        self.app.filename = os.path.join(self.tmp.name, 'post.rst')
+        self.app.text = ':title: Post\n\nFirst\n'
+        utils.atomic_write(self.app.filename, self.app.text)
+        self.app.edits = editbuffer.EditBuffer(self.app.text)
+        self.app.edits.set_field('id', '1')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def save(self):
+        with mock.patch.object(self.app, 'should_save_file', return_value=True):
+            self.app._save_post_updated()
+        with open(self.app.filename) as f:
+            return f.read()
+
+    def test_write_back(self):
+        self.assertEqual(self.save(), ':title: Post\n:id: 1\n\nFirst\n')
+        self.assertEqual(self.app.write_backs, {self.app.filename: ':title: Post\n:id: 1\n\nFirst\n'})
+
+    def test_changed_while_publishing(self):
+        utils.atomic_write(self.app.filename, ':title: Post\n\nSecond\n')
+        self.assertEqual(self.save(), ':title: Post\n:id: 1\n\nSecond\n')
+        # Not published yet, so --watch mustn't take it for ours
+        self.assertEqual(self.app.write_backs, {})
+
+    def test_removed_while_publishing(self):
+        os.unlink(self.app.filename)
+        with mock.patch.object(self.app, 'should_save_file', return_value=True):
+            self.app._save_post_updated()
+        self.assertFalse(os.path.exists(self.app.filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
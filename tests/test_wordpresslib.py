@@ -0,0 +1,266 @@
+import concurrent.futures
+import gzip
+import http.server
+import os
+import tempfile
+import threading
+import xmlrpc.client
+from unittest import mock
+from rst2wp.lib import wordpresslib
+from rst2wp import timings
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest  # and hope for the best
+
+def term(id, name, slug=None):
+    return {'term_id': str(id), 'name': name, 'slug': slug or name.lower(),
+            'count': '0', 'description': '', 'parent': '0'}
+
+class TestTerms(unittest.TestCase):
+    def setUp(self):
+        self.wp = wordpresslib.WordPressClient('http://example.com/xmlrpc.php', 'joe', 'secret')
+        self.server = self.wp._server = mock.Mock()
+        self.server.wp.getTerms.side_effect = lambda blog, user, password, taxonomy, filter: {
+            'post_tag': [term(1, 'Python'), term(2, 'docutils'), term(3, 'python', 'python-2')],
+            'category': [term(10, 'Uncategorized')],
+            }[taxonomy]
+
+    def test_tag_lookups(self):
+        self.assertTrue(self.wp.has_tag('docutils'))
+        self.assertFalse(self.wp.has_tag('Docutils'))
+        self.assertEqual(self.wp.get_tag('Python').id, 1)
+        self.assertEqual(self.wp.get_tag_id_from_name('python'), 3)
+        self.assertEqual(self.wp.find_tag('PYTHON', ignore_case=True).id, 1)
+        self.assertEqual(self.wp.find_tag(slug='python-2').name, 'python')
+        self.assertEqual(self.wp.find_tag(id='2').name, 'docutils')
+        self.assertEqual(self.wp.get_category_id_from_name('Uncategorized'), 10)
+        self.assertEqual(self.server.wp.getTerms.call_count, 2)
+
+    def test_index_follows_list(self):
+        self.assertFalse(self.wp.has_tag('new'))
+        self.wp.tags.append(wordpresslib.WordPressTag(id=4, name='new'))
+        self.assertTrue(self.wp.has_tag('new'))
+
+        self.wp.tags = [wordpresslib.WordPressTag(id=5, name='other')]
+        self.assertFalse(self.wp.has_tag('docutils'))
+        self.assertEqual(self.wp.get_tag_id_from_name('other'), 5)
+
+    def test_learn_new_tags(self):
+        self.wp.get_tags()
+        self.server.wp.getTerms.side_effect = lambda *args: [term(7, 'brand new'), term(8, 'brand new-ish')]
+        tag = wordpresslib.WordPressTag(name='brand new')
+
+        self.wp._learn_new_tags([self.wp.get_tag('Python'), tag])
+
+        self.assertEqual(tag.id, 7)
+        self.assertEqual(self.wp.get_tag_id_from_name('brand new'), 7)
+        self.assertEqual(self.server.wp.getTerms.call_args[0][4]['search'], 'brand new')
+
+    def test_learn_new_tags_unlocked(self):
+        self.wp.get_tags()
+        def search(*args):
+            # Another thread can get at the tags while we wait
+            looked = []
+            thread = threading.Thread(target=lambda: looked.append(self.wp.get_tag('Python')))
+            thread.start()
+            thread.join(5)
+            self.assertEqual(len(looked), 1)
+            # ...and learn about the same tag in the meantime
+            self.wp.tags.append(wordpresslib.WordPressTag.from_xmlrpc(term(7, 'brand new')))
+            return [term(7, 'brand new')]
+        self.server.wp.getTerms.side_effect = search
+
+        self.wp._learn_new_tags([wordpresslib.WordPressTag(name='brand new')])
+        self.assertEqual([t.name for t in self.wp.tags].count('brand new'), 1)
+
+    def test_term_cache(self):
+        term_cache = mock.Mock()
+        term_cache.load.return_value = ([{'id': 9, 'name': 'cached', 'slug': 'cached',
+                                          'description': '', 'count': 1,
+                                          'html_url': None, 'rss_url': None}], 1000)
+        self.wp.term_cache = term_cache
+
+        self.assertEqual(self.wp.get_tag_id_from_name('cached'), 9)
+        self.assertFalse(self.server.wp.getTerms.called)
+
+        term_cache.load.return_value = None
+        self.wp.get_categories()
+        self.assertEqual(term_cache.save.call_args[0][2], 'category')
+
+        # WordPress sends the id as a string
+        self.server.wp.newCategory.return_value = '11'
+        self.wp.new_category(wordpresslib.WordPressCategory(name='Fresh'))
+        self.assertEqual(self.wp.get_category_id_from_name('Fresh'), 11)
+        self.assertEqual([c.name for c in term_cache.save.call_args[0][3]],
+                         ['Uncategorized', 'Fresh'])
+
+    def post(self, id):
+        return {'postid': str(id), 'title': 'Post', 'description': '', 'permaLink': '', 'link': '',
+                'mt_excerpt': '', 'userid': '1', 'date_created_gmt': '20200101T00:00:00',
+                'dateCreated': '20200101T00:00:00', 'mt_text_more': '', 'mt_allow_comments': 1,
+                'mt_allow_pings': 1, 'categories': ['Uncategorized']}
+
+    def test_prefetch(self):
+        self.server.system.multicall.return_value = [
+            [{'software_version': {'value': '6.0'}}],
+            [{'userid': '7', 'firstname': '', 'lastname': '', 'nickname': 'joe'}],
+            [[term(1, 'Python')]],
+            [[term(10, 'Uncategorized')]],
+            [self.post(5)],
+            {'faultCode': 404, 'faultString': 'no such post'},
+            ]
+        self.wp.prefetch(options=True, user_info=True, tags=True, categories=True, posts=[5, 6])
+
+        calls = self.server.system.multicall.call_args[0][0]
+        self.assertEqual([call['methodName'] for call in calls],
+                         ['wp.getOptions', 'blogger.getUserInfo', 'wp.getTerms', 'wp.getTerms',
+                          'metaWeblog.getPost', 'metaWeblog.getPost'])
+
+        self.assertEqual(self.wp.get_options(), {'software_version': {'value': '6.0'}})
+        self.assertEqual(self.wp.get_user_info().id, '7')
+        self.assertEqual(self.wp.get_tag('Python').id, 1)
+        self.assertEqual(self.wp.get_category('Uncategorized').id, 10)
+        self.assertEqual(self.wp.get_post(5).id, 5)
+        self.assertFalse(self.server.wp.getTerms.called)
+        self.assertFalse(self.server.metaWeblog.getPost.called)
+
+        # The failed one is fetched (and fails) when it's asked for
+        self.server.metaWeblog.getPost.side_effect = xmlrpc.client.Fault(404, 'no such post')
+        self.assertRaises(wordpresslib.WordPressException, self.wp.get_post, 6)
+
+    def test_prefetch_without_multicall(self):
+        self.server.system.multicall.side_effect = xmlrpc.client.Fault(
+            -32601, 'server error. requested method system.multicall does not exist.')
+        self.server.metaWeblog.getPost.return_value = self.post(5)
+        self.server.blogger.getUserInfo.return_value = {'userid': '7', 'firstname': '', 'lastname': '', 'nickname': 'joe'}
+        self.wp.prefetch(tags=True, categories=True, posts=[5])
+        self.wp.prefetch(options=True, user_info=True)
+
+        self.assertEqual(self.server.system.multicall.call_count, 1)
+        self.assertEqual(self.server.wp.getTerms.call_count, 2)
+        self.assertEqual(self.wp.get_post(5).id, 5)
+        self.assertEqual(self.server.metaWeblog.getPost.call_count, 1)
+        self.assertTrue(self.server.wp.getOptions.called)
+        self.assertTrue(self.server.blogger.getUserInfo.called)
+
+
+class TestStreamingRequest(unittest.TestCase):
+    def check_roundtrip(self, contents, chunk_size):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(contents)
+            f.flush()
+            struct = {'name': 'caf\xe9 & co.jpg',
+                      'bits': wordpresslib.StreamingRequest.FILE_PLACEHOLDER}
+            request = wordpresslib.StreamingRequest('metaWeblog.newMediaObject',
+                                                    (1, 'joe', 'secret', struct),
+                                                    f.name, chunk_size=chunk_size)
+            chunks = list(request)
+
+        body = b''.join(chunks)
+        self.assertEqual(len(body), len(request))
+        self.assertTrue(max(len(c) for c in chunks[1:-1] or [b'']) <= 4 * chunk_size // 3 + 4)
+
+        params, method = xmlrpc.client.loads(body)
+        self.assertEqual(method, 'metaWeblog.newMediaObject')
+        self.assertEqual(params[:3], (1, 'joe', 'secret'))
+        self.assertEqual(params[3]['name'], 'caf\xe9 & co.jpg')
+        self.assertEqual(params[3]['bits'].data, contents)
+
+    def test_roundtrip(self):
+        for size in [0, 1, 2, 3, 100, 1000, 4097]:
+            self.check_roundtrip(os.urandom(size), chunk_size=30)
+        self.check_roundtrip(os.urandom(100000), chunk_size=3*64*1024)
+
+    def test_upload_file(self):
+        wp = wordpresslib.WordPressClient('http://example.com/blog/xmlrpc.php', 'joe', 'secret')
+        transport = mock.Mock()
+        transport.request.return_value = ({'url': 'http://example.com/uploads/test.txt'},)
+        wp.transport = transport
+
+        with tempfile.NamedTemporaryFile(suffix='.txt') as f:
+            f.write(b'hello world')
+            f.flush()
+            self.assertEqual(wp.upload_file(f.name), 'http://example.com/uploads/test.txt')
+
+        host, handler, request = transport.request.call_args[0]
+        self.assertEqual((host, handler), ('example.com', '/blog/xmlrpc.php'))
+        self.assertEqual(request.filename, f.name)
+
+
+class EchoHandler(http.server.BaseHTTPRequestHandler):
+    '''Answers every XML-RPC call with its own parameters.'''
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.server.connections.add(self.client_address)
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            self.server.gzipped += 1
+            body = gzip.decompress(body)
+        params, method = xmlrpc.client.loads(body)
+        response = xmlrpc.client.dumps((list(params),), methodresponse=True).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPooledTransport(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), EchoHandler)
+        self.server.daemon_threads = True
+        self.server.connections = set()
+        self.server.gzipped = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{0}/xmlrpc.php'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_reused(self):
+        transport = wordpresslib.PooledTransport(pool_size=3)
+        transport.timings = timings.Timings()
+        wp = wordpresslib.WordPressClient(self.url, 'joe', 'secret', transport=transport)
+        with concurrent.futures.ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda i: wp._server.echo(i), range(50)))
+
+        self.assertEqual(results, [[i] for i in range(50)])
+        self.assertTrue(transport.connections_opened <= 3)
+        self.assertEqual(len(self.server.connections), transport.connections_opened)
+        self.assertEqual(transport.totals.calls, 50)
+        self.assertEqual(set(span.name for span in transport.timings.spans), set(['echo']))
+        self.assertTrue(all(span.args['received'] > 0 for span in transport.timings.spans))
+        self.assertEqual(transport.totals.received,
+                         sum(span.args['received'] for span in transport.timings.spans))
+        transport.close_all()
+
+    def test_gzip(self):
+        transport = wordpresslib.PooledTransport(gzip=True)
+        wp = wordpresslib.WordPressClient(self.url, 'joe', 'secret', transport=transport)
+        self.assertEqual(wp._server.echo('x'), ['x'])
+        self.assertEqual(wp._server.echo('x' * 10000), ['x' * 10000])
+        self.assertEqual(self.server.gzipped, 1)
+        transport.close_all()
+
+    def test_timings(self):
+        transport = wordpresslib.PooledTransport()
+        wp = wordpresslib.WordPressClient(self.url, 'joe', 'secret', transport=transport)
+        wp.timings = transport.timings = timings.Timings()
+        self.assertEqual(wp.get_pingbacks('http://example.com/'), ['http://example.com/'])
+
+        rpc, = [span for span in wp.timings.spans if span.category == 'rpc']
+        request, = [span for span in wp.timings.spans if span.category == 'xmlrpc']
+        self.assertEqual(rpc.name, 'getPingbacks')
+        self.assertEqual(request.name, 'pingback.extensions.getPingbacks')
+        self.assertEqual(transport.totals.calls, 1)
+        self.assertEqual(request.args, {'sent': transport.totals.sent,
+                                        'received': transport.totals.received})
+        self.assertEqual(rpc.args, request.args)
+        self.assertTrue(rpc.start <= request.start and request.seconds <= rpc.seconds)
+        transport.close_all()